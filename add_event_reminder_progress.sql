@@ -0,0 +1,3 @@
+-- Прогресс отправки напоминаний: после перезапуска рассылка продолжается с последнего получателя
+ALTER TABLE posts ADD COLUMN reminder_cursor BIGINT;
+ALTER TABLE posts ADD COLUMN reminder_claimed_at TIMESTAMP;
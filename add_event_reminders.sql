@@ -0,0 +1,6 @@
+-- Напоминания о мероприятиях из избранного
+-- Посты к напоминанию выбираются по диапазону event_at, получатели — по likes.post_id
+ALTER TABLE posts ADD COLUMN reminder_sent_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS ix_posts_event_at ON posts (event_at);
+CREATE INDEX IF NOT EXISTS ix_likes_post_id ON likes (post_id);
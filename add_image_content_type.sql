@@ -0,0 +1,9 @@
+-- Картинки постов адресуются полным ключом объекта (id с расширением)
+-- и хранят Content-Type, поэтому хранилищу не нужно перебирать расширения.
+-- У старых постов image_id остаётся без расширения и ищется как раньше
+ALTER TABLE posts ADD COLUMN image_content_type VARCHAR(100);
+
+-- Бот всегда сохранял картинки с расширением jpg
+UPDATE posts
+SET image_id = image_id || '.jpg', image_content_type = 'image/jpeg'
+WHERE image_id IS NOT NULL AND image_id NOT LIKE '%.%';
@@ -0,0 +1,4 @@
+-- Результаты шардированных отправок для итогов рассылки (задержки, повторы, классы ошибок)
+ALTER TABLE notification_sends ADD COLUMN sent_at TIMESTAMP;
+ALTER TABLE notification_sends ADD COLUMN latency_ms FLOAT;
+ALTER TABLE notification_sends ADD COLUMN error_class VARCHAR(100);
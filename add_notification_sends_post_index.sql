@@ -0,0 +1,2 @@
+-- Отправки шардов удаляются вместе с постом и после итогов рассылки: выборка по post_id
+CREATE INDEX IF NOT EXISTS ix_notification_sends_post_id ON notification_sends (post_id);
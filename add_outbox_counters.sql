@@ -0,0 +1,4 @@
+-- Счётчики доставки для заданий рассылки уведомлений
+-- (итоги рассылки отправляются в группу модерации)
+ALTER TABLE notification_outbox ADD COLUMN sent_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE notification_outbox ADD COLUMN error_count INTEGER NOT NULL DEFAULT 0;
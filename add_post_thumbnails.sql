@@ -0,0 +1,2 @@
+-- Миниатюры картинок постов, создаваемые при обработке изображений
+ALTER TABLE posts ADD COLUMN thumbnail_id VARCHAR(255);
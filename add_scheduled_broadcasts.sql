@@ -0,0 +1,6 @@
+-- Запланированные рассылки (/broadcast_at)
+-- Получатели готовятся заранее и сохраняются в файл audience_path
+ALTER TABLE broadcast_jobs ADD COLUMN scheduled_at TIMESTAMP;
+ALTER TABLE broadcast_jobs ADD COLUMN audience_path VARCHAR(255);
+
+CREATE INDEX IF NOT EXISTS ix_broadcast_jobs_scheduled_at ON broadcast_jobs (scheduled_at);
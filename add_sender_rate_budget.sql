@@ -0,0 +1,4 @@
+-- Общий лимит отправок всех шардов (token bucket в sender_state)
+-- Шарды берут токены из одной строки, поэтому простаивающий шард не занимает долю лимита
+ALTER TABLE sender_state ADD COLUMN tokens FLOAT;
+ALTER TABLE sender_state ADD COLUMN tokens_at TIMESTAMP;
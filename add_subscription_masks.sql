@@ -0,0 +1,40 @@
+-- Битовые маски подписок: бит (ID - 1) отмечает город или категорию.
+-- Поиск получателей и лента используют их вместо соединений с таблицами
+-- user_cities/user_categories/post_cities/post_categories после установки
+-- SUBSCRIPTION_BITMASKS=1. Маски заполняются только если все ID не больше 63.
+ALTER TABLE users ADD COLUMN city_mask BIGINT;
+ALTER TABLE users ADD COLUMN category_mask BIGINT;
+ALTER TABLE posts ADD COLUMN city_mask BIGINT;
+ALTER TABLE posts ADD COLUMN category_mask BIGINT;
+
+UPDATE users SET city_mask = (
+    SELECT CAST(COALESCE(SUM(CAST(1 AS BIGINT) << (uc.city_id - 1)), 0) AS BIGINT)
+    FROM user_cities uc WHERE uc.user_id = users.id
+)
+WHERE NOT EXISTS (
+    SELECT 1 FROM user_cities uc WHERE uc.user_id = users.id AND uc.city_id > 63
+);
+
+UPDATE users SET category_mask = (
+    SELECT CAST(COALESCE(SUM(CAST(1 AS BIGINT) << (uc.category_id - 1)), 0) AS BIGINT)
+    FROM user_categories uc WHERE uc.user_id = users.id
+)
+WHERE NOT EXISTS (
+    SELECT 1 FROM user_categories uc WHERE uc.user_id = users.id AND uc.category_id > 63
+);
+
+UPDATE posts SET city_mask = (
+    SELECT CAST(COALESCE(SUM(CAST(1 AS BIGINT) << (pc.city_id - 1)), 0) AS BIGINT)
+    FROM post_cities pc WHERE pc.post_id = posts.id
+)
+WHERE NOT EXISTS (
+    SELECT 1 FROM post_cities pc WHERE pc.post_id = posts.id AND pc.city_id > 63
+);
+
+UPDATE posts SET category_mask = (
+    SELECT CAST(COALESCE(SUM(CAST(1 AS BIGINT) << (pc.category_id - 1)), 0) AS BIGINT)
+    FROM post_categories pc WHERE pc.post_id = posts.id
+)
+WHERE NOT EXISTS (
+    SELECT 1 FROM post_categories pc WHERE pc.post_id = posts.id AND pc.category_id > 63
+);
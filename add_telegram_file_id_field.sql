@@ -0,0 +1,4 @@
+-- Добавляем поле telegram_file_id к постам
+-- В нём хранится file_id картинки, полученный от Telegram после первой отправки,
+-- чтобы не загружать изображение из хранилища при каждой рассылке
+ALTER TABLE posts ADD COLUMN telegram_file_id VARCHAR(255);
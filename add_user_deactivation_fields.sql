@@ -0,0 +1,8 @@
+-- Отметка недоступных пользователей (заблокировали бота, чат не найден)
+-- Такие пользователи исключаются из уведомлений и рассылок до следующего /start
+ALTER TABLE users ADD COLUMN deactivated_at TIMESTAMP;
+ALTER TABLE users ADD COLUMN deactivation_reason VARCHAR(50);
+
+UPDATE users SET is_active = TRUE WHERE is_active IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_users_is_active ON users (is_active);
@@ -0,0 +1,11 @@
+-- Сегменты рассылок: фильтр по городам, категориям и последней активности
+-- Получатели выбираются одним запросом только по users.id через индексы
+ALTER TABLE users ADD COLUMN last_active_at TIMESTAMP;
+ALTER TABLE broadcast_jobs ADD COLUMN segment JSON;
+
+-- До появления отметок активности считаем ей последнее обновление профиля
+UPDATE users SET last_active_at = updated_at WHERE last_active_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_users_last_active_at ON users (last_active_at);
+CREATE INDEX IF NOT EXISTS ix_user_cities_city_id ON user_cities (city_id, user_id);
+CREATE INDEX IF NOT EXISTS ix_user_categories_category_id ON user_categories (category_id, user_id);
@@ -1,3 +1,12 @@
+# Переменные из .env загружаются до импорта модулей пакета: хранилище файлов,
+# параметры картинок и другие настройки читаются при импорте
+try:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+except ImportError:
+    pass
+
 from .database import (
     # Database models
     Base,
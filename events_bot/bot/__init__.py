@@ -12,7 +12,7 @@ from .keyboards import (
     get_category_selection_keyboard,
 )
 from .states import UserStates, PostStates
-from .middleware import DatabaseMiddleware
+from .middleware import ActivityMiddleware, DatabaseMiddleware, RequestPriorityMiddleware
 
 __all__ = [
     "register_start_handlers",
@@ -28,4 +28,6 @@ __all__ = [
     "UserStates",
     "PostStates",
     "DatabaseMiddleware",
+    "ActivityMiddleware",
+    "RequestPriorityMiddleware",
 ]
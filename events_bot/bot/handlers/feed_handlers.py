@@ -10,7 +10,6 @@ from events_bot.bot.keyboards.feed_keyboard import (
     get_liked_list_keyboard,
     get_liked_post_keyboard,
 )
-from events_bot.storage import file_storage
 import logfire
 from datetime import timezone
 from events_bot.utils import get_clean_category_string
@@ -334,13 +333,14 @@ async def show_post_details(
         logfire.warning(f"Не удалось удалить сообщение при показе деталей: {e}")
 
     try:
-        if post.image_id and (media_photo := await file_storage.get_media_photo(post.image_id)):
-            await callback.message.answer_photo(
-                photo=media_photo.media,
+        if photo := await PostService.get_post_photo(post):
+            sent = await callback.message.answer_photo(
+                photo=photo,
                 caption=text,
                 parse_mode="HTML",
                 reply_markup=keyboard
             )
+            await PostService.remember_telegram_file_id(db, post, sent)
         else:
             await callback.message.answer(
                 text=text,
@@ -405,13 +405,14 @@ async def show_liked_post_details(
         logfire.warning(f"Не удалось удалить сообщение при показе деталей избранного: {e}")
 
     try:
-        if post.image_id and (media_photo := await file_storage.get_media_photo(post.image_id)):
-            await callback.message.answer_photo(
-                photo=media_photo.media,
+        if photo := await PostService.get_post_photo(post):
+            sent = await callback.message.answer_photo(
+                photo=photo,
                 caption=text,
                 parse_mode="HTML",
                 reply_markup=keyboard
             )
+            await PostService.remember_telegram_file_id(db, post, sent)
         else:
             await callback.message.answer(
                 text=text,
@@ -15,8 +15,17 @@ from events_bot.bot.keyboards import (
     get_main_keyboard,
 )
 from events_bot.bot.states.moderation_states import ModerationStates
+from events_bot.bot.middleware import RequestPriorityMiddleware
+from events_bot.bot.request_scheduler import RequestPriority
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from events_bot.workers import NotificationOutboxWorkerPool
 
 router = Router()
+# Ответы модераторам идут в своём классе, не конкурируя с рассылками
+router.message.middleware(RequestPriorityMiddleware(RequestPriority.MODERATION))
+router.callback_query.middleware(RequestPriorityMiddleware(RequestPriority.MODERATION))
 
 
 def register_moderation_handlers(dp: Router):
@@ -127,7 +136,12 @@ async def refresh_moderation_queue(callback: CallbackQuery, db):
 
 
 @router.callback_query(F.data.startswith("moderate_"))
-async def process_moderation_action(callback: CallbackQuery, state: FSMContext, db):
+async def process_moderation_action(
+    callback: CallbackQuery,
+    state: FSMContext,
+    db,
+    notification_pool: "NotificationOutboxWorkerPool | None" = None,
+):
     """Обработка действий модерации"""
     data = callback.data.split("_")
     action = data[1]
@@ -139,14 +153,15 @@ async def process_moderation_action(callback: CallbackQuery, state: FSMContext,
         post = await PostService.approve_post(db, post_id, callback.from_user.id)
         if post:
             post = await PostService.publish_post(db, post_id)
-            await db.refresh(post, attribute_names=["author", "categories", "cities"])
             logfire.info(f"Пост {post_id} одобрен и опубликован модератором {callback.from_user.id}")
             
-            users_to_notify = await NotificationService.get_users_to_notify(db, post)
-            logfire.info(f"Отправляем уведомления {len(users_to_notify)} пользователям")
-            await NotificationService.send_post_notification(
-                bot=callback.bot, post=post, users=users_to_notify, db=db
-            )
+            # Рассылку выполняют обработчики очереди уведомлений
+            await NotificationService.enqueue_post_notification(db, post.id)
+            if notification_pool:
+                notification_pool.notify()
+            # Отвечаем, когда задание рассылки поставлено: сама рассылка идёт
+            # в фоне, итоги придут в группу модерации
+            await callback.answer("Мероприятие одобрено, рассылка запущена 🤟😌")
             try:
                 await callback.bot.send_message(
                     chat_id=post.author_id,
@@ -154,11 +169,11 @@ async def process_moderation_action(callback: CallbackQuery, state: FSMContext,
                 )
             except Exception as e:
                 logfire.warning(f"Не удалось уведомить автора {post.author_id}: {e}")
-
-            await callback.answer("Ваше мероприятие одобрено и опубликовано 🤟😌")
         else:
             logfire.error(f"Ошибка при одобрении поста {post_id}")
-            await callback.answer("❌ Ошибка при одобрении поста")
+            await callback.answer()
+            await callback.message.answer(f"❌ Ошибка при одобрении поста {post_id}")
+            return
 
     elif action == "reject":
         # ✅ Возвращаем ввод комментария при отклонении
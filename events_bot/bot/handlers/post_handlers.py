@@ -370,11 +370,15 @@ async def process_post_image(message: Message, state: FSMContext, db):
         return
 
     photo = message.photo[-1]
-    file_info = await message.bot.get_file(photo.file_id)
-    file_data = await message.bot.download_file(file_info.file_path)
-    file_id = await file_storage.save_file(file_data.read(), "jpg")
-
-    await state.update_data(image_id=file_id)
+    stored_file = await file_storage.save_telegram_photo(message.bot, photo.file_id, "jpg")
+    await PostService.register_uploaded_media(db, [stored_file.key, stored_file.thumbnail_key])
+
+    await state.update_data(
+        image_id=stored_file.key,
+        image_content_type=stored_file.content_type,
+        thumbnail_id=stored_file.thumbnail_key,
+        image_telegram_file_id=photo.file_id,
+    )
     await continue_post_creation(message, state, db)
 
 
@@ -397,6 +401,9 @@ async def continue_post_creation(callback_or_message: Union[Message, CallbackQue
     category_ids = data.get("category_ids", [])
     post_city_names = data.get("post_city_names", [])
     image_id = data.get("image_id")
+    image_content_type = data.get("image_content_type")
+    thumbnail_id = data.get("thumbnail_id")
+    image_telegram_file_id = data.get("image_telegram_file_id")
     event_at_iso = data.get("event_at")
     url = data.get("url")
     address = data.get("address")
@@ -421,6 +428,9 @@ async def continue_post_creation(callback_or_message: Union[Message, CallbackQue
         url=url,
         address=address,
         bot=message.bot,
+        image_content_type=image_content_type,
+        thumbnail_id=thumbnail_id,
+        image_telegram_file_id=image_telegram_file_id,
     )
 
     if post:
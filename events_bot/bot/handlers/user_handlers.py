@@ -1,17 +1,20 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from events_bot.database.services import UserService, CategoryService, PostService, LikeService, CityService
+from events_bot.database.services import UserService, CategoryService, PostService, LikeService, CityService, NotificationService, BroadcastService
 from events_bot.bot.states import UserStates
 from events_bot.bot.keyboards import get_main_keyboard, get_category_selection_keyboard, get_city_keyboard
 from events_bot.utils import get_clean_category_string
 from events_bot.bot.keyboards.notification_keyboard import get_post_notification_keyboard
 from events_bot.bot.handlers.feed_handlers import show_liked_page_from_animation, format_liked_list
 from events_bot.bot.keyboards.feed_keyboard import get_liked_list_keyboard
+from events_bot.bot.keyboards.broadcast_keyboard import get_broadcast_control_keyboard
 import logfire
 import os
-import asyncio
-from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from events_bot.workers import BroadcastWorker
 
 LIKED_GIF_ID = os.getenv("LIKED_GIF_ID")
 POSTS_PER_PAGE = 5
@@ -180,11 +183,26 @@ async def cmd_delete_user(message: Message, db):
 
 # НОВАЯ КОМАНДА ДЛЯ АДМИНА
 @router.message(F.text.startswith("/broadcast ") & (F.from_user.id == ADMIN_USER_ID))
-async def cmd_broadcast(message: Message, db):
-    """Отправить сообщение всем пользователям (только для администратора)"""
-    # Извлекаем текст сообщения после команды
-    original_text = message.text[len("/broadcast "):].strip()
-    
+async def cmd_broadcast(
+    message: Message, db, broadcast_worker: "BroadcastWorker | None" = None
+):
+    """Отправить сообщение всем пользователям (только для администратора)
+
+    Рассылка сохраняется в базе и отправляется фоновым обработчиком,
+    прогресс и кнопки управления показываются в ответном сообщении.
+    Перед текстом можно указать сегмент: city=1,2 category=3 active=30.
+    """
+    # Извлекаем текст сообщения после команды и необязательный сегмент
+    try:
+        segment, original_text = BroadcastService.parse_segment(
+            message.text[len("/broadcast "):].strip()
+        )
+    except ValueError:
+        await message.answer(
+            "❌ Неверный сегмент. Пример: /broadcast city=1,2 category=3 active=30 текст"
+        )
+        return
+
     if not original_text:
         await message.answer("❌ Пожалуйста, введите текст сообщения после команды /broadcast")
         return
@@ -193,71 +211,124 @@ async def cmd_broadcast(message: Message, db):
     # Используем HTML-разметку для выделения жирным
     broadcast_text = f"<b>Команда «Сердца»:</b>\n\n{original_text}"
 
-    # Подтверждение отправки
-    confirm_msg = await message.answer(f"⏳ Начинаю рассылку сообщения...\n\n{broadcast_text}", parse_mode="HTML")
-    
-    # Получаем всех пользователей из базы данных
-    users = await UserService.get_all_users(db)
-    
-    if not users:
-        await confirm_msg.edit_text("❌ Нет пользователей для отправки сообщения.")
+    job = await BroadcastService.create_broadcast(
+        db, broadcast_text, message.from_user.id, segment
+    )
+    if not job.total:
+        await BroadcastService.cancel(db, job.id)
+        await message.answer("❌ Нет пользователей для отправки сообщения.")
         return
 
-    total_users = len(users)
-    success_count = 0
-    fail_count = 0
-    
-    # Отправляем сообщение каждому пользователю
-    for user in users:
-        try:
-            # Отправляем сообщение с HTML-разметкой
-            await message.bot.send_message(chat_id=user.id, text=broadcast_text, parse_mode="HTML")
-            success_count += 1
-            # Небольшая задержка, чтобы избежать ограничений Telegram
-            await asyncio.sleep(0.05) 
-        except TelegramForbiddenError:
-            # Пользователь заблокировал бота
-            logfire.warning(f"Пользователь {user.id} заблокировал бота, не могу отправить сообщение")
-            fail_count += 1
-        except TelegramRetryAfter as e:
-            # Достигнут лимит запросов, ждем
-            logfire.warning(f"Достигнут лимит запросов Telegram, жду {e.retry_after} секунд")
-            await asyncio.sleep(e.retry_after)
-            # Повторяем попытку для этого пользователя
-            try:
-                await message.bot.send_message(chat_id=user.id, text=broadcast_text, parse_mode="HTML")
-                success_count += 1
-            except Exception as e2:
-                logfire.error(f"Ошибка повторной отправки сообщения пользователю {user.id}: {e2}")
-                fail_count += 1
-        except Exception as e:
-            logfire.error(f"Ошибка отправки сообщения пользователю {user.id}: {e}")
-            fail_count += 1
-            
-        # Обновляем статус каждые 10 пользователей
-        if (success_count + fail_count) % 10 == 0 or (success_count + fail_count) == total_users:
-            try:
-                await confirm_msg.edit_text(
-                    f"⏳ Рассылка сообщения...\n"
-                    f"Прогресс: {success_count + fail_count}/{total_users}\n"
-                    f"Успешно: {success_count}\n"
-                    f"Ошибок: {fail_count}\n\n"
-                    f"{broadcast_text}",
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass # Игнорируем ошибки редактирования сообщения о прогрессе
-
-    # Финальный отчет
-    await confirm_msg.edit_text(
-        f"✅ Рассылка завершена!\n"
-        f"Всего пользователей: {total_users}\n"
-        f"Успешно: {success_count}\n"
-        f"Ошибок: {fail_count}\n\n"
-        f"Отправленное сообщение:\n{broadcast_text}",
-        parse_mode="HTML"
+    progress_msg = await message.answer(
+        BroadcastService.format_progress(job),
+        reply_markup=get_broadcast_control_keyboard(job.id, job.status),
+        parse_mode="HTML",
+    )
+    await BroadcastService.set_progress_message(
+        db, job.id, progress_msg.chat.id, progress_msg.message_id
+    )
+    if broadcast_worker:
+        broadcast_worker.notify()
+
+
+@router.message(F.text.startswith("/broadcast_at ") & (F.from_user.id == ADMIN_USER_ID))
+async def cmd_broadcast_at(message: Message, db):
+    """Запланировать рассылку на указанное время по Москве (только для администратора)
+
+    /broadcast_at ДД.ММ.ГГГГ ЧЧ:ММ [city=1,2 category=3 active=30] текст
+    Список получателей готовится заранее, отправка начинается в указанное время.
+    """
+    usage = (
+        "❌ Формат: /broadcast_at ДД.ММ.ГГГГ ЧЧ:ММ [city=1,2 category=3 active=30] текст"
+    )
+    try:
+        scheduled_at, rest = BroadcastService.parse_schedule(
+            message.text[len("/broadcast_at "):].strip()
+        )
+        segment, original_text = BroadcastService.parse_segment(rest)
+    except ValueError:
+        await message.answer(usage)
+        return
+
+    if not original_text:
+        await message.answer(usage)
+        return
+
+    broadcast_text = f"<b>Команда «Сердца»:</b>\n\n{original_text}"
+    job = await BroadcastService.create_broadcast(
+        db, broadcast_text, message.from_user.id, segment, scheduled_at
+    )
+    progress_msg = await message.answer(
+        BroadcastService.format_progress(job),
+        reply_markup=get_broadcast_control_keyboard(job.id, job.status),
+        parse_mode="HTML",
+    )
+    await BroadcastService.set_progress_message(
+        db, job.id, progress_msg.chat.id, progress_msg.message_id
     )
 
+
+@router.callback_query(
+    F.data.regexp(r"^broadcast_(pause|resume|cancel)_\d+$")
+    & (F.from_user.id == ADMIN_USER_ID)
+)
+async def handle_broadcast_control(
+    callback: CallbackQuery, db, broadcast_worker: "BroadcastWorker | None" = None
+):
+    """Пауза, продолжение и отмена рассылки"""
+    _, action, job_id = callback.data.split("_")
+    job_id = int(job_id)
+    if action == "pause":
+        changed = await BroadcastService.pause(db, job_id)
+    elif action == "resume":
+        changed = await BroadcastService.resume(db, job_id)
+        if changed and broadcast_worker:
+            broadcast_worker.notify()
+    else:
+        changed = await BroadcastService.cancel(db, job_id)
+
+    job = await BroadcastService.get_broadcast(db, job_id)
+    if not changed or not job:
+        await callback.answer("Статус рассылки уже изменился", show_alert=True)
+        return
+    await db.refresh(job)
+    await callback.answer()
+    try:
+        await callback.message.edit_text(
+            BroadcastService.format_progress(job),
+            reply_markup=get_broadcast_control_keyboard(job.id, job.status),
+            parse_mode="HTML",
+        )
+    except Exception:
+        pass # Игнорируем ошибки редактирования сообщения о прогрессе
+
+
+@router.message(F.text.startswith("/delivery_stats") & (F.from_user.id == ADMIN_USER_ID))
+async def cmd_delivery_stats(message: Message, db):
+    """Статистика рассылок уведомлений (только для администратора)
+
+    /delivery_stats — сводка по последним рассылкам,
+    /delivery_stats <ID поста> — подробный отчёт по посту.
+    """
+    argument = message.text[len("/delivery_stats"):].strip()
+    if argument:
+        if not argument.isdigit():
+            await message.answer("❌ Используйте: /delivery_stats [ID поста]")
+            return
+        delivery = await NotificationService.get_post_delivery(db, int(argument))
+        if not delivery:
+            await message.answer(f"Рассылок о посте {argument} не найдено.")
+            return
+        await message.answer(NotificationService.format_delivery_report(delivery))
+        return
+
+    deliveries = await NotificationService.get_recent_deliveries(db)
+    if not deliveries:
+        await message.answer("Рассылок уведомлений пока не было.")
+        return
+    await message.answer(NotificationService.format_delivery_summary(deliveries))
+
+
 # ВОССТАНОВЛЕННЫЙ ОБРАБОТЧИК
 @router.message(F.text.startswith("/delete_post "))
 async def cmd_delete_post(message: Message, db):
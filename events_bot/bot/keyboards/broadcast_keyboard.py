@@ -0,0 +1,17 @@
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.types import InlineKeyboardMarkup
+from events_bot.database.models import BroadcastStatus
+
+
+def get_broadcast_control_keyboard(job_id: int, status: str) -> InlineKeyboardMarkup | None:
+    """Кнопки управления рассылкой; у завершённой рассылки их нет"""
+    builder = InlineKeyboardBuilder()
+    if status == BroadcastStatus.RUNNING.value:
+        builder.button(text="⏸ Пауза", callback_data=f"broadcast_pause_{job_id}")
+    elif status == BroadcastStatus.PAUSED.value:
+        builder.button(text="▶️ Продолжить", callback_data=f"broadcast_resume_{job_id}")
+    elif status != BroadcastStatus.SCHEDULED.value:
+        return None
+    builder.button(text="⛔️ Отменить", callback_data=f"broadcast_cancel_{job_id}")
+    builder.adjust(2)
+    return builder.as_markup()
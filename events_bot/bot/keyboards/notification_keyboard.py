@@ -24,3 +24,12 @@ def get_post_notification_keyboard(
         builder.adjust(1)
 
     return builder.as_markup()
+
+
+def get_digest_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура для дайджеста новых мероприятий"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📮 Актуальные мероприятия", callback_data="feed")
+    builder.button(text="💌 Главное меню", callback_data="main_menu")
+    builder.adjust(1)
+    return builder.as_markup()
@@ -1,7 +1,12 @@
+import os
+import time
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from typing import Callable, Dict, Any, Awaitable
+import logfire
 from events_bot.bot.utils import get_db_session
+from events_bot.database.repositories import UserRepository
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
 
 
 class DatabaseMiddleware(BaseMiddleware):
@@ -17,3 +22,53 @@ class DatabaseMiddleware(BaseMiddleware):
             data['db'] = db
             return await handler(event, data)
 
+
+class RequestPriorityMiddleware(BaseMiddleware):
+    """Middleware, задающее класс приоритета исходящих запросов обработчика"""
+
+    def __init__(self, priority: RequestPriority):
+        self.priority = priority
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with request_priority(self.priority):
+            return await handler(event, data)
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Middleware, запоминающее время последнего обращения пользователя.
+
+    Запись в базу не чаще раза в ACTIVITY_TOUCH_MINUTES минут на пользователя,
+    поэтому на каждое обновление не приходится лишний UPDATE.
+    Подключается после DatabaseMiddleware.
+    """
+
+    def __init__(self, touch_minutes: float | None = None):
+        self.touch_interval = 60 * (
+            touch_minutes or float(os.getenv("ACTIVITY_TOUCH_MINUTES", 10))
+        )
+        self._touched: Dict[int, float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        db = data.get("db")
+        if user and db is not None:
+            now = time.monotonic()
+            if now - self._touched.get(user.id, float("-inf")) >= self.touch_interval:
+                if len(self._touched) > 100_000:
+                    self._touched.clear()
+                self._touched[user.id] = now
+                try:
+                    await UserRepository.touch_last_active(db, user.id)
+                except Exception as e:
+                    logfire.warning(f"Не удалось обновить активность пользователя {user.id}: {e}")
+        return await handler(event, data)
@@ -0,0 +1,178 @@
+"""
+Планировщик исходящих запросов к Telegram с классами приоритета
+
+Все отправки (ответы пользователям, модерация, уведомления, рассылки) идут
+через одну сессию бота и общий лимит Telegram. Планировщик выдаёт слоты
+с общей частотой TELEGRAM_RATE_LIMIT запросов в секунду, а между классами,
+у которых есть ожидающие запросы, делит их по весам (smooth weighted
+round-robin). Каждый класс гарантированно получает свою долю, а доля
+простаивающих классов достаётся остальным. Класс запроса берётся из
+контекста: request_priority(RequestPriority.BROADCAST).
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, Iterator
+import logfire
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+class RequestPriority(IntEnum):
+    """Классы исходящих запросов (меньше — важнее)"""
+
+    INTERACTIVE = 0
+    MODERATION = 1
+    NOTIFICATION = 2
+    BROADCAST = 3
+
+
+# Гарантированные доли общего лимита для каждого класса
+DEFAULT_SHARES: Dict[RequestPriority, float] = {
+    RequestPriority.INTERACTIVE: 0.4,
+    RequestPriority.MODERATION: 0.1,
+    RequestPriority.NOTIFICATION: 0.3,
+    RequestPriority.BROADCAST: 0.2,
+}
+
+# Методы, на которые распространяется лимит Telegram на отправку сообщений
+RATE_LIMITED_METHOD_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+_current_priority: ContextVar[RequestPriority] = ContextVar(
+    "request_priority", default=RequestPriority.INTERACTIVE
+)
+
+
+def get_request_priority() -> RequestPriority:
+    """Класс приоритета текущего контекста"""
+    return _current_priority.get()
+
+
+@contextmanager
+def request_priority(priority: RequestPriority) -> Iterator[None]:
+    """Выполнять запросы внутри блока с указанным приоритетом"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class OutboundScheduler:
+    """Распределение общего лимита отправок между классами приоритета"""
+
+    def __init__(
+        self,
+        rate_per_second: float | None = None,
+        shares: Dict[RequestPriority, float] | None = None,
+        burst: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        """
+        Args:
+            rate_per_second: Общий лимит отправок в секунду
+            shares: Гарантированные доли классов
+            burst: Сколько запросов можно выдать подряд после простоя
+            clock: Источник монотонного времени (подменяется в тестах)
+            sleep: Функция ожидания (подменяется в тестах)
+        """
+        self.rate_per_second = rate_per_second or float(os.getenv("TELEGRAM_RATE_LIMIT", 25))
+        self.shares = shares or DEFAULT_SHARES
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._queues: Dict[RequestPriority, Deque[asyncio.Future]] = {
+            priority: deque() for priority in RequestPriority
+        }
+        self._credits: Dict[RequestPriority, float] = {
+            priority: 0.0 for priority in RequestPriority
+        }
+        self._paused_until = 0.0
+        self._has_waiters = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def acquire(self, priority: RequestPriority) -> None:
+        """Дождаться слота на отправку для класса priority"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(future)
+        self._has_waiters.set()
+        await future
+
+    def pause(self, seconds: float) -> None:
+        """Приостановить все отправки (Telegram ответил RetryAfter)"""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def _drop_cancelled(self) -> None:
+        for queue in self._queues.values():
+            # Достаточно очистить начало очереди: выдаётся всегда первый
+            while queue and queue[0].done():
+                queue.popleft()
+
+    def _pick(self) -> RequestPriority:
+        active = [priority for priority, queue in self._queues.items() if queue]
+        total = sum(self.shares[priority] for priority in active)
+        for priority in RequestPriority:
+            if priority in active:
+                self._credits[priority] += self.shares[priority]
+            else:
+                self._credits[priority] = 0.0
+        chosen = max(active, key=lambda priority: (self._credits[priority], -priority))
+        self._credits[chosen] -= total
+        return chosen
+
+    async def _run(self) -> None:
+        interval = 1 / self.rate_per_second
+        next_slot = self._clock()
+        while True:
+            now = self._clock()
+            wait = max(next_slot, self._paused_until) - now
+            if wait > 0:
+                # Класс выбирается только когда слот уже свободен, иначе
+                # выбор пропадал бы вместе с ожиданием и доли нарушались
+                await self._sleep(wait)
+                continue
+            # Отменённые запросы не участвуют в выборе и не тратят слот
+            self._drop_cancelled()
+            if not any(self._queues.values()):
+                self._has_waiters.clear()
+                await self._has_waiters.wait()
+                continue
+            priority = self._pick()
+            self._queues[priority].popleft().set_result(None)
+            next_slot = max(next_slot, now - interval * (self.burst - 1)) + interval
+
+
+class ScheduledRequestMiddleware(BaseRequestMiddleware):
+    """Пропускает отправки бота через OutboundScheduler"""
+
+    def __init__(self, scheduler: OutboundScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if type(method).__name__.startswith(RATE_LIMITED_METHOD_PREFIXES):
+            await self.scheduler.acquire(get_request_priority())
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            logfire.warning(f"Telegram просит подождать {e.retry_after} с, приостанавливаем отправки")
+            self.scheduler.pause(e.retry_after)
+            raise
@@ -1,5 +1,5 @@
 from .models import Base, User, Category, Post, ModerationRecord, City
-from .connection import create_async_engine_and_session, create_tables, get_db
+from .connection import create_async_engine_and_session, create_tables, dispose_engine, get_db
 from .repositories import (
     UserRepository,
     CategoryRepository,
@@ -20,6 +20,7 @@ __all__ = [
     # Database connection
     "create_async_engine_and_session",
     "create_tables",
+    "dispose_engine",
     "get_db",
     # Repпозитории
     "UserRepository",
@@ -1,5 +1,6 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import event
 import os
 from .models import Base
 from logfire import instrument_sqlalchemy
@@ -23,18 +24,51 @@ def get_database_url():
         
 already_instrumented = False
 
-def create_async_engine_and_session():
-    """Создает асинхронный движок базы данных и сессию"""
+# Движок и фабрика сессий процесса: создаются при первом обращении (после
+# load_dotenv) и переиспользуются; дочерний процесс создаёт свои
+_engine_pid = None
+_engine = None
+_session_maker = None
+
+
+def _create_engine():
     database_url = get_database_url()
-    engine = create_async_engine(database_url, echo=True)
-    session_maker = async_sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
+    echo = os.getenv("DATABASE_ECHO", "0").lower() in ("1", "true", "yes")
+    engine = create_async_engine(database_url, echo=echo)
+    if engine.dialect.name == "sqlite":
+        # В режиме WAL чтение не блокирует запись: потоковое чтение получателей
+        # рассылки идёт параллельно с сохранением прогресса в другой сессии
+        @event.listens_for(engine.sync_engine, "connect")
+        def _set_sqlite_wal(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+
     global already_instrumented
     if not already_instrumented:
         instrument_sqlalchemy(engine)
         already_instrumented = True
-    return engine, session_maker
+    return engine
+
+
+def create_async_engine_and_session():
+    """Возвращает движок базы данных и фабрику сессий процесса (один пул на процесс)"""
+    global _engine_pid, _engine, _session_maker
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = _create_engine()
+        _session_maker = async_sessionmaker(
+            _engine, class_=AsyncSession, expire_on_commit=False
+        )
+        _engine_pid = os.getpid()
+    return _engine, _session_maker
+
+
+async def dispose_engine():
+    """Закрыть соединения пула движка процесса"""
+    global _engine_pid, _engine, _session_maker
+    if _engine is not None and _engine_pid == os.getpid():
+        await _engine.dispose()
+    _engine_pid = _engine = _session_maker = None
 
 
 async def create_tables(engine):
@@ -8,6 +8,10 @@ from sqlalchemy import (
     func,
     Column,
     BigInteger,
+    Integer,
+    Index,
+    Float,
+    JSON,
     UniqueConstraint,
 )
 from datetime import datetime, timezone
@@ -46,6 +50,8 @@ user_categories = Table(
     Base.metadata,
     Column("user_id", ForeignKey("users.id"), primary_key=True),
     Column("category_id", ForeignKey("categories.id"), primary_key=True),
+    # Поиск подписчиков категории (первичный ключ начинается с user_id)
+    Index("ix_user_categories_category_id", "category_id", "user_id"),
 )
 
 # Таблица связи многие-ко-многим для пользователей и городов
@@ -54,6 +60,8 @@ user_cities = Table(
     Base.metadata,
     Column("user_id", ForeignKey("users.id"), primary_key=True),
     Column("city_id", ForeignKey("cities.id"), primary_key=True),
+    # Поиск подписчиков города (первичный ключ начинается с user_id)
+    Index("ix_user_cities_city_id", "city_id", "user_id"),
 )
 
 # Таблица связи многие-ко-многим для постов и категорий
@@ -72,6 +80,14 @@ post_cities = Table(
     Column("city_id", ForeignKey("cities.id"), primary_key=True),
 )
 
+# Таблица связи многие-ко-многим для дайджестов и постов
+notification_digest_posts = Table(
+    "notification_digest_posts",
+    Base.metadata,
+    Column("digest_id", ForeignKey("notification_digests.id"), primary_key=True),
+    Column("post_id", ForeignKey("posts.id"), primary_key=True),
+)
+
 
 class User(Base, TimestampMixin):
     """Модель пользователя Telegram"""
@@ -84,7 +100,21 @@ class User(Base, TimestampMixin):
     username: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     last_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
-    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    # False, если бот не может писать пользователю (заблокировал бота,
+    # удалил аккаунт). Такие пользователи исключаются из рассылок
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, index=True)
+    deactivated_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    deactivation_reason: Mapped[Optional[str]] = mapped_column(
+        String(50), nullable=True
+    )
+    # Денормализованные подписки (см. events_bot.utils.bitmask). NULL — маска
+    # не заполнена или ID не помещается в неё
+    city_mask: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
+    category_mask: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
+    # Последнее обращение к боту (обновляется не чаще раза в несколько минут)
+    last_active_at: Mapped[Optional[DateTime]] = mapped_column(
+        DateTime, nullable=True, index=True
+    )
 
     # Связи
     categories: Mapped[List["Category"]] = relationship(
@@ -147,16 +177,41 @@ class Post(Base, TimestampMixin):
     title: Mapped[str] = mapped_column(String(200), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     author_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    # Ключ картинки в файловом хранилище (id с расширением);
+    # у старых постов — id без расширения
     image_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    image_content_type: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    # Ключ миниатюры картинки (если картинка проходила обработку)
+    thumbnail_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # file_id картинки на серверах Telegram, полученный после первой отправки.
+    # Повторные отправки используют его вместо повторной загрузки из хранилища
+    telegram_file_id: Mapped[Optional[str]] = mapped_column(
+        String(255), nullable=True
+    )
     url: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)  # Ссылка
     is_approved: Mapped[bool] = mapped_column(Boolean, default=False)
     is_published: Mapped[bool] = mapped_column(Boolean, default=False)
     published_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
     # Дата и время события/актуальности поста.
     # После наступления этого времени пост скрывается и удаляется
-    event_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    event_at: Mapped[Optional[DateTime]] = mapped_column(
+        DateTime, nullable=True, index=True
+    )
+    # Когда лайкнувшим пост отправлено напоминание о начале события
+    reminder_sent_at: Mapped[Optional[DateTime]] = mapped_column(
+        DateTime, nullable=True
+    )
+    # Прогресс отправки напоминания: последний получатель и когда обработчик
+    # в последний раз подтвердил захват (как cursor и claimed_at в outbox)
+    reminder_cursor: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
+    reminder_claimed_at: Mapped[Optional[DateTime]] = mapped_column(
+        DateTime, nullable=True
+    )
     # Адрес мероприятия
     address: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
+    # Денормализованные города и категории поста (см. events_bot.utils.bitmask)
+    city_mask: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
+    category_mask: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
 
     # Связи
     author: Mapped[User] = relationship(back_populates="posts")
@@ -196,7 +251,9 @@ class Like(Base, TimestampMixin):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
-    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"), nullable=False)
+    post_id: Mapped[int] = mapped_column(
+        ForeignKey("posts.id"), nullable=False, index=True
+    )
 
     # Связи
     user: Mapped[User] = relationship()
@@ -206,6 +263,182 @@ class Like(Base, TimestampMixin):
     __table_args__ = (UniqueConstraint("user_id", "post_id", name="uq_like_user_post"),)
 
 
+class OutboxStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    # Отправки разложены по шардам, итоги подводятся после их завершения
+    DISPATCHED = "dispatched"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class NotificationOutbox(Base, TimestampMixin):
+    """Задание на рассылку уведомлений о посте (outbox)"""
+
+    __tablename__ = "notification_outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"), nullable=False)
+    # ID последнего получателя, которому уведомление уже отправлено.
+    # Получатели перебираются по возрастанию ID, поэтому после перезапуска
+    # рассылка продолжается с этого места
+    cursor: Mapped[int] = mapped_column(BigInteger(), default=0, nullable=False)
+    status: Mapped[str] = mapped_column(
+        String(20), default=OutboxStatus.PENDING.value, nullable=False, index=True
+    )
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    error_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    claimed_by: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    claimed_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    # Связи
+    post: Mapped[Post] = relationship()
+
+
+class DigestStatus(str, Enum):
+    COLLECTING = "collecting"
+    PENDING = "pending"
+    DONE = "done"
+
+
+class NotificationDigest(Base, TimestampMixin):
+    """Дайджест: посты, одобренные за окно, рассылаются одним сообщением"""
+
+    __tablename__ = "notification_digests"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    status: Mapped[str] = mapped_column(
+        String(20), default=DigestStatus.COLLECTING.value, nullable=False, index=True
+    )
+    # ID последнего получателя, которому дайджест уже отправлен
+    cursor: Mapped[int] = mapped_column(BigInteger(), default=0, nullable=False)
+    closed_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+
+    # Связи
+    posts: Mapped[List[Post]] = relationship(secondary=notification_digest_posts)
+
+
+class NotificationDelivery(Base, TimestampMixin):
+    """Итоги рассылки уведомлений о посте"""
+
+    __tablename__ = "notification_deliveries"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Без внешнего ключа: статистика остаётся после удаления просроченного поста
+    post_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    post_title: Mapped[str] = mapped_column(String(255), nullable=False)
+    audience_size: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    failed_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Количество ошибок по классам: {"blocked": 3, "TelegramBadRequest": 1}
+    failures: Mapped[dict] = mapped_column(JSON, default=dict, nullable=False)
+    retries: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Момент постановки рассылки в очередь (одобрения поста)
+    started_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    first_send_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    last_send_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    latency_p50_ms: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    latency_p95_ms: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+
+class SendStatus(str, Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class NotificationSend(Base, TimestampMixin):
+    """Отдельная отправка уведомления в очереди шардированных отправителей"""
+
+    __tablename__ = "notification_sends"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # chat_id % количество шардов: все сообщения одного чата обрабатывает
+    # один процесс по возрастанию id, поэтому их порядок сохраняется
+    shard: Mapped[int] = mapped_column(Integer, nullable=False)
+    chat_id: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+    # Без внешнего ключа: отправки о удалённом посте пропускаются,
+    # а строки удаляются вместе с постом
+    post_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    status: Mapped[str] = mapped_column(
+        String(20), default=SendStatus.PENDING.value, nullable=False
+    )
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Результат отправки для итогов рассылки: момент, длительность
+    # и класс ошибки (причина недоступности или тип исключения)
+    sent_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    latency_ms: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    error_class: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_sends_shard_status_id", "shard", "status", "id"),
+    )
+
+
+class SenderState(Base):
+    """Общее состояние отправителей: глобальная пауза после RetryAfter
+    и общий лимит отправок всех шардов (token bucket)"""
+
+    __tablename__ = "sender_state"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    paused_until: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    # Остаток токенов на момент tokens_at; пополняется со скоростью SENDER_RATE_LIMIT
+    tokens: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    tokens_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+
+
+class MediaObject(Base, TimestampMixin):
+    """Объект в файловом хранилище и число постов, которые на него ссылаются.
+
+    Ключ объекта — хэш его содержимого, поэтому одна и та же картинка
+    в нескольких постах хранится один раз.
+    """
+
+    __tablename__ = "media_objects"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    refcount: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class BroadcastStatus(str, Enum):
+    SCHEDULED = "scheduled"
+    RUNNING = "running"
+    PAUSED = "paused"
+    CANCELLED = "cancelled"
+    DONE = "done"
+
+
+class BroadcastJob(Base, TimestampMixin):
+    """Рассылка администратора всем пользователям"""
+
+    __tablename__ = "broadcast_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_by: Mapped[int] = mapped_column(BigInteger(), nullable=False)
+    status: Mapped[str] = mapped_column(
+        String(20), default=BroadcastStatus.RUNNING.value, nullable=False, index=True
+    )
+    # ID последнего пользователя, которому сообщение уже отправлено
+    cursor: Mapped[int] = mapped_column(BigInteger(), default=0, nullable=False)
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    error_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Сообщение администратору, в котором показывается прогресс
+    progress_chat_id: Mapped[Optional[int]] = mapped_column(BigInteger(), nullable=True)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Сегмент получателей: {"city_ids": [...], "category_ids": [...],
+    # "active_since": "ISO-дата"}; None — все активные пользователи
+    segment: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Время запланированной отправки (UTC) и заранее подготовленный файл с ID получателей
+    scheduled_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True, index=True)
+    audience_path: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    finished_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+
+
 class ModerationAction(str, Enum):
     APPROVE = "approve"
     REJECT = "reject"
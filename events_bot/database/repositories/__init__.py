@@ -4,6 +4,12 @@ from .post_repository import PostRepository
 from .moderation_repository import ModerationRepository
 from .like_repository import LikeRepository
 from .city_repository import CityRepository
+from .outbox_repository import OutboxRepository
+from .digest_repository import DigestRepository
+from .delivery_repository import DeliveryRepository
+from .send_queue_repository import SendQueueRepository
+from .broadcast_repository import BroadcastRepository
+from .media_repository import MediaRepository
 
 __all__ = [
     "UserRepository",
@@ -12,4 +18,10 @@ __all__ = [
     "ModerationRepository",
     "LikeRepository",
     "CityRepository",
+    "OutboxRepository",
+    "DigestRepository",
+    "DeliveryRepository",
+    "SendQueueRepository",
+    "BroadcastRepository",
+    "MediaRepository",
 ]
@@ -0,0 +1,133 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, and_
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from ..models import BroadcastJob, BroadcastStatus, utc_now
+
+
+class BroadcastRepository:
+    """Асинхронный репозиторий для рассылок администратора"""
+
+    @staticmethod
+    async def create(
+        db: AsyncSession,
+        text: str,
+        created_by: int,
+        total: int,
+        segment: Optional[Dict[str, Any]] = None,
+        scheduled_at: Optional[datetime] = None,
+    ) -> BroadcastJob:
+        """Создать рассылку; без scheduled_at она сразу готова к отправке"""
+        job = BroadcastJob(
+            text=text,
+            created_by=created_by,
+            total=total,
+            segment=segment,
+            scheduled_at=scheduled_at,
+            status=(
+                BroadcastStatus.SCHEDULED.value if scheduled_at else BroadcastStatus.RUNNING.value
+            ),
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+    @staticmethod
+    async def get(db: AsyncSession, job_id: int) -> Optional[BroadcastJob]:
+        return await db.get(BroadcastJob, job_id)
+
+    @staticmethod
+    async def get_running(db: AsyncSession) -> List[BroadcastJob]:
+        """Рассылки, которые нужно отправлять (в том числе прерванные перезапуском)"""
+        result = await db.execute(
+            select(BroadcastJob)
+            .where(BroadcastJob.status == BroadcastStatus.RUNNING.value)
+            .order_by(BroadcastJob.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_scheduled(db: AsyncSession, before: datetime) -> List[BroadcastJob]:
+        """Запланированные рассылки со временем отправки не позже before"""
+        result = await db.execute(
+            select(BroadcastJob)
+            .where(
+                and_(
+                    BroadcastJob.status == BroadcastStatus.SCHEDULED.value,
+                    BroadcastJob.scheduled_at <= before,
+                )
+            )
+            .order_by(BroadcastJob.scheduled_at, BroadcastJob.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def set_audience(
+        db: AsyncSession, job_id: int, audience_path: Optional[str], total: int
+    ) -> None:
+        """Запомнить подготовленный файл получателей и их число"""
+        await db.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(audience_path=audience_path, total=total)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def get_status(db: AsyncSession, job_id: int) -> Optional[str]:
+        result = await db.execute(
+            select(BroadcastJob.status).where(BroadcastJob.id == job_id)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def set_progress_message(
+        db: AsyncSession, job_id: int, chat_id: int, message_id: int
+    ) -> None:
+        await db.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(progress_chat_id=chat_id, progress_message_id=message_id)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def change_status(
+        db: AsyncSession,
+        job_id: int,
+        status: BroadcastStatus,
+        from_statuses: Iterable[BroadcastStatus],
+    ) -> bool:
+        """Сменить статус, если рассылка сейчас в одном из from_statuses"""
+        values = {"status": status.value}
+        if status in (BroadcastStatus.CANCELLED, BroadcastStatus.DONE):
+            values["finished_at"] = utc_now()
+        result = await db.execute(
+            update(BroadcastJob)
+            .where(
+                and_(
+                    BroadcastJob.id == job_id,
+                    BroadcastJob.status.in_([s.value for s in from_statuses]),
+                )
+            )
+            .values(**values)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def advance_cursor(
+        db: AsyncSession, job_id: int, cursor: int, sent: int, errors: int
+    ) -> None:
+        """Сохранить прогресс рассылки"""
+        await db.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(
+                cursor=cursor,
+                sent_count=BroadcastJob.sent_count + sent,
+                error_count=BroadcastJob.error_count + errors,
+            )
+        )
+        await db.commit()
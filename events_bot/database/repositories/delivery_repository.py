@@ -0,0 +1,38 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from typing import List, Optional
+from ..models import NotificationDelivery
+
+
+class DeliveryRepository:
+    """Асинхронный репозиторий для статистики рассылок уведомлений"""
+
+    @staticmethod
+    async def create(db: AsyncSession, **fields) -> NotificationDelivery:
+        """Сохранить итоги рассылки"""
+        delivery = NotificationDelivery(**fields)
+        db.add(delivery)
+        await db.commit()
+        await db.refresh(delivery)
+        return delivery
+
+    @staticmethod
+    async def get_recent(db: AsyncSession, limit: int = 10) -> List[NotificationDelivery]:
+        """Последние рассылки, новые первыми"""
+        result = await db.execute(
+            select(NotificationDelivery)
+            .order_by(NotificationDelivery.id.desc())
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_by_post(db: AsyncSession, post_id: int) -> Optional[NotificationDelivery]:
+        """Последняя рассылка о посте"""
+        result = await db.execute(
+            select(NotificationDelivery)
+            .where(NotificationDelivery.post_id == post_id)
+            .order_by(NotificationDelivery.id.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
@@ -0,0 +1,148 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert, and_, func
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from ..models import (
+    NotificationDigest,
+    DigestStatus,
+    Post,
+    User,
+    notification_digest_posts,
+    post_cities,
+    post_categories,
+    user_cities,
+    user_categories,
+    utc_now,
+)
+
+
+class DigestRepository:
+    """Асинхронный репозиторий для дайджестов уведомлений"""
+
+    @staticmethod
+    async def add_post(db: AsyncSession, post_id: int) -> NotificationDigest:
+        """Добавить пост в собираемый дайджест (создаётся при необходимости)"""
+        digest = await DigestRepository.get_collecting(db)
+        if not digest:
+            digest = NotificationDigest()
+            db.add(digest)
+            await db.flush()
+        await db.execute(
+            insert(notification_digest_posts).values(digest_id=digest.id, post_id=post_id)
+        )
+        await db.commit()
+        return digest
+
+    @staticmethod
+    async def get_collecting(db: AsyncSession) -> Optional[NotificationDigest]:
+        """Дайджест, в который сейчас собираются посты"""
+        result = await db.execute(
+            select(NotificationDigest)
+            .where(NotificationDigest.status == DigestStatus.COLLECTING.value)
+            .order_by(NotificationDigest.id)
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def get_last_closed_at(db: AsyncSession) -> Optional[datetime]:
+        """Время закрытия последнего окна сбора (UTC)"""
+        result = await db.execute(select(func.max(NotificationDigest.closed_at)))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def close_collecting(db: AsyncSession) -> Optional[NotificationDigest]:
+        """Закрыть окно сбора: дайджест становится готовым к рассылке"""
+        digest = await DigestRepository.get_collecting(db)
+        if digest:
+            digest.status = DigestStatus.PENDING.value
+            digest.closed_at = utc_now()
+            await db.commit()
+        return digest
+
+    @staticmethod
+    async def get_pending(db: AsyncSession) -> List[NotificationDigest]:
+        """Дайджесты, которые закрыты, но ещё не разосланы до конца"""
+        result = await db.execute(
+            select(NotificationDigest)
+            .where(NotificationDigest.status == DigestStatus.PENDING.value)
+            .order_by(NotificationDigest.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_digest_posts(db: AsyncSession, digest_id: int) -> List[Post]:
+        """Посты дайджеста, которые ещё опубликованы"""
+        result = await db.execute(
+            select(Post)
+            .join(notification_digest_posts, notification_digest_posts.c.post_id == Post.id)
+            .where(
+                and_(
+                    notification_digest_posts.c.digest_id == digest_id,
+                    Post.is_published == True,
+                )
+            )
+            .options(selectinload(Post.categories), selectinload(Post.cities))
+            .order_by(Post.event_at.is_(None), Post.event_at.asc())
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def stream_recipient_posts(
+        db: AsyncSession, digest_id: int, after_id: int = 0, batch_size: int = 500
+    ) -> AsyncIterator[List[Tuple[int, int]]]:
+        """Потоково выдавать пары (user_id, post_id) по возрастанию user_id.
+
+        Один сгруппированный запрос сопоставляет все посты дайджеста
+        с подписками пользователей по городам и категориям.
+        """
+        user_id = user_cities.c.user_id
+        post_id = notification_digest_posts.c.post_id
+        result = await db.stream(
+            select(user_id, post_id)
+            .select_from(notification_digest_posts)
+            .join(post_cities, post_cities.c.post_id == post_id)
+            .join(user_cities, user_cities.c.city_id == post_cities.c.city_id)
+            .join(post_categories, post_categories.c.post_id == post_id)
+            .join(
+                user_categories,
+                and_(
+                    user_categories.c.category_id == post_categories.c.category_id,
+                    user_categories.c.user_id == user_id,
+                ),
+            )
+            .join(User, User.id == user_id)
+            .where(
+                and_(
+                    notification_digest_posts.c.digest_id == digest_id,
+                    user_id > after_id,
+                    User.is_active == True,
+                )
+            )
+            .group_by(user_id, post_id)
+            .order_by(user_id, post_id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            yield [(row[0], row[1]) for row in partition]
+
+    @staticmethod
+    async def advance_cursor(db: AsyncSession, digest_id: int, cursor: int) -> None:
+        """Сохранить прогресс рассылки дайджеста"""
+        await db.execute(
+            update(NotificationDigest)
+            .where(NotificationDigest.id == digest_id)
+            .values(cursor=cursor)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def mark_done(db: AsyncSession, digest_id: int) -> None:
+        """Отметить дайджест разосланным"""
+        await db.execute(
+            update(NotificationDigest)
+            .where(NotificationDigest.id == digest_id)
+            .values(status=DigestStatus.DONE.value)
+        )
+        await db.commit()
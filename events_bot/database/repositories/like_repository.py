@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, delete
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from ..models import Like, User, Post
 
 
@@ -52,6 +52,24 @@ class LikeRepository:
         result = await db.execute(stmt)
         return result.scalars().all()
 
+    @staticmethod
+    async def stream_liker_ids(
+        db: AsyncSession, post_id: int, after_id: Optional[int] = None, batch_size: int = 500
+    ) -> AsyncIterator[List[int]]:
+        """Потоково выдавать ID активных пользователей, лайкнувших пост, после after_id"""
+        conditions = [Like.post_id == post_id, User.is_active == True]
+        if after_id:
+            conditions.append(Like.user_id > after_id)
+        result = await db.stream(
+            select(Like.user_id)
+            .join(User, User.id == Like.user_id)
+            .where(and_(*conditions))
+            .order_by(Like.user_id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            yield [row.user_id for row in partition]
+
     @staticmethod
     async def get_post_likes_count(db: AsyncSession, post_id: int) -> int:
         """Получить количество лайков на пост"""
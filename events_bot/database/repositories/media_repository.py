@@ -0,0 +1,153 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, case, and_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from typing import Iterable, List
+from ..models import MediaObject, utc_now
+
+
+class MediaRepository:
+    """Асинхронный репозиторий счётчиков ссылок на объекты хранилища.
+
+    register, acquire и release не фиксируют транзакцию: ссылки меняются
+    вместе с созданием или удалением поста, который их держит. Ключи
+    обрабатываются одним запросом, а не по одному.
+    """
+
+    @staticmethod
+    def _upsert(db: AsyncSession, counts: dict, insert_refcount, on_conflict):
+        """INSERT строк объектов, а для существующих — UPDATE счётчика одним запросом.
+
+        insert_refcount(n) — счётчик новой строки ключа, встреченного n раз;
+        on_conflict(excluded) — новое значение счётчика существующей строки,
+        excluded — вставляемые значения (в них refcount = insert_refcount(n)).
+        """
+        now = utc_now()
+        rows = [
+            {"key": key, "refcount": insert_refcount(n), "updated_at": now}
+            for key, n in counts.items()
+        ]
+        dialect = db.get_bind().dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(MediaObject).values(rows)
+            return stmt.on_duplicate_key_update(
+                refcount=on_conflict(stmt.inserted), updated_at=now
+            )
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(MediaObject).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[MediaObject.key],
+            set_={"refcount": on_conflict(stmt.excluded), "updated_at": now},
+        )
+
+    @staticmethod
+    async def register(db: AsyncSession, keys: Iterable[str]) -> None:
+        """Учесть загруженные объекты, на которые пока не ссылается ни один пост.
+
+        Новые объекты получают строку со счётчиком 0, у существующих
+        счётчик не меняется. В обоих случаях обновляется updated_at, и
+        delete_unreferenced не трогает объект, пока не истечёт отсрочка.
+        """
+        counts = Counter(keys)
+        if counts:
+            await db.execute(
+                MediaRepository._upsert(
+                    db, counts, lambda n: 0, lambda excluded: MediaObject.refcount
+                )
+            )
+
+    @staticmethod
+    async def acquire(db: AsyncSession, keys: Iterable[str]) -> None:
+        """Учесть новую ссылку поста на каждый из объектов"""
+        counts = Counter(keys)
+        if counts:
+            await db.execute(
+                MediaRepository._upsert(
+                    db,
+                    counts,
+                    lambda n: n,
+                    lambda excluded: MediaObject.refcount + excluded.refcount,
+                )
+            )
+
+    @staticmethod
+    async def release(db: AsyncSession, keys: Iterable[str]) -> None:
+        """Снять ссылку поста с объектов.
+
+        Объекты без ссылок остаются в таблице со счётчиком 0, пока их не
+        удалит delete_unreferenced. Объекты, сохранённые до подсчёта ссылок,
+        принадлежали одному посту и получают строку со счётчиком 0.
+        """
+        counts = Counter(keys)
+        # Один запрос на каждое число снимаемых ссылок: обычно пост ссылается
+        # на объект один раз, и запрос получается один
+        by_count = {}
+        for key, n in counts.items():
+            by_count.setdefault(n, {})[key] = n
+        for n, group in by_count.items():
+            await db.execute(
+                MediaRepository._upsert(
+                    db,
+                    group,
+                    lambda n: 0,
+                    lambda excluded, n=n: case(
+                        (MediaObject.refcount > n, MediaObject.refcount - n), else_=0
+                    ),
+                )
+            )
+
+    @staticmethod
+    async def get_unreferenced(
+        db: AsyncSession, limit: int, released_before: datetime
+    ) -> List[str]:
+        """Ключи объектов, на которые нет ссылок с момента раньше released_before"""
+        result = await db.execute(
+            select(MediaObject.key)
+            .where(
+                and_(MediaObject.refcount == 0, MediaObject.updated_at < released_before)
+            )
+            .order_by(MediaObject.updated_at)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def delete_unreferenced(
+        db: AsyncSession, keys: List[str], released_before: datetime
+    ) -> List[str]:
+        """Удалить строки объектов, на которые всё ещё нет ссылок; возвращает их ключи.
+
+        Объекты, которые с released_before загрузили заново или на которые
+        взяли и сняли ссылку, не удаляются.
+
+        Транзакция не фиксируется: пока вызывающий удаляет файлы, строки
+        заблокированы, и acquire того же объекта ждёт фиксации.
+        """
+        if not keys:
+            return []
+        unreferenced = and_(
+            MediaObject.key.in_(keys),
+            MediaObject.refcount == 0,
+            MediaObject.updated_at < released_before,
+        )
+        result = await db.execute(
+            select(MediaObject.key).where(unreferenced).with_for_update()
+        )
+        locked = list(result.scalars().all())
+        if not locked:
+            return []
+        await db.execute(
+            delete(MediaObject).where(
+                and_(
+                    MediaObject.key.in_(locked),
+                    MediaObject.refcount == 0,
+                    MediaObject.updated_at < released_before,
+                )
+            )
+        )
+        # Ссылку на объект могли взять между выборкой и удалением (SQLite не
+        # блокирует строки при SELECT), такие строки остались в таблице
+        result = await db.execute(select(MediaObject.key).where(MediaObject.key.in_(locked)))
+        kept = set(result.scalars().all())
+        return [key for key in locked if key not in kept]
@@ -0,0 +1,170 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, and_, or_
+from typing import List
+from datetime import timedelta
+from ..models import NotificationOutbox, OutboxStatus, utc_now
+
+
+class OutboxRepository:
+    """Асинхронный репозиторий для очереди рассылки уведомлений"""
+
+    @staticmethod
+    async def enqueue(db: AsyncSession, post_id: int) -> NotificationOutbox:
+        """Поставить рассылку уведомлений о посте в очередь"""
+        job = NotificationOutbox(post_id=post_id)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+    @staticmethod
+    async def claim(
+        db: AsyncSession, worker_id: str, limit: int, lease_seconds: int
+    ) -> List[NotificationOutbox]:
+        """Захватить задания для обработки.
+
+        Берутся новые задания и задания, чей владелец не продлевал захват
+        дольше lease_seconds (например, процесс упал посреди рассылки).
+        Захват выполняется условным UPDATE, поэтому одно задание не достанется
+        двум обработчикам даже в разных процессах.
+        """
+        now = utc_now()
+        claimable = or_(
+            NotificationOutbox.status == OutboxStatus.PENDING.value,
+            and_(
+                NotificationOutbox.status == OutboxStatus.PROCESSING.value,
+                NotificationOutbox.claimed_at < now - timedelta(seconds=lease_seconds),
+            ),
+        )
+        result = await db.execute(
+            select(NotificationOutbox.id)
+            .where(claimable)
+            .order_by(NotificationOutbox.id)
+            .limit(limit)
+        )
+        claimed_ids = []
+        for job_id in result.scalars().all():
+            claimed = await db.execute(
+                update(NotificationOutbox)
+                .where(and_(NotificationOutbox.id == job_id, claimable))
+                .values(
+                    status=OutboxStatus.PROCESSING.value,
+                    claimed_by=worker_id,
+                    claimed_at=now,
+                )
+            )
+            if claimed.rowcount:
+                claimed_ids.append(job_id)
+        await db.commit()
+        if not claimed_ids:
+            return []
+        result = await db.execute(
+            select(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(claimed_ids))
+            .order_by(NotificationOutbox.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def advance_cursor(
+        db: AsyncSession,
+        job_id: int,
+        worker_id: str,
+        cursor: int,
+        sent: int = 0,
+        errors: int = 0,
+    ) -> bool:
+        """Сохранить прогресс рассылки и продлить захват задания"""
+        result = await db.execute(
+            update(NotificationOutbox)
+            .where(
+                and_(
+                    NotificationOutbox.id == job_id,
+                    NotificationOutbox.claimed_by == worker_id,
+                )
+            )
+            .values(
+                cursor=cursor,
+                claimed_at=utc_now(),
+                sent_count=NotificationOutbox.sent_count + sent,
+                error_count=NotificationOutbox.error_count + errors,
+            )
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def ack(db: AsyncSession, job_id: int, worker_id: str) -> bool:
+        """Отметить задание выполненным"""
+        result = await db.execute(
+            update(NotificationOutbox)
+            .where(
+                and_(
+                    NotificationOutbox.id == job_id,
+                    NotificationOutbox.claimed_by == worker_id,
+                )
+            )
+            .values(status=OutboxStatus.DONE.value, claimed_by=None, last_error=None)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def mark_dispatched(db: AsyncSession, job_id: int, worker_id: str) -> bool:
+        """Отметить, что отправки задания переданы шардам"""
+        result = await db.execute(
+            update(NotificationOutbox)
+            .where(
+                and_(
+                    NotificationOutbox.id == job_id,
+                    NotificationOutbox.claimed_by == worker_id,
+                )
+            )
+            .values(status=OutboxStatus.DISPATCHED.value, claimed_by=None, last_error=None)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def get_dispatched(db: AsyncSession) -> List[NotificationOutbox]:
+        """Задания, чьи отправки выполняют шарды"""
+        result = await db.execute(
+            select(NotificationOutbox)
+            .where(NotificationOutbox.status == OutboxStatus.DISPATCHED.value)
+            .order_by(NotificationOutbox.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def complete_dispatched(db: AsyncSession, job_id: int) -> bool:
+        """Закрыть задание, переданное шардам; False — его уже закрыл другой процесс"""
+        result = await db.execute(
+            update(NotificationOutbox)
+            .where(
+                and_(
+                    NotificationOutbox.id == job_id,
+                    NotificationOutbox.status == OutboxStatus.DISPATCHED.value,
+                )
+            )
+            .values(status=OutboxStatus.DONE.value)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def release_with_error(
+        db: AsyncSession, job_id: int, worker_id: str, error: str, max_attempts: int
+    ) -> None:
+        """Вернуть задание в очередь после ошибки или пометить его проваленным"""
+        job = await db.get(NotificationOutbox, job_id)
+        if not job or job.claimed_by != worker_id:
+            return
+        job.attempts += 1
+        job.last_error = error[:1000]
+        job.claimed_by = None
+        job.status = (
+            OutboxStatus.FAILED.value
+            if job.attempts >= max_attempts
+            else OutboxStatus.PENDING.value
+        )
+        await db.commit()
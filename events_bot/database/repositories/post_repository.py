@@ -1,27 +1,24 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func, insert, or_, delete
+from sqlalchemy import select, and_, func, insert, or_, delete, update
 from sqlalchemy.orm import selectinload
-from typing import List, Optional
-from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
 from ..models import Post, ModerationRecord, ModerationAction, Category, City, post_categories
-from ..models import User, Like
+from ..models import User, Like, NotificationOutbox, NotificationSend, notification_digest_posts, utc_now
+from .media_repository import MediaRepository
+from ...utils.msk_time import MSK_OFFSET, get_current_msk_time
+from ...utils.bitmask import SUBSCRIPTION_BITMASKS_ENABLED, ids_to_mask, mask_to_ids
 
 
 class PostRepository:
     """Асинхронный репозиторий для работы с постами"""
 
-    # Московское время обычно UTC+3. Для точности можно использовать библиотеку zoneinfo,
-    # но для простоты зафиксируем смещение.
-    MSK_OFFSET = timedelta(hours=3)
+    MSK_OFFSET = MSK_OFFSET
 
     @staticmethod
     async def _get_current_msk_time() -> datetime:
         """Получить текущее время в Москве (UTC+3)."""
-        # Получаем текущее UTC время
-        utc_now = datetime.now(timezone.utc).replace(tzinfo=None)
-        # Конвертируем в MSK
-        msk_now = utc_now + PostRepository.MSK_OFFSET
-        return msk_now
+        return get_current_msk_time()
 
     @staticmethod
     async def create_post(
@@ -35,6 +32,8 @@ class PostRepository:
         event_at: datetime | None = None,
         url: str | None = None,
         address: str | None = None,
+        image_content_type: str | None = None,
+        thumbnail_id: str | None = None,
     ) -> Post:
         """Создать новый пост с категориями, городами и адресом"""
         categories_result = await db.execute(
@@ -52,17 +51,40 @@ class PostRepository:
             content=content,
             author_id=author_id,
             image_id=image_id,
+            image_content_type=image_content_type,
+            thumbnail_id=thumbnail_id,
             event_at=event_at,
             url=url,
             address=address,
             categories=category_objs,
             cities=city_objs,
+            city_mask=ids_to_mask(c.id for c in city_objs),
+            category_mask=ids_to_mask(cat.id for cat in category_objs),
         )
         db.add(post)
+        # Ссылки на картинку и миниатюру учитываются в той же транзакции, что и пост
+        await MediaRepository.acquire(db, [key for key in (image_id, thumbnail_id) if key])
         await db.commit()
         await db.refresh(post)
         return post
 
+    @staticmethod
+    async def replace_image(
+        db: AsyncSession,
+        post: Post,
+        image_id: str,
+        image_content_type: str | None,
+        thumbnail_id: str | None = None,
+    ) -> None:
+        """Заменить картинку и миниатюру поста, перенеся его ссылки на новые объекты"""
+        previous_keys = [key for key in (post.image_id, post.thumbnail_id) if key]
+        post.image_id = image_id
+        post.image_content_type = image_content_type
+        post.thumbnail_id = thumbnail_id
+        await MediaRepository.acquire(db, [key for key in (image_id, thumbnail_id) if key])
+        await MediaRepository.release(db, previous_keys)
+        await db.commit()
+
     @staticmethod
     async def get_pending_moderation(db: AsyncSession) -> List[Post]:
         result = await db.execute(
@@ -197,9 +219,132 @@ class PostRepository:
         return post
 
     @staticmethod
-    async def get_feed_posts(
-        db: AsyncSession, user_id: int, limit: int = 10, offset: int = 0
-    ) -> List[Post]:
+    async def set_telegram_file_id(
+        db: AsyncSession, post_id: int, telegram_file_id: str
+    ) -> None:
+        """Сохранить file_id картинки поста, выданный Telegram"""
+        await db.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(telegram_file_id=telegram_file_id)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def get_posts_to_remind(
+        db: AsyncSession, event_from: datetime, event_to: datetime
+    ) -> List[tuple]:
+        """(id, event_at) опубликованных постов с лайками, чьё событие
+        в интервале (event_from, event_to] и напоминание ещё не отправлено.
+
+        Выборка идёт по индексу posts.event_at, лайки проверяются
+        по индексу likes.post_id только для постов из интервала.
+        """
+        result = await db.execute(
+            select(Post.id, Post.event_at)
+            .where(
+                and_(
+                    Post.event_at > event_from,
+                    Post.event_at <= event_to,
+                    Post.is_published == True,
+                    Post.reminder_sent_at.is_(None),
+                    select(Like.id).where(Like.post_id == Post.id).exists(),
+                )
+            )
+            .order_by(Post.event_at)
+        )
+        return [(row.id, row.event_at) for row in result]
+
+    @staticmethod
+    async def claim_reminder(
+        db: AsyncSession, post_id: int, lease_seconds: int
+    ) -> Tuple[bool, Optional[int]]:
+        """Захватить отправку напоминания; возвращает (захвачено, cursor).
+
+        Напоминание, которое обрабатывается другим процессом, не захватывается,
+        пока его захват не старше lease_seconds (процесс мог упасть посреди
+        отправки) — тогда отправка продолжается после cursor.
+        """
+        now = utc_now()
+        result = await db.execute(
+            update(Post)
+            .where(
+                and_(
+                    Post.id == post_id,
+                    Post.reminder_sent_at.is_(None),
+                    or_(
+                        Post.reminder_claimed_at.is_(None),
+                        Post.reminder_claimed_at < now - timedelta(seconds=lease_seconds),
+                    ),
+                )
+            )
+            .values(reminder_claimed_at=now)
+        )
+        await db.commit()
+        if not result.rowcount:
+            return False, None
+        cursor = await db.scalar(select(Post.reminder_cursor).where(Post.id == post_id))
+        return True, cursor
+
+    @staticmethod
+    async def advance_reminder_cursor(db: AsyncSession, post_id: int, cursor: int) -> None:
+        """Сохранить прогресс отправки напоминания и продлить захват"""
+        await db.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(reminder_cursor=cursor, reminder_claimed_at=utc_now())
+        )
+        await db.commit()
+
+    @staticmethod
+    async def mark_reminder_sent(db: AsyncSession, post_id: int) -> bool:
+        """Отметить напоминание отправленным; False — его уже отправил другой процесс"""
+        result = await db.execute(
+            update(Post)
+            .where(and_(Post.id == post_id, Post.reminder_sent_at.is_(None)))
+            .values(reminder_sent_at=func.now())
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    async def _get_feed_subscription_filter(db: AsyncSession, user_id: int):
+        """Условие «пост подходит подпискам пользователя».
+
+        Возвращает None, если у пользователя нет городов или категорий.
+        С SUBSCRIPTION_BITMASKS и заполненными масками пользователя посты
+        отбираются по маскам; с post_cities/post_categories сверяются только
+        посты без маски.
+        """
+        if SUBSCRIPTION_BITMASKS_ENABLED:
+            masks_result = await db.execute(
+                select(User.city_mask, User.category_mask).where(User.id == user_id)
+            )
+            masks = masks_result.one_or_none()
+            if masks and masks.city_mask is not None and masks.category_mask is not None:
+                if not masks.city_mask or not masks.category_mask:
+                    return None
+                # У поста с ID города или категории больше 63 маска NULL:
+                # такие посты проверяются по таблицам связей
+                return and_(
+                    or_(
+                        Post.city_mask.op("&")(masks.city_mask) != 0,
+                        and_(
+                            Post.city_mask.is_(None),
+                            Post.cities.any(City.id.in_(mask_to_ids(masks.city_mask))),
+                        ),
+                    ),
+                    or_(
+                        Post.category_mask.op("&")(masks.category_mask) != 0,
+                        and_(
+                            Post.category_mask.is_(None),
+                            Post.categories.any(
+                                Category.id.in_(mask_to_ids(masks.category_mask))
+                            ),
+                        ),
+                    ),
+                )
+
         user_result = await db.execute(
             select(User)
             .where(User.id == user_id)
@@ -207,21 +352,30 @@ class PostRepository:
         )
         user = user_result.scalar_one_or_none()
         if not user or not user.categories or not user.cities:
-            return []
+            return None
 
         category_ids = [cat.id for cat in user.categories]
         city_ids = [c.id for c in user.cities]
+        return and_(
+            Post.categories.any(Category.id.in_(category_ids)),
+            Post.cities.any(City.id.in_(city_ids)),
+        )
+
+    @staticmethod
+    async def get_feed_posts(
+        db: AsyncSession, user_id: int, limit: int = 10, offset: int = 0
+    ) -> List[Post]:
+        subscription_filter = await PostRepository._get_feed_subscription_filter(db, user_id)
+        if subscription_filter is None:
+            return []
+
         now_utc = func.now()
         
         result = await db.execute(
             select(Post)
-            .group_by(Post.id) # <-- ИЗМЕНЕНИЕ ЗДЕСЬ
-            .join(Post.categories)
-            .join(Post.cities)
             .where(
                 and_(
-                    Post.categories.any(Category.id.in_(category_ids)),
-                    Post.cities.any(City.id.in_(city_ids)),
+                    subscription_filter,
                     Post.is_approved == True,
                     Post.is_published == True,
                     or_(Post.event_at.is_(None), Post.event_at > now_utc),
@@ -236,26 +390,15 @@ class PostRepository:
 
     @staticmethod
     async def get_feed_posts_count(db: AsyncSession, user_id: int) -> int:
-        user_result = await db.execute(
-            select(User)
-            .where(User.id == user_id)
-            .options(selectinload(User.categories), selectinload(User.cities))
-        )
-        user = user_result.scalar_one_or_none()
-        if not user or not user.categories or not user.cities:
+        subscription_filter = await PostRepository._get_feed_subscription_filter(db, user_id)
+        if subscription_filter is None:
             return 0
 
-        category_ids = [cat.id for cat in user.categories]
-        city_ids = [c.id for c in user.cities]
-
         result = await db.execute(
-            select(func.count(Post.id.distinct()))
-            .join(Post.categories)
-            .join(Post.cities)
+            select(func.count(Post.id))
             .where(
                 and_(
-                    Post.categories.any(Category.id.in_(category_ids)),
-                    Post.cities.any(City.id.in_(city_ids)),
+                    subscription_filter,
                     Post.is_approved == True,
                     Post.is_published == True,
                     or_(Post.event_at.is_(None), Post.event_at > func.now()),
@@ -314,17 +457,33 @@ class PostRepository:
         deletion_threshold_msk = current_msk + timedelta(hours=2)
         
         expired_posts = await db.execute(
-            select(Post.id).where(
+            select(Post.id, Post.image_id, Post.thumbnail_id).where(
                 and_(
                     Post.event_at.is_not(None), 
                     Post.event_at <= deletion_threshold_msk # Исправлено
                 )
             )
         )
-        post_ids = [pid for pid in expired_posts.scalars().all()]
+        expired_rows = expired_posts.all()
+        post_ids = [row.id for row in expired_rows]
         if not post_ids:
             return 0
         await db.execute(Like.__table__.delete().where(Like.post_id.in_(post_ids)))
+        await db.execute(
+            NotificationOutbox.__table__.delete().where(
+                NotificationOutbox.post_id.in_(post_ids)
+            )
+        )
+        await db.execute(
+            NotificationSend.__table__.delete().where(
+                NotificationSend.post_id.in_(post_ids)
+            )
+        )
+        await db.execute(
+            notification_digest_posts.delete().where(
+                notification_digest_posts.c.post_id.in_(post_ids)
+            )
+        )
         await db.execute(
             ModerationRecord.__table__.delete().where(
                 ModerationRecord.post_id.in_(post_ids)
@@ -337,6 +496,10 @@ class PostRepository:
             post_cities.delete().where(post_cities.c.post_id.in_(post_ids))
         )
         result = await db.execute(Post.__table__.delete().where(Post.id.in_(post_ids)))
+        await MediaRepository.release(
+            db,
+            [key for row in expired_rows for key in (row.image_id, row.thumbnail_id) if key],
+        )
         await db.commit()
         return result.rowcount or 0
 
@@ -349,7 +512,7 @@ class PostRepository:
         deletion_threshold_msk = current_msk + timedelta(hours=2)
         
         result = await db.execute(
-            select(Post.id, Post.image_id).where(
+            select(Post.id, Post.image_id, Post.thumbnail_id).where(
                 and_(
                     Post.event_at.is_not(None), 
                     Post.event_at <= deletion_threshold_msk # Исправлено
@@ -357,7 +520,7 @@ class PostRepository:
             )
         )
         rows = result.all()
-        return [{"id": row[0], "image_id": row[1]} for row in rows]
+        return [{"id": row[0], "image_id": row[1], "thumbnail_id": row[2]} for row in rows]
 
     @staticmethod
     async def delete_post(db: AsyncSession, post_id: int) -> bool:
@@ -365,13 +528,34 @@ class PostRepository:
         from ..models import Like, ModerationRecord, post_cities
         # Удаляем лайки
         await db.execute(delete(Like).where(Like.post_id == post_id))
+        # Удаляем задания рассылки
+        await db.execute(
+            delete(NotificationOutbox).where(
+                NotificationOutbox.post_id == post_id
+            )
+        )
+        await db.execute(
+            delete(NotificationSend).where(
+                NotificationSend.post_id == post_id
+            )
+        )
+        await db.execute(
+            delete(notification_digest_posts).where(
+                notification_digest_posts.c.post_id == post_id
+            )
+        )
         # Удаляем записи модерации
         await db.execute(delete(ModerationRecord).where(ModerationRecord.post_id == post_id))
         # Удаляем связи с категориями
         await db.execute(delete(post_categories).where(post_categories.c.post_id == post_id))
         # Удаляем связи с городами
         await db.execute(delete(post_cities).where(post_cities.c.post_id == post_id))
-        # Удаляем сам пост
+        # Удаляем сам пост и снимаем его ссылки на картинку и миниатюру
+        media = (
+            await db.execute(select(Post.image_id, Post.thumbnail_id).where(Post.id == post_id))
+        ).first()
         result = await db.execute(delete(Post).where(Post.id == post_id))
+        if result.rowcount and media:
+            await MediaRepository.release(db, [key for key in media if key])
         await db.commit()
         return result.rowcount > 0
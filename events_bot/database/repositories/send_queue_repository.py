@@ -0,0 +1,182 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert, delete, and_, func
+from sqlalchemy.exc import IntegrityError
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from ..models import NotificationSend, SendStatus, SenderState, utc_now
+
+# Единственная строка таблицы sender_state
+_SENDER_STATE_ID = 1
+
+
+class SendQueueRepository:
+    """Асинхронный репозиторий для очереди шардированных отправок"""
+
+    @staticmethod
+    async def enqueue_batch(
+        db: AsyncSession, post_id: int, chat_ids: List[int], shards: int
+    ) -> int:
+        """Поставить отправки уведомления о посте в очереди шардов"""
+        if not chat_ids:
+            return 0
+        await db.execute(
+            insert(NotificationSend),
+            [
+                {"shard": chat_id % shards, "chat_id": chat_id, "post_id": post_id}
+                for chat_id in chat_ids
+            ],
+        )
+        await db.commit()
+        return len(chat_ids)
+
+    @staticmethod
+    async def get_pending(
+        db: AsyncSession, shard: int, limit: int
+    ) -> List[NotificationSend]:
+        """Очередные отправки шарда в порядке постановки"""
+        result = await db.execute(
+            select(NotificationSend)
+            .where(
+                and_(
+                    NotificationSend.shard == shard,
+                    NotificationSend.status == SendStatus.PENDING.value,
+                )
+            )
+            .order_by(NotificationSend.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def record_results(db: AsyncSession, results: List[Dict[str, Any]]) -> None:
+        """Сохранить результаты отправок.
+
+        Каждый элемент — значения строки по её id: status, attempts,
+        sent_at, latency_ms и error_class.
+        """
+        if not results:
+            return
+        await db.execute(update(NotificationSend), results)
+        await db.commit()
+
+    @staticmethod
+    async def record_retry(db: AsyncSession, send_id: int) -> None:
+        """Учесть попытку, отложенную из-за RetryAfter; отправка остаётся в очереди"""
+        await db.execute(
+            update(NotificationSend)
+            .where(NotificationSend.id == send_id)
+            .values(attempts=NotificationSend.attempts + 1)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def get_post_progress(db: AsyncSession, post_id: int) -> Dict[str, int]:
+        """Число отправок о посте по статусам"""
+        result = await db.execute(
+            select(NotificationSend.status, func.count(NotificationSend.id))
+            .where(NotificationSend.post_id == post_id)
+            .group_by(NotificationSend.status)
+        )
+        return {status: count for status, count in result.all()}
+
+    @staticmethod
+    async def get_post_results(
+        db: AsyncSession, post_id: int
+    ) -> List[Tuple[str, int, Optional[datetime], Optional[float], Optional[str]]]:
+        """Результаты обработанных отправок о посте:
+        (status, attempts, sent_at, latency_ms, error_class)"""
+        result = await db.execute(
+            select(
+                NotificationSend.status,
+                NotificationSend.attempts,
+                NotificationSend.sent_at,
+                NotificationSend.latency_ms,
+                NotificationSend.error_class,
+            ).where(
+                and_(
+                    NotificationSend.post_id == post_id,
+                    NotificationSend.status != SendStatus.PENDING.value,
+                )
+            )
+        )
+        return [tuple(row) for row in result.all()]
+
+    @staticmethod
+    async def prune_post(db: AsyncSession, post_id: int) -> int:
+        """Удалить обработанные отправки о посте после подведения итогов"""
+        result = await db.execute(
+            delete(NotificationSend).where(
+                and_(
+                    NotificationSend.post_id == post_id,
+                    NotificationSend.status != SendStatus.PENDING.value,
+                )
+            )
+        )
+        await db.commit()
+        return result.rowcount or 0
+
+    @staticmethod
+    async def get_paused_until(db: AsyncSession) -> Optional[datetime]:
+        """До какого момента (UTC) отправки приостановлены"""
+        state = await db.get(SenderState, _SENDER_STATE_ID)
+        return state.paused_until if state else None
+
+    @staticmethod
+    async def pause_until(db: AsyncSession, until: datetime) -> None:
+        """Приостановить отправки всех шардов до момента until (UTC)"""
+        state = await db.get(SenderState, _SENDER_STATE_ID)
+        if not state:
+            db.add(SenderState(id=_SENDER_STATE_ID, paused_until=until))
+            try:
+                await db.commit()
+                return
+            except IntegrityError:
+                # Строку одновременно создал другой шард
+                await db.rollback()
+        await db.execute(
+            update(SenderState)
+            .where(SenderState.id == _SENDER_STATE_ID)
+            .where((SenderState.paused_until.is_(None)) | (SenderState.paused_until < until))
+            .values(paused_until=until)
+        )
+        await db.commit()
+
+    @staticmethod
+    async def take_tokens(
+        db: AsyncSession, wanted: int, rate: float, capacity: float
+    ) -> int:
+        """Взять до wanted токенов общего лимита всех шардов; возвращает сколько взято.
+
+        Токены копятся со скоростью rate в секунду, но не больше capacity.
+        Строка обновляется условно по прежнему tokens_at, поэтому шарды
+        в разных процессах не возьмут одни и те же токены.
+        """
+        while True:
+            state = await db.get(SenderState, _SENDER_STATE_ID, populate_existing=True)
+            if not state:
+                db.add(SenderState(id=_SENDER_STATE_ID))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+                continue
+            now = utc_now()
+            if state.tokens_at is None:
+                tokens = capacity
+            else:
+                elapsed = max((now - state.tokens_at).total_seconds(), 0)
+                tokens = min(capacity, (state.tokens or 0) + elapsed * rate)
+            granted = min(wanted, int(tokens))
+            condition = (
+                SenderState.tokens_at.is_(None)
+                if state.tokens_at is None
+                else SenderState.tokens_at == state.tokens_at
+            )
+            result = await db.execute(
+                update(SenderState)
+                .where(and_(SenderState.id == _SENDER_STATE_ID, condition))
+                .values(tokens=tokens - granted, tokens_at=now)
+            )
+            await db.commit()
+            if result.rowcount:
+                return granted
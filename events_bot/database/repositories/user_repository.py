@@ -1,9 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, delete, insert
+from sqlalchemy import select, and_, or_, delete, insert, update, func
 from sqlalchemy.orm import selectinload
-from typing import List, Optional
-from ..models import User, Category, City, user_categories, user_cities, post_cities
-from ..models import Post, Like, ModerationRecord, post_categories
+from typing import AsyncIterator, List, Optional
+from datetime import datetime
+from ..models import User, Category, City, user_categories, user_cities, post_cities, utc_now
+from ..models import Post, Like, ModerationRecord, NotificationOutbox, post_categories
+from ..models import NotificationSend, notification_digest_posts
+from .media_repository import MediaRepository
+from ...utils.bitmask import SUBSCRIPTION_BITMASKS_ENABLED, ids_to_mask
 
 
 class UserRepository:
@@ -33,6 +37,32 @@ class UserRepository:
         await db.refresh(user)
         return user
 
+    @staticmethod
+    async def mark_unreachable(
+        db: AsyncSession, user_ids: List[int], reason: str
+    ) -> int:
+        """Отметить пользователей недоступными для рассылок"""
+        if not user_ids:
+            return 0
+        result = await db.execute(
+            update(User)
+            .where(and_(User.id.in_(user_ids), User.is_active == True))
+            .values(is_active=False, deactivated_at=utc_now(), deactivation_reason=reason)
+        )
+        await db.commit()
+        return result.rowcount or 0
+
+    @staticmethod
+    async def reactivate(db: AsyncSession, user_id: int) -> bool:
+        """Вернуть пользователя в рассылки"""
+        result = await db.execute(
+            update(User)
+            .where(and_(User.id == user_id, User.is_active == False))
+            .values(is_active=True, deactivated_at=None, deactivation_reason=None)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
     @staticmethod
     async def get_or_create_user(
         db: AsyncSession,
@@ -46,6 +76,10 @@ class UserRepository:
             user = await UserRepository.create_user(
                 db, telegram_id, username, first_name, last_name
             )
+        elif user.is_active is False:
+            # Пользователь снова написал боту — значит, он доступен
+            await UserRepository.reactivate(db, telegram_id)
+            await db.refresh(user)
         return user
 
     @staticmethod
@@ -61,6 +95,11 @@ class UserRepository:
                 for category_id in category_ids
             ]
             await db.execute(insert(user_categories).values(values))
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(category_mask=ids_to_mask(category_ids))
+        )
         await db.commit()
         result = await db.execute(
             select(User)
@@ -81,27 +120,187 @@ class UserRepository:
                 {"user_id": user_id, "city_id": city_id} for city_id in city_ids
             ]
             await db.execute(insert(user_cities).values(values))
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(city_mask=ids_to_mask(city_ids))
+        )
         await db.commit()
         result = await db.execute(
             select(User).where(User.id == user_id).options(selectinload(User.cities))
         )
         return result.scalar_one_or_none()
 
+    @staticmethod
+    def _subscribed_filter(ids: List[int], mask_column, link_user_id, link_item_id):
+        """Условие «пользователь подписан на один из ids» по маске или таблице связей.
+
+        У пользователя, подписанного на ID больше 63, маска NULL — для него
+        (и для ещё не заполненных масок) подписка проверяется по таблице связей.
+        """
+        link_filter = User.id.in_(select(link_user_id).where(link_item_id.in_(ids)))
+        mask = ids_to_mask(ids) if SUBSCRIPTION_BITMASKS_ENABLED else None
+        if mask is None:
+            return link_filter
+        return or_(
+            mask_column.op("&")(mask) != 0,
+            and_(mask_column.is_(None), link_filter),
+        )
+
+    @staticmethod
+    def _subscription_filter(city_ids: List[int], category_ids: List[int]):
+        """Условие подписки на один из городов и одну из категорий"""
+        return and_(
+            UserRepository._subscribed_filter(
+                city_ids, User.city_mask, user_cities.c.user_id, user_cities.c.city_id
+            ),
+            UserRepository._subscribed_filter(
+                category_ids,
+                User.category_mask,
+                user_categories.c.user_id,
+                user_categories.c.category_id,
+            ),
+        )
+
     @staticmethod
     async def get_users_by_cities_and_categories(
         db: AsyncSession, city_ids: List[int], category_ids: List[int]
     ) -> List[User]:
+        if SUBSCRIPTION_BITMASKS_ENABLED:
+            result = await db.execute(
+                select(User).where(
+                    and_(
+                        UserRepository._subscription_filter(city_ids, category_ids),
+                        User.is_active == True,
+                    )
+                )
+            )
+            return result.scalars().all()
         result = await db.execute(
             select(User)
             .distinct()
             .join(User.cities)
             .join(User.categories)
             .where(
-                and_(City.id.in_(city_ids), Category.id.in_(category_ids))
+                and_(
+                    City.id.in_(city_ids),
+                    Category.id.in_(category_ids),
+                    User.is_active == True,
+                )
             )
         )
         return result.scalars().all()
 
+    @staticmethod
+    async def stream_user_ids_by_cities_and_categories(
+        db: AsyncSession,
+        city_ids: List[int],
+        category_ids: List[int],
+        after_id: int = 0,
+        batch_size: int = 500,
+    ) -> AsyncIterator[List[int]]:
+        """Потоково выдавать ID подписчиков порциями по возрастанию ID.
+
+        Выбирается только users.id активных пользователей через серверный
+        курсор, поэтому память не зависит от размера аудитории. Сессия занята
+        курсором до конца перебора — записи нужно делать в другой сессии.
+        С SUBSCRIPTION_BITMASKS подписки проверяются по маскам в самой
+        таблице users; к user_cities/user_categories обращаются только для
+        пользователей без маски.
+        """
+        subscription_filter = UserRepository._subscription_filter(city_ids, category_ids)
+        result = await db.stream(
+            select(User.id)
+            .where(
+                and_(
+                    User.id > after_id,
+                    User.is_active == True,
+                    subscription_filter,
+                )
+            )
+            .order_by(User.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            yield [row.id for row in partition]
+
+    @staticmethod
+    def _segment_filter(
+        city_ids: Optional[List[int]] = None,
+        category_ids: Optional[List[int]] = None,
+        active_since: Optional[datetime] = None,
+    ):
+        """Условие на активных пользователей сегмента; пустой фильтр — все"""
+        conditions = [User.is_active == True]
+        if city_ids:
+            conditions.append(
+                UserRepository._subscribed_filter(
+                    city_ids, User.city_mask, user_cities.c.user_id, user_cities.c.city_id
+                )
+            )
+        if category_ids:
+            conditions.append(
+                UserRepository._subscribed_filter(
+                    category_ids,
+                    User.category_mask,
+                    user_categories.c.user_id,
+                    user_categories.c.category_id,
+                )
+            )
+        if active_since:
+            conditions.append(User.last_active_at >= active_since)
+        return and_(*conditions)
+
+    @staticmethod
+    async def count_active_users(
+        db: AsyncSession,
+        city_ids: Optional[List[int]] = None,
+        category_ids: Optional[List[int]] = None,
+        active_since: Optional[datetime] = None,
+    ) -> int:
+        result = await db.execute(
+            select(func.count(User.id)).where(
+                UserRepository._segment_filter(city_ids, category_ids, active_since)
+            )
+        )
+        return result.scalar() or 0
+
+    @staticmethod
+    async def stream_active_user_ids(
+        db: AsyncSession,
+        after_id: int = 0,
+        batch_size: int = 500,
+        city_ids: Optional[List[int]] = None,
+        category_ids: Optional[List[int]] = None,
+        active_since: Optional[datetime] = None,
+    ) -> AsyncIterator[List[int]]:
+        """Потоково выдавать ID активных пользователей порциями по возрастанию.
+
+        Сегмент (города, категории, активность с даты) проверяется в том же
+        запросе, выбираются только users.id.
+        """
+        result = await db.stream(
+            select(User.id)
+            .where(
+                and_(
+                    User.id > after_id,
+                    UserRepository._segment_filter(city_ids, category_ids, active_since),
+                )
+            )
+            .order_by(User.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            yield [row.id for row in partition]
+
+    @staticmethod
+    async def touch_last_active(db: AsyncSession, user_id: int) -> None:
+        """Запомнить время последнего обращения пользователя к боту"""
+        await db.execute(
+            update(User).where(User.id == user_id).values(last_active_at=utc_now())
+        )
+        await db.commit()
+
     @staticmethod
     async def delete_user(db: AsyncSession, user_id: int) -> bool:
         """Полное удаление пользователя (исправленная версия)"""
@@ -114,18 +313,40 @@ class UserRepository:
         await db.execute(delete(ModerationRecord).where(ModerationRecord.moderator_id == user_id))
         
         # 2. Находим все посты пользователя
-        posts_result = await db.execute(select(Post.id).where(Post.author_id == user_id))
-        post_ids = posts_result.scalars().all()
+        posts_result = await db.execute(
+            select(Post.id, Post.image_id, Post.thumbnail_id).where(Post.author_id == user_id)
+        )
+        post_rows = posts_result.all()
+        post_ids = [row.id for row in post_rows]
         
         if post_ids:
             # 3. Удаляем все, что ссылается на его посты
             await db.execute(delete(Like).where(Like.post_id.in_(post_ids)))
+            await db.execute(
+                delete(NotificationOutbox).where(
+                    NotificationOutbox.post_id.in_(post_ids)
+                )
+            )
+            await db.execute(
+                delete(NotificationSend).where(
+                    NotificationSend.post_id.in_(post_ids)
+                )
+            )
+            await db.execute(
+                delete(notification_digest_posts).where(
+                    notification_digest_posts.c.post_id.in_(post_ids)
+                )
+            )
             await db.execute(delete(ModerationRecord).where(ModerationRecord.post_id.in_(post_ids)))
             await db.execute(delete(post_categories).where(post_categories.c.post_id.in_(post_ids)))
             await db.execute(delete(post_cities).where(post_cities.c.post_id.in_(post_ids)))
             
             # 4. Удаляем сами посты
             await db.execute(delete(Post).where(Post.id.in_(post_ids)))
+            await MediaRepository.release(
+                db,
+                [key for row in post_rows for key in (row.image_id, row.thumbnail_id) if key],
+            )
 
         # 5. Удаляем связи пользователя из m2m таблиц
         await db.execute(delete(user_categories).where(user_categories.c.user_id == user_id))
@@ -139,7 +360,10 @@ class UserRepository:
 
     # НОВЫЙ МЕТОД ДЛЯ РАССЫЛКИ
     @staticmethod
-    async def get_all_users(db: AsyncSession) -> List[User]:
+    async def get_all_users(db: AsyncSession, only_active: bool = False) -> List[User]:
         """Получить всех пользователей"""
-        result = await db.execute(select(User))
+        stmt = select(User)
+        if only_active:
+            stmt = stmt.where(User.is_active == True)
+        result = await db.execute(stmt)
         return list(result.scalars().all())
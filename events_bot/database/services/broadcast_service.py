@@ -0,0 +1,163 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timedelta
+from ..repositories import BroadcastRepository, UserRepository
+from ..models import BroadcastJob, BroadcastStatus, utc_now
+from ...utils.audience_spill import remove_audience
+from ...utils.msk_time import MSK_OFFSET
+
+STATUS_TITLES = {
+    BroadcastStatus.SCHEDULED.value: "🕒 Рассылка запланирована",
+    BroadcastStatus.RUNNING.value: "⏳ Рассылка идёт",
+    BroadcastStatus.PAUSED.value: "⏸ Рассылка приостановлена",
+    BroadcastStatus.CANCELLED.value: "⛔️ Рассылка отменена",
+    BroadcastStatus.DONE.value: "✅ Рассылка завершена!",
+}
+
+
+# Параметры сегмента в начале текста /broadcast: city=1,2 category=3 active=30
+SEGMENT_OPTIONS = ("city", "category", "active")
+
+# Формат времени отправки в /broadcast_at (по Москве)
+SCHEDULE_FORMAT = "%d.%m.%Y %H:%M"
+
+
+class BroadcastService:
+    """Асинхронный сервис для рассылок администратора"""
+
+    @staticmethod
+    def parse_segment(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Отделить параметры сегмента от текста рассылки.
+
+        Параметры идут в начале текста: city=<ID,...> — подписчики городов,
+        category=<ID,...> — подписчики категорий, active=<дней> — обращались
+        к боту за последние дни. Возвращает (сегмент или None, текст).
+        Raises:
+            ValueError: если значение параметра не число
+        """
+        segment: Dict[str, Any] = {}
+        words = text.split(" ")
+        while words and "=" in words[0] and words[0].split("=", 1)[0] in SEGMENT_OPTIONS:
+            key, value = words.pop(0).split("=", 1)
+            if key == "active":
+                active_since = utc_now() - timedelta(days=int(value))
+                segment["active_since"] = active_since.isoformat()
+            else:
+                segment[f"{key}_ids"] = [int(item) for item in value.split(",") if item]
+        return (segment or None), " ".join(words).strip()
+
+    @staticmethod
+    def parse_schedule(text: str) -> Tuple[datetime, str]:
+        """Отделить время отправки «ДД.ММ.ГГГГ ЧЧ:ММ» (МСК) от остального текста.
+
+        Возвращает (время отправки в UTC, остаток текста).
+        Raises:
+            ValueError: если время не указано, не разобрано или уже прошло
+        """
+        words = text.split(" ", 2)
+        if len(words) < 2:
+            raise ValueError("не указано время отправки")
+        scheduled_msk = datetime.strptime(f"{words[0]} {words[1]}", SCHEDULE_FORMAT)
+        scheduled_at = scheduled_msk - MSK_OFFSET
+        if scheduled_at <= utc_now():
+            raise ValueError("время отправки уже прошло")
+        return scheduled_at, (words[2] if len(words) > 2 else "").strip()
+
+    @staticmethod
+    def segment_filters(segment: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Аргументы фильтра пользователей для сохранённого сегмента"""
+        if not segment:
+            return {}
+        active_since = segment.get("active_since")
+        return {
+            "city_ids": segment.get("city_ids"),
+            "category_ids": segment.get("category_ids"),
+            "active_since": datetime.fromisoformat(active_since) if active_since else None,
+        }
+
+    @staticmethod
+    async def create_broadcast(
+        db: AsyncSession,
+        text: str,
+        created_by: int,
+        segment: Optional[Dict[str, Any]] = None,
+        scheduled_at: Optional[datetime] = None,
+    ) -> BroadcastJob:
+        """Создать рассылку активным пользователям сегмента (по умолчанию всем).
+
+        Для запланированной рассылки total — оценка, точное число получателей
+        определяется при подготовке списка перед отправкой.
+        """
+        total = await UserRepository.count_active_users(
+            db, **BroadcastService.segment_filters(segment)
+        )
+        return await BroadcastRepository.create(
+            db, text, created_by, total, segment, scheduled_at
+        )
+
+    @staticmethod
+    async def get_broadcast(db: AsyncSession, job_id: int) -> Optional[BroadcastJob]:
+        return await BroadcastRepository.get(db, job_id)
+
+    @staticmethod
+    async def set_progress_message(
+        db: AsyncSession, job_id: int, chat_id: int, message_id: int
+    ) -> None:
+        await BroadcastRepository.set_progress_message(db, job_id, chat_id, message_id)
+
+    @staticmethod
+    async def pause(db: AsyncSession, job_id: int) -> bool:
+        return await BroadcastRepository.change_status(
+            db, job_id, BroadcastStatus.PAUSED, [BroadcastStatus.RUNNING]
+        )
+
+    @staticmethod
+    async def resume(db: AsyncSession, job_id: int) -> bool:
+        return await BroadcastRepository.change_status(
+            db, job_id, BroadcastStatus.RUNNING, [BroadcastStatus.PAUSED]
+        )
+
+    @staticmethod
+    async def cancel(db: AsyncSession, job_id: int) -> bool:
+        cancelled = await BroadcastRepository.change_status(
+            db,
+            job_id,
+            BroadcastStatus.CANCELLED,
+            [BroadcastStatus.SCHEDULED, BroadcastStatus.RUNNING, BroadcastStatus.PAUSED],
+        )
+        if cancelled:
+            job = await BroadcastRepository.get(db, job_id)
+            # Подготовленный список получателей больше не нужен
+            await remove_audience(job.audience_path if job else None)
+        return cancelled
+
+    @staticmethod
+    def format_segment(segment: Optional[Dict[str, Any]]) -> str:
+        if not segment:
+            return "все пользователи"
+        parts = []
+        if segment.get("city_ids"):
+            parts.append("города " + ", ".join(map(str, segment["city_ids"])))
+        if segment.get("category_ids"):
+            parts.append("категории " + ", ".join(map(str, segment["category_ids"])))
+        if segment.get("active_since"):
+            active_since = datetime.fromisoformat(segment["active_since"])
+            parts.append(f"активны с {active_since:%d.%m.%Y}")
+        return "; ".join(parts)
+
+    @staticmethod
+    def format_progress(job: BroadcastJob) -> str:
+        """Текст сообщения о прогрессе рассылки"""
+        processed = job.sent_count + job.error_count
+        schedule = ""
+        if job.scheduled_at:
+            schedule = f"Отправка: {job.scheduled_at + MSK_OFFSET:{SCHEDULE_FORMAT}} (МСК)\n"
+        return (
+            f"{STATUS_TITLES.get(job.status, job.status)} (№{job.id})\n"
+            f"{schedule}"
+            f"Получатели: {BroadcastService.format_segment(job.segment)}\n"
+            f"Прогресс: {processed}/{job.total}\n"
+            f"Успешно: {job.sent_count}\n"
+            f"Ошибок: {job.error_count}\n\n"
+            f"{job.text}"
+        )
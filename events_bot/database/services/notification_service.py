@@ -1,13 +1,43 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import math
+import os
+import time
 import logfire
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from ..repositories import UserRepository
-from ..models import User, Post, Like
+from ..repositories import (
+    UserRepository,
+    OutboxRepository,
+    DigestRepository,
+    DeliveryRepository,
+    SendQueueRepository,
+)
+from ..subscription_index import subscription_index
+from ..models import (
+    User,
+    Post,
+    NotificationOutbox,
+    NotificationDigest,
+    NotificationDelivery,
+    SendStatus,
+    utc_now,
+)
 from ...utils import get_clean_category_string
 from ...bot.keyboards.notification_keyboard import get_post_notification_keyboard
-from ...storage import file_storage
+from .post_service import PostService
+from .user_service import UserService
+from ...utils.telegram import get_unreachable_reason
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, InputFile, Message
+
+# Режим дайджеста: посты, одобренные за окно (в минутах), рассылаются одним
+# сообщением. 0 — каждый пост рассылается сразу после одобрения
+NOTIFICATION_DIGEST_WINDOW_MINUTES = int(os.getenv("NOTIFICATION_DIGEST_WINDOW_MINUTES", 0))
+# Сколько постов перечислять в одном дайджесте
+DIGEST_MAX_POSTS = 10
 
 
 class NotificationService:
@@ -32,6 +62,47 @@ class NotificationService:
         )
         return users
 
+    @staticmethod
+    async def enqueue_post_notification(
+        db: AsyncSession, post_id: int
+    ) -> Union[NotificationOutbox, NotificationDigest]:
+        """Поставить рассылку уведомлений о посте в очередь.
+
+        В режиме дайджеста пост добавляется в текущий дайджест и будет
+        разослан вместе с остальными постами окна одним сообщением.
+        """
+        if NOTIFICATION_DIGEST_WINDOW_MINUTES > 0:
+            digest = await DigestRepository.add_post(db, post_id)
+            logfire.info(f"Пост {post_id} добавлен в дайджест {digest.id}")
+            return digest
+        job = await OutboxRepository.enqueue(db, post_id)
+        logfire.info(f"Рассылка о посте {post_id} поставлена в очередь (задание {job.id})")
+        return job
+
+    @staticmethod
+    async def iter_recipient_ids(
+        db: AsyncSession, post: Post, after_id: int = 0, batch_size: int = 500
+    ) -> AsyncIterator[List[int]]:
+        """Потоково выдавать получателей уведомления о посте порциями.
+
+        Если загружен индекс подписок, получатели вычисляются в памяти
+        без запросов к базе.
+        """
+        city_ids = [c.id for c in post.cities]
+        category_ids = [cat.id for cat in post.categories]
+        if not city_ids or not category_ids:
+            return
+        if subscription_index.loaded:
+            for user_ids in subscription_index.iter_recipient_batches(
+                city_ids, category_ids, after_id=after_id, batch_size=batch_size
+            ):
+                yield user_ids
+            return
+        async for user_ids in UserRepository.stream_user_ids_by_cities_and_categories(
+            db, city_ids, category_ids, after_id=after_id, batch_size=batch_size
+        ):
+            yield user_ids
+
     @staticmethod
     def format_post_notification(post: Post) -> str:
         """Форматировать уведомление о посте"""
@@ -60,60 +131,353 @@ class NotificationService:
         return "\n".join(lines)
 
     @staticmethod
-    async def send_post_notification(bot: Bot, post: Post, users: List[User], db: AsyncSession) -> None:
-        """Отправить уведомления о новом посте"""
-        logfire.info(f"Отправляем уведомления о посте {post.id} {len(users)} пользователям")
-        
+    def format_event_reminder(post: Post) -> str:
+        """Форматировать напоминание о мероприятии из избранного"""
+        return "⏰ <b>Напоминание: скоро мероприятие из вашего избранного</b>\n\n" + (
+            NotificationService.format_post_notification(post)
+        )
+
+    @staticmethod
+    async def build_event_reminder_payload(
+        post: Post, db: AsyncSession
+    ) -> "NotificationPayload":
+        """Подготовить напоминание о посте один раз для всех лайкнувших"""
         await db.refresh(post, attribute_names=["author", "categories", "cities"])
-        
-        notification_text = NotificationService.format_post_notification(post)
-        post_url = getattr(post, "url", None)
+        return NotificationPayload(
+            text=NotificationService.format_event_reminder(post),
+            reply_markup=get_post_notification_keyboard(
+                post_id=post.id,
+                is_liked=True,
+                url=getattr(post, "url", None),
+            ),
+            photo=await PostService.get_post_photo(post),
+        )
 
+    @staticmethod
+    def format_digest(posts: List[Post]) -> str:
+        """Форматировать дайджест новых мероприятий"""
+        lines = ["📬 <b>Новые мероприятия по вашим интересам</b>", ""]
+        for post in posts[:DIGEST_MAX_POSTS]:
+            category_str = get_clean_category_string(post.categories)
+            event_at = getattr(post, "event_at", None)
+            lines.append(f"<b>{post.title}</b>")
+            lines.append(f"<i>   ⭐️ {category_str}</i>")
+            if event_at:
+                lines.append(f"<i>   🗓 {event_at.strftime('%d.%m.%Y %H:%M')}</i>")
+            lines.append("")
+        if len(posts) > DIGEST_MAX_POSTS:
+            lines.append(f"И ещё {len(posts) - DIGEST_MAX_POSTS} в актуальном")
+        return "\n".join(lines).rstrip()
+
+    @staticmethod
+    async def send_digest(
+        bot: Bot,
+        user_posts: Dict[int, List[Post]],
+        db: AsyncSession,
+        reply_markup: InlineKeyboardMarkup,
+    ) -> Tuple[int, int]:
+        """Отправить каждому пользователю один дайджест, вернуть (успешно, ошибок)"""
         success_count = 0
         error_count = 0
+        unreachable: Dict[str, List[int]] = {}
 
-        for user in users:
+        for user_id, posts in user_posts.items():
+            payload = NotificationPayload(
+                text=NotificationService.format_digest(posts),
+                reply_markup=reply_markup,
+            )
             try:
-                logfire.debug(f"Отправляем уведомление пользователю {user.id}")
+                await NotificationService.send_payload(bot, user_id, payload)
+                success_count += 1
+            except Exception as e:
+                error_count += 1
+                NotificationService._collect_send_error(user_id, e, unreachable)
 
-                is_liked = await db.scalar(
-                    select(Like.id).where(Like.user_id == user.id, Like.post_id == post.id)
-                ) is not None
+        await NotificationService._mark_unreachable(db, unreachable)
+        return success_count, error_count
 
-                keyboard = get_post_notification_keyboard(
-                    post_id=post.id,
-                    is_liked=is_liked,
-                    url=post_url,
-                )
+    @staticmethod
+    def _collect_send_error(
+        user_id: int, error: Exception, unreachable: Dict[str, List[int]]
+    ) -> None:
+        reason = get_unreachable_reason(error)
+        if reason:
+            logfire.info(f"Пользователь {user_id} недоступен ({reason}), исключаем из рассылок")
+            unreachable.setdefault(reason, []).append(user_id)
+        else:
+            logfire.warning(f"Ошибка отправки уведомления пользователю {user_id}: {error}")
+
+    @staticmethod
+    async def _mark_unreachable(db: AsyncSession, unreachable: Dict[str, List[int]]) -> None:
+        for reason, unreachable_ids in unreachable.items():
+            await UserService.mark_unreachable(db, unreachable_ids, reason)
+
+    @staticmethod
+    async def build_post_notification_payload(
+        post: Post, db: AsyncSession
+    ) -> "NotificationPayload":
+        """Подготовить уведомление о посте один раз для всех получателей.
+
+        Для только что опубликованного поста лайков ещё нет, поэтому
+        клавиатура одна и та же у всех получателей.
+        """
+        await db.refresh(post, attribute_names=["author", "categories", "cities"])
+        return NotificationPayload(
+            text=NotificationService.format_post_notification(post),
+            reply_markup=get_post_notification_keyboard(
+                post_id=post.id,
+                is_liked=False,
+                url=getattr(post, "url", None),
+            ),
+            photo=await PostService.get_post_photo(post),
+        )
+
+    @staticmethod
+    async def send_payload(
+        bot: Bot, chat_id: int, payload: "NotificationPayload"
+    ) -> Message:
+        """Отправить подготовленное уведомление в чат"""
+        if payload.photo:
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=payload.photo,
+                caption=payload.text,
+                reply_markup=payload.reply_markup,
+                parse_mode=payload.parse_mode,
+            )
+        return await bot.send_message(
+            chat_id=chat_id,
+            text=payload.text,
+            reply_markup=payload.reply_markup,
+            parse_mode=payload.parse_mode,
+        )
+
+    @staticmethod
+    async def _send_payload_with_retry(
+        bot: Bot,
+        chat_id: int,
+        payload: "NotificationPayload",
+        stats: Optional["DeliveryStats"] = None,
+    ) -> Message:
+        try:
+            return await NotificationService.send_payload(bot, chat_id, payload)
+        except TelegramRetryAfter as e:
+            # Отправки уже приостановлены планировщиком запросов, повторяем один раз
+            if stats:
+                stats.retries += 1
+            await asyncio.sleep(e.retry_after)
+            return await NotificationService.send_payload(bot, chat_id, payload)
+
+    @staticmethod
+    async def send_post_notification(
+        bot: Bot,
+        post: Post,
+        user_ids: List[int],
+        db: AsyncSession,
+        payload: Optional["NotificationPayload"] = None,
+        stats: Optional["DeliveryStats"] = None,
+    ) -> Tuple[int, int]:
+        """Отправить уведомления о новом посте, вернуть (успешно, ошибок).
+
+        Если передан stats, в него записываются результаты и задержки отправок.
+        """
+        logfire.info(f"Отправляем уведомления о посте {post.id} {len(user_ids)} пользователям")
+
+        if payload is None:
+            payload = await NotificationService.build_post_notification_payload(post, db)
 
-                if post.image_id:
-                    media_photo = await file_storage.get_media_photo(post.image_id)
-                    if media_photo:
-                        await bot.send_photo(
-                            chat_id=user.id,
-                            photo=media_photo.media,
-                            caption=notification_text,
-                            reply_markup=keyboard,
-                            parse_mode="HTML"
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id=user.id,
-                            text=notification_text,
-                            reply_markup=keyboard,
-                            parse_mode="HTML"
-                        )
-                else:
-                    await bot.send_message(
-                        chat_id=user.id,
-                        text=notification_text,
-                        reply_markup=keyboard,
-                        parse_mode="HTML"
-                    )
+        success_count = 0
+        error_count = 0
+        unreachable: Dict[str, List[int]] = {}
 
+        for user_id in user_ids:
+            started = time.monotonic()
+            try:
+                logfire.debug(f"Отправляем уведомление пользователю {user_id}")
+                sent = await NotificationService._send_payload_with_retry(
+                    bot, user_id, payload, stats
+                )
+                if stats:
+                    stats.record_sent(time.monotonic() - started)
+                # Картинка загружается в Telegram один раз, дальше рассылаем по file_id
+                if payload.photo and not isinstance(payload.photo, str):
+                    payload.photo = await PostService.remember_telegram_file_id(
+                        db, post, sent
+                    ) or payload.photo
                 success_count += 1
             except Exception as e:
-                logfire.warning(f"Ошибка отправки уведомления пользователю {user.id}: {e}")
                 error_count += 1
+                if stats:
+                    stats.record_failure(get_unreachable_reason(e) or type(e).__name__)
+                NotificationService._collect_send_error(user_id, e, unreachable)
+
+        await NotificationService._mark_unreachable(db, unreachable)
 
         logfire.info(f"Уведомления отправлены: успех={success_count}, ошибок={error_count}")
+        return success_count, error_count
+
+    @staticmethod
+    async def record_delivery(
+        db: AsyncSession,
+        post: Post,
+        stats: "DeliveryStats",
+        started_at: Optional[datetime] = None,
+    ) -> NotificationDelivery:
+        """Сохранить итоги рассылки о посте"""
+        p50 = stats.latency_percentile(50)
+        p95 = stats.latency_percentile(95)
+        return await DeliveryRepository.create(
+            db,
+            post_id=post.id,
+            post_title=post.title[:255],
+            audience_size=stats.audience_size,
+            sent_count=stats.sent,
+            failed_count=stats.failed,
+            failures=dict(stats.failures),
+            retries=stats.retries,
+            started_at=started_at,
+            first_send_at=stats.first_send_at,
+            last_send_at=stats.last_send_at,
+            latency_p50_ms=p50 * 1000 if p50 is not None else None,
+            latency_p95_ms=p95 * 1000 if p95 is not None else None,
+        )
+
+    @staticmethod
+    async def build_sharded_delivery_stats(db: AsyncSession, post_id: int) -> "DeliveryStats":
+        """Статистика рассылки о посте по результатам отправок шардов"""
+        stats = DeliveryStats()
+        for status, attempts, sent_at, latency_ms, error_class in (
+            await SendQueueRepository.get_post_results(db, post_id)
+        ):
+            stats.retries += max(attempts - 1, 0)
+            if status == SendStatus.DONE.value:
+                stats.sent += 1
+                if latency_ms is not None:
+                    stats.latencies.append(latency_ms / 1000)
+            else:
+                error_class = error_class or "sender"
+                stats.failures[error_class] = stats.failures.get(error_class, 0) + 1
+            if sent_at is not None:
+                stats.first_send_at = min(stats.first_send_at or sent_at, sent_at)
+                stats.last_send_at = max(stats.last_send_at or sent_at, sent_at)
+        return stats
+
+    @staticmethod
+    async def get_recent_deliveries(
+        db: AsyncSession, limit: int = 10
+    ) -> List[NotificationDelivery]:
+        """Последние рассылки уведомлений"""
+        return await DeliveryRepository.get_recent(db, limit)
+
+    @staticmethod
+    async def get_post_delivery(
+        db: AsyncSession, post_id: int
+    ) -> Optional[NotificationDelivery]:
+        """Итоги последней рассылки о посте"""
+        return await DeliveryRepository.get_by_post(db, post_id)
+
+    @staticmethod
+    def _format_seconds_since(start: Optional[datetime], end: Optional[datetime]) -> str:
+        if not start or not end:
+            return "—"
+        return f"{(end - start).total_seconds():.1f} с"
+
+    @staticmethod
+    def _format_ms(value: Optional[float]) -> str:
+        return f"{value:.0f}" if value is not None else "—"
+
+    @staticmethod
+    def format_delivery_report(delivery: NotificationDelivery) -> str:
+        """Подробный отчёт о рассылке"""
+        failures = ", ".join(
+            f"{error_class}: {count}"
+            for error_class, count in sorted(
+                (delivery.failures or {}).items(), key=lambda item: -item[1]
+            )
+        )
+        lines = [
+            f"📊 Рассылка о «{delivery.post_title}» (ID {delivery.post_id})",
+            f"Аудитория: {delivery.audience_size}",
+            f"Доставлено: {delivery.sent_count}",
+            f"Ошибок: {delivery.failed_count}" + (f" ({failures})" if failures else ""),
+            f"Повторов: {delivery.retries}",
+            "До первой отправки: "
+            + NotificationService._format_seconds_since(delivery.started_at, delivery.first_send_at),
+            "До последней отправки: "
+            + NotificationService._format_seconds_since(delivery.started_at, delivery.last_send_at),
+            "Задержка отправки p50/p95: "
+            f"{NotificationService._format_ms(delivery.latency_p50_ms)}/"
+            f"{NotificationService._format_ms(delivery.latency_p95_ms)} мс",
+        ]
+        return "\n".join(lines)
+
+    @staticmethod
+    def format_delivery_summary(deliveries: List[NotificationDelivery]) -> str:
+        """Краткая сводка по нескольким рассылкам"""
+        lines = ["📊 Последние рассылки уведомлений:", ""]
+        for delivery in deliveries:
+            duration = NotificationService._format_seconds_since(
+                delivery.started_at, delivery.last_send_at
+            )
+            lines.append(
+                f"ID {delivery.post_id} «{delivery.post_title}»: "
+                f"{delivery.sent_count}/{delivery.audience_size}, "
+                f"ошибок {delivery.failed_count}, {duration}, "
+                f"p95 {NotificationService._format_ms(delivery.latency_p95_ms)} мс"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class NotificationPayload:
+    """Готовое к отправке уведомление: одно и то же для всех получателей"""
+
+    text: str
+    reply_markup: InlineKeyboardMarkup
+    photo: Optional[Union[str, InputFile]] = None
+    parse_mode: str = "HTML"
+
+
+@dataclass
+class DeliveryStats:
+    """Накопитель статистики одной рассылки"""
+
+    sent: int = 0
+    # Количество ошибок по классам (причина недоступности или тип исключения)
+    failures: Dict[str, int] = field(default_factory=dict)
+    retries: int = 0
+    first_send_at: Optional[datetime] = None
+    last_send_at: Optional[datetime] = None
+    # Длительность каждой успешной отправки в секундах
+    latencies: List[float] = field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return sum(self.failures.values())
+
+    @property
+    def audience_size(self) -> int:
+        return self.sent + self.failed
+
+    def _touch(self) -> None:
+        now = utc_now()
+        if self.first_send_at is None:
+            self.first_send_at = now
+        self.last_send_at = now
+
+    def record_sent(self, latency: float) -> None:
+        self._touch()
+        self.sent += 1
+        self.latencies.append(latency)
+
+    def record_failure(self, error_class: str) -> None:
+        self._touch()
+        self.failures[error_class] = self.failures.get(error_class, 0) + 1
+
+    def latency_percentile(self, percent: float) -> Optional[float]:
+        """Перцентиль задержки отправки (nearest-rank), в секундах"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
@@ -1,15 +1,20 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
-from datetime import datetime, timezone
-from ..repositories import PostRepository
-from ..models import Post
+from typing import List, Optional, Union
+from datetime import datetime, timedelta, timezone
+from ..repositories import MediaRepository, PostRepository
+from ..models import Post, utc_now
 import os
 import logfire
 from events_bot.bot.keyboards.moderation_keyboard import get_moderation_keyboard
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
 from events_bot.storage import file_storage
-from aiogram.types import FSInputFile, InputMediaPhoto
+from aiogram.types import FSInputFile, InputFile, InputMediaPhoto, Message
 from .moderation_service import ModerationService
 
+# Сколько минут файл без ссылок хранится до удаления: загруженная картинка
+# ждёт, пока автор закончит создание поста
+MEDIA_RELEASE_GRACE_MINUTES = int(os.getenv("MEDIA_RELEASE_GRACE_MINUTES", 60))
+
 
 class PostService:
     """Асинхронный сервис для работы с постами"""
@@ -27,6 +32,9 @@ class PostService:
         url: str | None = None,
         address: str | None = None,
         bot=None,
+        image_content_type: str | None = None,
+        thumbnail_id: str | None = None,
+        image_telegram_file_id: str | None = None,
     ) -> Post:
         parsed_event_at = None
         if event_at is not None:
@@ -38,12 +46,32 @@ class PostService:
             except Exception:
                 parsed_event_at = None
         post = await PostRepository.create_post(
-            db, title, content, author_id, category_ids, city_names, image_id, parsed_event_at, url, address
+            db, title, content, author_id, category_ids, city_names, image_id, parsed_event_at, url, address,
+            image_content_type, thumbnail_id,
         )
+        if post and post.image_id and image_telegram_file_id and bot:
+            await PostService._ensure_post_image(db, post, bot, image_telegram_file_id)
         if post and bot:
             await PostService.send_post_to_moderation(bot, post, db)
         return post
 
+    @staticmethod
+    async def _ensure_post_image(db: AsyncSession, post: Post, bot, telegram_file_id: str) -> None:
+        """Загрузить картинку поста заново, если её файл удалили до того, как пост взял ссылку.
+
+        Загрузка не записывает файл, который уже есть в хранилище; если тот же
+        файл в это время удалялся как ненужный, пост остался бы без картинки.
+        """
+        keys = [key for key in (post.image_id, post.thumbnail_id) if key]
+        if all([await file_storage.file_exists(key) for key in keys]):
+            return
+        logfire.warning(f"Файл картинки поста {post.id} удалён при создании поста, загружаем заново")
+        stored_file = await file_storage.save_telegram_photo(bot, telegram_file_id, "jpg")
+        if (stored_file.key, stored_file.thumbnail_key) != (post.image_id, post.thumbnail_id):
+            await PostRepository.replace_image(
+                db, post, stored_file.key, stored_file.content_type, stored_file.thumbnail_key
+            )
+
     @staticmethod
     async def send_post_to_moderation(bot, post: Post, db=None):
         moderation_group_id = os.getenv("MODERATION_GROUP_ID")
@@ -57,30 +85,65 @@ class PostService:
         moderation_keyboard = get_moderation_keyboard(post.id)
         logfire.info(f"Отправляем пост {post.id} на модерацию в группу {moderation_group_id}")
         logfire.debug(f"Текст модерации: {moderation_text[:100]}...")
-        try:
-            if post.image_id:
-                media_photo = await file_storage.get_media_photo(post.image_id)
-                if media_photo:
-                    await bot.send_photo(
-                        chat_id=moderation_group_id,
-                        photo=media_photo.media,
-                        caption=moderation_text,
-                        reply_markup=moderation_keyboard,
-                        parse_mode="HTML",
-                    )
-                    return
-                else:
-                    logfire.warning("Изображение не найдено")
-            await bot.send_message(
-                chat_id=moderation_group_id,
-                text=moderation_text,
-                reply_markup=moderation_keyboard,
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            logfire.error(f"Ошибка отправки поста на модерацию: {e}")
-            import traceback
-            logfire.error(f"Стек ошибки: {traceback.format_exc()}")
+        with request_priority(RequestPriority.MODERATION):
+            try:
+                if post.image_id:
+                    photo = await PostService.get_post_photo(post)
+                    if photo:
+                        sent = await bot.send_photo(
+                            chat_id=moderation_group_id,
+                            photo=photo,
+                            caption=moderation_text,
+                            reply_markup=moderation_keyboard,
+                            parse_mode="HTML",
+                        )
+                        if db:
+                            await PostService.remember_telegram_file_id(db, post, sent)
+                        return
+                    else:
+                        logfire.warning("Изображение не найдено")
+                await bot.send_message(
+                    chat_id=moderation_group_id,
+                    text=moderation_text,
+                    reply_markup=moderation_keyboard,
+                    parse_mode="HTML",
+                )
+            except Exception as e:
+                logfire.error(f"Ошибка отправки поста на модерацию: {e}")
+                import traceback
+                logfire.error(f"Стек ошибки: {traceback.format_exc()}")
+
+    @staticmethod
+    async def get_post_photo(post: Post) -> Optional[Union[str, InputFile]]:
+        """Получить картинку поста для отправки в Telegram.
+
+        Если картинка уже отправлялась, возвращает сохранённый file_id,
+        иначе загружает её из файлового хранилища.
+        """
+        if not post.image_id:
+            return None
+        if post.telegram_file_id:
+            return post.telegram_file_id
+        media_photo = await file_storage.get_media_photo(post.image_id)
+        return media_photo.media if media_photo else None
+
+    @staticmethod
+    async def remember_telegram_file_id(
+        db: AsyncSession, post: Post, sent_message: Optional[Message]
+    ) -> Optional[str]:
+        """Сохранить file_id картинки из отправленного сообщения"""
+        if not sent_message or not sent_message.photo:
+            return post.telegram_file_id
+        telegram_file_id = sent_message.photo[-1].file_id
+        if post.telegram_file_id != telegram_file_id:
+            post.telegram_file_id = telegram_file_id
+            try:
+                await PostRepository.set_telegram_file_id(db, post.id, telegram_file_id)
+            except Exception as e:
+                logfire.warning(
+                    f"Не удалось сохранить file_id картинки поста {post.id}: {e}"
+                )
+        return telegram_file_id
 
     @staticmethod
     async def get_user_posts(db: AsyncSession, user_id: int) -> List[Post]:
@@ -150,6 +213,44 @@ class PostService:
     async def get_expired_posts_info(db: AsyncSession) -> list[dict]:
         return await PostRepository.get_expired_posts_info(db)
 
+    @staticmethod
+    async def register_uploaded_media(db: AsyncSession, keys: List[Optional[str]]) -> None:
+        """Учесть только что загруженные файлы, пока на них не ссылается ни один пост.
+
+        Без строки в media_objects файл из брошенного создания поста
+        никогда не был бы удалён; строка со счётчиком 0 удаляется
+        collect_unreferenced_media после отсрочки.
+        """
+        await MediaRepository.register(db, [key for key in keys if key])
+        await db.commit()
+
+    @staticmethod
+    async def collect_unreferenced_media(db: AsyncSession, batch_size: int = 500) -> int:
+        """Удалить из хранилища файлы, на которые не ссылается ни один пост.
+
+        Файл удаляется, если ссылок на него нет дольше
+        MEDIA_RELEASE_GRACE_MINUTES: так не пропадает картинка поста,
+        который автор ещё создаёт. Возвращает количество удалённых файлов.
+        """
+        released_before = utc_now() - timedelta(minutes=MEDIA_RELEASE_GRACE_MINUTES)
+        removed = 0
+        while True:
+            keys = await MediaRepository.get_unreferenced(db, batch_size, released_before)
+            if not keys:
+                return removed
+            try:
+                deleted = await MediaRepository.delete_unreferenced(db, keys, released_before)
+                # Файлы удаляются до фиксации: строки заблокированы, и пост,
+                # берущий ссылку на тот же файл, дождётся конца удаления
+                await file_storage.delete_files(deleted)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            removed += len(deleted)
+            if len(keys) < batch_size:
+                return removed
+
     @staticmethod
     async def delete_post(db: AsyncSession, post_id: int) -> bool:
         """Удалить пост по ID"""
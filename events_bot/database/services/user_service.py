@@ -4,6 +4,8 @@ from sqlalchemy.orm import selectinload
 from typing import List
 from ..repositories import UserRepository
 from ..models import User, Category, City
+from ..subscription_index import subscription_index
+import logfire
 
 
 class UserService:
@@ -17,21 +19,28 @@ class UserService:
         first_name: str = None,
         last_name: str = None,
     ) -> User:
-        return await UserRepository.get_or_create_user(
+        user = await UserRepository.get_or_create_user(
             db, telegram_id, username, first_name, last_name
         )
+        if user and user.is_active:
+            subscription_index.activate(user.id)
+        return user
 
     @staticmethod
     async def select_categories(
         db: AsyncSession, user_id: int, category_ids: List[int]
     ) -> User:
-        return await UserRepository.add_categories_to_user(db, user_id, category_ids)
+        user = await UserRepository.add_categories_to_user(db, user_id, category_ids)
+        subscription_index.set_user_categories(user_id, category_ids)
+        return user
 
     @staticmethod
     async def select_cities(
         db: AsyncSession, user_id: int, city_ids: List[int]
     ) -> User:
-        return await UserRepository.add_cities_to_user(db, user_id, city_ids)
+        user = await UserRepository.add_cities_to_user(db, user_id, city_ids)
+        subscription_index.set_user_cities(user_id, city_ids)
+        return user
 
     @staticmethod
     async def get_user_categories(db: AsyncSession, user_id: int) -> List[Category]:
@@ -56,10 +65,22 @@ class UserService:
     @staticmethod
     async def delete_user(db: AsyncSession, user_id: int) -> bool:
         """Удалить пользователя по ID"""
-        return await UserRepository.delete_user(db, user_id)
+        deleted = await UserRepository.delete_user(db, user_id)
+        if deleted:
+            subscription_index.remove_user(user_id)
+        return deleted
 
     # НОВЫЙ МЕТОД ДЛЯ РАССЫЛКИ
     @staticmethod
-    async def get_all_users(db: AsyncSession) -> List[User]:
+    async def get_all_users(db: AsyncSession, only_active: bool = False) -> List[User]:
         """Получить всех пользователей"""
-        return await UserRepository.get_all_users(db)
+        return await UserRepository.get_all_users(db, only_active)
+
+    @staticmethod
+    async def mark_unreachable(db: AsyncSession, user_ids: List[int], reason: str) -> int:
+        """Исключить недоступных пользователей из рассылок"""
+        count = await UserRepository.mark_unreachable(db, user_ids, reason)
+        subscription_index.deactivate(user_ids)
+        if count:
+            logfire.info(f"Отмечено недоступными пользователей: {count} (причина: {reason})")
+        return count
@@ -0,0 +1,222 @@
+"""
+Обратный индекс подписок в памяти процесса
+
+Для каждого города и каждой категории хранится отсортированный массив
+array('q') с ID подписанных пользователей (8 байт на подписку), плюс
+отсортированный массив недоступных пользователей. Получатели поста
+вычисляются пересечением массивов без запросов к базе.
+
+Индекс включается переменной SUBSCRIPTION_INDEX=1, загружается при старте
+и обновляется сервисом пользователей при изменении подписок, удалении
+и блокировке. Изменения из других процессов подхватываются периодической
+перезагрузкой (SUBSCRIPTION_INDEX_REFRESH_MINUTES).
+"""
+
+import asyncio
+import heapq
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, Tuple
+import logfire
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import User, user_cities, user_categories
+
+SUBSCRIPTION_INDEX_ENABLED = os.getenv("SUBSCRIPTION_INDEX", "0").lower() in ("1", "true", "yes")
+SUBSCRIPTION_INDEX_REFRESH_MINUTES = int(os.getenv("SUBSCRIPTION_INDEX_REFRESH_MINUTES", 10))
+
+_LOAD_BATCH_SIZE = 5000
+
+
+def _insert_sorted(values: array, value: int) -> None:
+    index = bisect_left(values, value)
+    if index == len(values) or values[index] != value:
+        values.insert(index, value)
+
+
+def _remove_sorted(values: array, value: int) -> None:
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
+
+
+def _contains_sorted(values: array, value: int) -> bool:
+    index = bisect_left(values, value)
+    return index < len(values) and values[index] == value
+
+
+def _union_sorted(arrays: List[array]) -> array:
+    """Объединение отсортированных массивов слиянием, без повторов"""
+    arrays = [values for values in arrays if values]
+    if len(arrays) == 1:
+        return arrays[0]
+    result = array("q")
+    for value in heapq.merge(*arrays):
+        if not result or result[-1] != value:
+            result.append(value)
+    return result
+
+
+def _intersect_sorted(smaller: array, larger: array, excluded: array) -> array:
+    """Пересечение отсортированных массивов без значений из excluded.
+
+    Перебирается меньший массив, значения ищутся в большем бинарным
+    поиском от позиции предыдущего совпадения.
+    """
+    if len(smaller) > len(larger):
+        smaller, larger = larger, smaller
+    result = array("q")
+    position = 0
+    for value in smaller:
+        position = bisect_left(larger, value, position)
+        if position == len(larger):
+            break
+        if larger[position] == value and not _contains_sorted(excluded, value):
+            result.append(value)
+    return result
+
+
+class SubscriptionIndex:
+    """Обратный индекс: город/категория → отсортированные ID подписчиков"""
+
+    def __init__(self):
+        self._cities: Dict[int, array] = {}
+        self._categories: Dict[int, array] = {}
+        self._inactive = array("q")
+        self.loaded = False
+        self._loading = False
+        # Изменения, пришедшие во время загрузки, применяются после неё
+        self._pending: List[Tuple[Callable, tuple]] = []
+
+    async def _load_pairs(self, db: AsyncSession, key_column, user_column) -> Dict[int, array]:
+        index: Dict[int, array] = {}
+        result = await db.stream(
+            select(key_column, user_column)
+            .order_by(key_column, user_column)
+            .execution_options(yield_per=_LOAD_BATCH_SIZE)
+        )
+        async for partition in result.partitions(_LOAD_BATCH_SIZE):
+            for key, user_id in partition:
+                index.setdefault(key, array("q")).append(user_id)
+        return index
+
+    async def load(self, db: AsyncSession) -> None:
+        """Построить индекс по текущему состоянию базы"""
+        self._loading = True
+        try:
+            cities = await self._load_pairs(db, user_cities.c.city_id, user_cities.c.user_id)
+            categories = await self._load_pairs(
+                db, user_categories.c.category_id, user_categories.c.user_id
+            )
+            inactive = array(
+                "q",
+                (
+                    await db.execute(
+                        select(User.id).where(User.is_active == False).order_by(User.id)
+                    )
+                ).scalars(),
+            )
+            self._cities, self._categories, self._inactive = cities, categories, inactive
+            self.loaded = True
+        finally:
+            self._loading = False
+            pending, self._pending = self._pending, []
+            for method, args in pending:
+                method(*args)
+        logfire.info(
+            f"Индекс подписок загружен: городов {len(self._cities)}, "
+            f"категорий {len(self._categories)}, {self.memory_bytes() // 1024} КБ"
+        )
+
+    async def run(self, session_factory, refresh_minutes: int | None = None) -> None:
+        """Загрузить индекс и периодически перезагружать его"""
+        if not SUBSCRIPTION_INDEX_ENABLED:
+            return
+        refresh_minutes = refresh_minutes or SUBSCRIPTION_INDEX_REFRESH_MINUTES
+        while True:
+            try:
+                async with session_factory() as db:
+                    await self.load(db)
+            except Exception as e:
+                logfire.error(f"Ошибка загрузки индекса подписок: {e}")
+            await asyncio.sleep(refresh_minutes * 60)
+
+    def memory_bytes(self) -> int:
+        """Объём памяти под ID в индексе"""
+        arrays = [*self._cities.values(), *self._categories.values(), self._inactive]
+        return sum(values.itemsize * len(values) for values in arrays)
+
+    def _apply(self, method: Callable, *args) -> bool:
+        """Отложить изменение, если идёт загрузка; False — индекс не используется"""
+        if self._loading:
+            self._pending.append((method, args))
+            return False
+        return self.loaded
+
+    @staticmethod
+    def _replace(index: Dict[int, array], user_id: int, keys: Iterable[int]) -> None:
+        keys = set(keys)
+        for key, values in index.items():
+            if key not in keys:
+                _remove_sorted(values, user_id)
+        for key in keys:
+            _insert_sorted(index.setdefault(key, array("q")), user_id)
+
+    def set_user_cities(self, user_id: int, city_ids: Iterable[int]) -> None:
+        """Заменить города пользователя"""
+        city_ids = list(city_ids)
+        if self._apply(self.set_user_cities, user_id, city_ids):
+            self._replace(self._cities, user_id, city_ids)
+
+    def set_user_categories(self, user_id: int, category_ids: Iterable[int]) -> None:
+        """Заменить категории пользователя"""
+        category_ids = list(category_ids)
+        if self._apply(self.set_user_categories, user_id, category_ids):
+            self._replace(self._categories, user_id, category_ids)
+
+    def remove_user(self, user_id: int) -> None:
+        """Убрать удалённого пользователя из индекса"""
+        if self._apply(self.remove_user, user_id):
+            self._replace(self._cities, user_id, ())
+            self._replace(self._categories, user_id, ())
+            _remove_sorted(self._inactive, user_id)
+
+    def deactivate(self, user_ids: Iterable[int]) -> None:
+        """Исключить недоступных пользователей из получателей"""
+        user_ids = list(user_ids)
+        if self._apply(self.deactivate, user_ids):
+            for user_id in user_ids:
+                _insert_sorted(self._inactive, user_id)
+
+    def activate(self, user_id: int) -> None:
+        """Вернуть пользователя в число получателей"""
+        if self._apply(self.activate, user_id):
+            _remove_sorted(self._inactive, user_id)
+
+    def recipients(self, city_ids: Iterable[int], category_ids: Iterable[int]) -> array:
+        """Отсортированные ID активных подписчиков хотя бы одного города
+        и хотя бы одной категории"""
+        city_users = _union_sorted([self._cities.get(key, array("q")) for key in city_ids])
+        if not city_users:
+            return array("q")
+        category_users = _union_sorted(
+            [self._categories.get(key, array("q")) for key in category_ids]
+        )
+        return _intersect_sorted(city_users, category_users, self._inactive)
+
+    def iter_recipient_batches(
+        self,
+        city_ids: Iterable[int],
+        category_ids: Iterable[int],
+        after_id: int = 0,
+        batch_size: int = 500,
+    ) -> Iterable[List[int]]:
+        """Получатели порциями по возрастанию ID, начиная после after_id"""
+        recipients = self.recipients(city_ids, category_ids)
+        for start in range(bisect_right(recipients, after_id), len(recipients), batch_size):
+            yield recipients[start:start + batch_size].tolist()
+
+
+# Индекс подписок для использования во всём процессе
+subscription_index = SubscriptionIndex()
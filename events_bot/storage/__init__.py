@@ -1,8 +1,9 @@
 import os
 import logfire
-from .interfaces import FileStorageInterface
+from .interfaces import FileStorageInterface, StoredFile
 from .file_storage import LocalFileStorage
 from .s3_storage import S3FileStorage
+from .telegram_storage import TelegramFileStorage
 
 def has_s3_credentials() -> bool:
     """Проверить наличие данных для авторизации в S3"""
@@ -14,10 +15,8 @@ def has_s3_credentials() -> bool:
     
     return all(os.getenv(var) for var in required_vars)
 
-# Инициализируем файловое хранилище в зависимости от доступности S3
-def get_file_storage() -> FileStorageInterface:
-    """Получить подходящее файловое хранилище"""
-    
+def get_bytes_storage() -> FileStorageInterface:
+    """Хранилище для байтов файлов: S3, если заданы данные доступа, иначе диск"""
     if has_s3_credentials():
         try:
             logfire.info("Initializing S3 storage with provided credentials")
@@ -29,7 +28,20 @@ def get_file_storage() -> FileStorageInterface:
         logfire.info("No S3 credentials found, using local storage")
         return LocalFileStorage()
 
+# Инициализируем файловое хранилище в зависимости от FILE_STORAGE и доступности S3
+def get_file_storage() -> FileStorageInterface:
+    """Получить подходящее файловое хранилище
+
+    FILE_STORAGE=telegram — картинки остаются в Telegram, хранится только
+    file_id; остальные значения — S3 или локальный диск.
+    """
+    bytes_storage = get_bytes_storage()
+    if os.getenv("FILE_STORAGE", "").lower() == "telegram":
+        logfire.info("Using Telegram file storage")
+        return TelegramFileStorage(fallback=bytes_storage)
+    return bytes_storage
+
 # Инициализируем файловое хранилище для использования во всем приложении
 file_storage = get_file_storage()
 
-__all__ = ["FileStorageInterface", "LocalFileStorage", "S3FileStorage", "file_storage", "get_file_storage"] 
+__all__ = ["FileStorageInterface", "StoredFile", "LocalFileStorage", "S3FileStorage", "TelegramFileStorage", "file_storage", "get_file_storage"] 
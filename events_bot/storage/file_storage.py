@@ -1,15 +1,36 @@
-from typing import Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional
 import aiofiles
+import asyncio
+import hashlib
 import os
+import shutil
 import uuid
 from pathlib import Path
 from aiogram.types import InputMediaPhoto, FSInputFile
-from .interfaces import FileStorageInterface
+from .interfaces import (
+    FileStorageInterface,
+    StoredFile,
+    content_key,
+    get_content_type,
+    hash_content,
+    is_legacy_file_id,
+    spool_to_file,
+)
+
+# Сколько файлов удаляет один поток в delete_files
+LOCAL_DELETE_BATCH_SIZE = 100
 
 
 class LocalFileStorage(FileStorageInterface):
-    """Локальное файловое хранилище через aiofiles"""
-    
+    """Локальное файловое хранилище через aiofiles
+
+    Файлы раскладываются по подпапкам ab/cd/ по хэшу ключа, чтобы в одной
+    папке не копились сотни тысяч файлов. Пути к файлам хранятся в индексе
+    в памяти: он строится одним обходом папки при старте и обновляется при
+    сохранении и удалении. Файлы, сохранённые другим процессом, находятся
+    по вычисляемому пути; файлы до раскладки по подпапкам лежат в корне.
+    """
+
     def __init__(self, storage_path: str = "uploads"):
         """
         Args:
@@ -17,41 +38,159 @@ class LocalFileStorage(FileStorageInterface):
         """
         self.storage_path = Path(os.getcwd()) / Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
-    
-    async def save_file(self, file_data: bytes, file_extension: str) -> str:
-        """Сохранить файл локально"""
-        # Генерируем уникальный id
-        file_id = str(uuid.uuid4())
-        file_path = self.storage_path / f"{file_id}.{file_extension}"
-        
-        # Сохраняем файл асинхронно
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_data)
-        
-        return file_id
-    
-    async def get_media_photo(self, file_id: str) -> Optional[InputMediaPhoto]:
+        # Временные файлы загрузки пишутся рядом, чтобы переносить их под ключ без копирования
+        self.spool_directory = self.storage_path
+        # ключ (и id без расширения для старых файлов) → путь
+        self._index: Dict[str, Path] = {}
+        self._index_loaded = False
+
+    async def start(self) -> None:
+        """Построить индекс файлов, не блокируя цикл событий"""
+        await asyncio.to_thread(self._load_index)
+
+    def _load_index(self) -> None:
+        index: Dict[str, Path] = {}
+        for root, _, files in os.walk(self.storage_path):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    self._add_to_index(index, Path(root) / name)
+        self._index = index
+        self._index_loaded = True
+
+    @staticmethod
+    def _add_to_index(index: Dict[str, Path], file_path: Path) -> None:
+        index[file_path.name] = file_path
+        index.setdefault(file_path.stem, file_path)
+
+    def _shard_path(self, key: str) -> Path:
+        """Путь файла в подпапках по хэшу ключа"""
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return self.storage_path / digest[:2] / digest[2:4] / key
+
+    async def save_file(self, file_data: bytes, file_extension: str) -> StoredFile:
+        """Сохранить файл локально (повторно те же байты не записываются)"""
+        key = content_key(hash_content(file_data), file_extension)
+        file_path = self._shard_path(key)
+        if not file_path.exists():
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # Пишем во временный файл, чтобы под ключом не оказался неполный файл
+            tmp_path = file_path.with_name(f".{uuid.uuid4()}.tmp")
+            try:
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    await f.write(file_data)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+
+        self._add_to_index(self._index, file_path)
+        return StoredFile(key=key, content_type=get_content_type(file_extension))
+
+    async def save_stream(
+        self, chunks: AsyncIterator[bytes], file_extension: str
+    ) -> StoredFile:
+        """Сохранить файл локально, записывая части по мере получения.
+
+        Части пишутся во временный файл с подсчётом хэша; после записи файл
+        переносится под ключ по содержимому или удаляется, если такой уже есть.
+        """
+        tmp_path, digest = await spool_to_file(chunks, self.spool_directory)
+        try:
+            return await self.save_spooled_file(tmp_path, digest, file_extension)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    async def save_spooled_file(
+        self, file_path: Path, digest: str, file_extension: str
+    ) -> StoredFile:
+        """Перенести временный файл под ключ по содержимому (если такого ещё нет)"""
+        key = content_key(digest, file_extension)
+        target_path = self._shard_path(key)
+        if not target_path.exists():
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            # Файл из другой папки копируется, из папки хранилища — переименовывается
+            await asyncio.to_thread(shutil.move, file_path, target_path)
+
+        self._add_to_index(self._index, target_path)
+        return StoredFile(key=key, content_type=get_content_type(file_extension))
+
+    async def _ensure_index(self) -> None:
+        """Построить индекс в потоке, если start() ещё не вызывался"""
+        if not self._index_loaded:
+            await self.start()
+
+    async def _find_file(self, key: str) -> Optional[Path]:
+        """Путь к файлу по ключу; индекс строится без блокировки цикла событий"""
+        await self._ensure_index()
+        return self._lookup_file(key)
+
+    def _lookup_file(self, key: str) -> Optional[Path]:
+        """Путь к файлу по ключу: из индекса, по вычисляемому пути или в корне.
+
+        Индекс должен быть построен (_ensure_index).
+        """
+        file_path = self._index.get(key)
+        if file_path and file_path.exists():
+            return file_path
+        if is_legacy_file_id(key):
+            # id старого формата ищется по всем расширениям
+            candidates = list(self.storage_path.glob(f"{key}.*"))
+        else:
+            candidates = [self._shard_path(key), self.storage_path / key]
+        for candidate in candidates:
+            if candidate.exists():
+                self._add_to_index(self._index, candidate)
+                return candidate
+        return None
+
+    def _remove_from_index(self, file_path: Path) -> None:
+        for name in (file_path.name, file_path.stem):
+            if self._index.get(name) == file_path:
+                self._index.pop(name, None)
+
+    async def get_media_photo(self, key: str) -> Optional[InputMediaPhoto]:
         """Получить файл как InputMediaPhoto для отправки в Telegram"""
-        # Ищем файл по id (проверяем все возможные расширения)
-        for file_path in self.storage_path.glob(f"{file_id}.*"):
-            if file_path.exists():
-                return InputMediaPhoto(media=FSInputFile(str(file_path)))
+        file_path = await self._find_file(key)
+        if file_path:
+            return InputMediaPhoto(media=FSInputFile(str(file_path)))
         return None
-    
-    async def get_file_url(self, file_id: str, expires_in: int = 3600) -> Optional[str]:
+
+    async def get_file_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
         """Получить URL файла для прямого доступа (локальный путь)"""
-        # Ищем файл по id (проверяем все возможные расширения)
-        for file_path in self.storage_path.glob(f"{file_id}.*"):
-            if file_path.exists():
-                # Возвращаем абсолютный путь к файлу
-                return str(file_path.absolute())
+        file_path = await self._find_file(key)
+        if file_path:
+            # Возвращаем абсолютный путь к файлу
+            return str(file_path.absolute())
         return None
-    
-    async def delete_file(self, file_id: str) -> bool:
-        """Удалить файл по id"""
-        # Ищем файл по id
-        for file_path in self.storage_path.glob(f"{file_id}.*"):
-            if file_path.exists():
+
+    def _delete_batch(self, keys: List[str]) -> int:
+        deleted = 0
+        for key in keys:
+            file_path = self._lookup_file(key)
+            if not file_path:
+                continue
+            self._remove_from_index(file_path)
+            try:
                 file_path.unlink()
-                return True
-        return False
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    async def delete_files(self, keys: Iterable[str]) -> int:
+        """Удалить файлы пачками параллельно в потоках, не блокируя цикл событий"""
+        await self._ensure_index()
+        keys = list(dict.fromkeys(keys))
+        batches = [
+            keys[start:start + LOCAL_DELETE_BATCH_SIZE]
+            for start in range(0, len(keys), LOCAL_DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._delete_batch, batch) for batch in batches)
+        )
+        return sum(results)
+
+    async def delete_file(self, key: str) -> bool:
+        """Удалить файл по ключу"""
+        await self._ensure_index()
+        return await asyncio.to_thread(self._delete_batch, [key]) == 1
@@ -0,0 +1,139 @@
+"""
+Нормализация картинок постов
+
+Картинка уменьшается до IMAGE_MAX_DIMENSION по большей стороне, теряет
+метаданные (EXIF, геопозиция), перекодируется в IMAGE_FORMAT и получает
+миниатюру IMAGE_THUMBNAIL_SIZE. Обработка идёт в отдельных процессах
+(ProcessPoolExecutor), чтобы не блокировать цикл событий бота. Пул
+создаётся при старте процесса (start) и запускает процессы через spawn:
+fork процесса с работающим циклом событий и потоками небезопасен.
+
+Требует Pillow (pip install "events-bot[images]"); без него картинки
+сохраняются как есть. Отключается переменной IMAGE_PROCESSING=0.
+"""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+import logfire
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow — необязательная зависимость
+    Image = None
+    ImageOps = None
+
+IMAGE_PROCESSING_ENABLED = Image is not None and os.getenv(
+    "IMAGE_PROCESSING", "1"
+).lower() in ("1", "true", "yes")
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1600))
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", 320))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 82))
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", 2))
+
+# Формат Pillow и расширение файла для IMAGE_FORMAT
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+IMAGE_FORMAT, IMAGE_EXTENSION = IMAGE_FORMATS.get(
+    os.getenv("IMAGE_FORMAT", "jpeg").lower(), IMAGE_FORMATS["jpeg"]
+)
+
+
+@dataclass
+class ProcessedImage:
+    """Нормализованная картинка и её миниатюра"""
+
+    data: bytes
+    thumbnail: bytes
+    extension: str
+
+
+def _encode(image, image_format: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    options = {"quality": quality, "optimize": True}
+    if image_format == "JPEG":
+        options["progressive"] = True
+    # exif не передаётся, поэтому метаданные в файл не попадают
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def _normalize_image(
+    file_path: str, max_dimension: int, thumbnail_size: int, image_format: str, quality: int
+) -> Tuple[bytes, bytes]:
+    """Уменьшить, очистить от метаданных и перекодировать (выполняется в дочернем процессе)"""
+    with Image.open(file_path) as source:
+        # Поворот из EXIF применяется до того, как метаданные будут отброшены
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        normalized = _encode(image, image_format, quality)
+        image.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        thumbnail = _encode(image, image_format, quality)
+    return normalized, thumbnail
+
+
+class ImageProcessor:
+    """Пул процессов для обработки картинок"""
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or IMAGE_PROCESS_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return IMAGE_PROCESSING_ENABLED
+
+    def start(self) -> None:
+        """Создать пул процессов; вызывается при старте, до запуска потоков и цикла событий"""
+        if self.enabled and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=get_context("spawn")
+            )
+
+    async def process(self, file_path: Path) -> Optional[ProcessedImage]:
+        """Обработать картинку из файла; None — обработка выключена или не удалась.
+
+        Дочерний процесс читает файл сам, поэтому исходная картинка
+        не передаётся через память бота.
+        """
+        if not self.enabled:
+            return None
+        # Процессы, не вызвавшие start(), создают пул при первой картинке
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            normalized, thumbnail = await loop.run_in_executor(
+                self._executor,
+                _normalize_image,
+                str(file_path),
+                IMAGE_MAX_DIMENSION,
+                IMAGE_THUMBNAIL_SIZE,
+                IMAGE_FORMAT,
+                IMAGE_QUALITY,
+            )
+        except Exception as e:
+            logfire.warning(f"Не удалось обработать картинку, сохраняем как есть: {e}")
+            return None
+        logfire.info(
+            f"Картинка обработана: {os.path.getsize(file_path) // 1024} КБ → {len(normalized) // 1024} КБ"
+        )
+        return ProcessedImage(data=normalized, thumbnail=thumbnail, extension=IMAGE_EXTENSION)
+
+    def shutdown(self) -> None:
+        """Остановить процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Обработчик картинок для использования во всём процессе
+image_processor = ImageProcessor()
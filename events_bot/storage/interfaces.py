@@ -1,32 +1,196 @@
+import asyncio
+import hashlib
+import os
+import tempfile
 from abc import ABC, abstractmethod
-from typing import Optional
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Optional, Tuple
+import aiofiles
+from aiogram import Bot
 from aiogram.types import InputMediaPhoto
+from events_bot.utils.telegram import iter_telegram_file
+from .image_processing import image_processor
+
+# Расширения, с которыми сохранялись файлы до появления ключей с расширением
+LEGACY_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+
+
+def get_content_type(file_extension: str) -> str:
+    """Определить Content-Type по расширению файла"""
+    return CONTENT_TYPES.get(file_extension.lower(), 'application/octet-stream')
+
+
+def content_key(digest: str, file_extension: str) -> str:
+    """Ключ объекта по хэшу содержимого: одинаковые файлы получают один ключ"""
+    return f"{digest}.{file_extension}"
+
+
+def hash_content(file_data: bytes) -> str:
+    """SHA-256 содержимого файла"""
+    return hashlib.sha256(file_data).hexdigest()
+
+
+def is_legacy_file_id(key: str) -> bool:
+    """Старые посты хранят id файла без расширения — его приходится искать"""
+    return '.' not in key
+
+
+async def spool_to_file(
+    chunks: AsyncIterator[bytes], directory: Optional[Path] = None
+) -> Tuple[Path, str]:
+    """Записать части во временный файл (*.tmp), считая SHA-256 содержимого.
+
+    В памяти находится одна часть. Возвращает путь к файлу и хэш;
+    удалить файл должен вызывающий.
+    """
+    fd, name = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    os.close(fd)
+    file_path = Path(name)
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(file_path, 'wb') as f:
+            async for chunk in chunks:
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+    return file_path, digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    """Сохранённый файл: полный ключ объекта (хэш содержимого с расширением) и его тип"""
+
+    key: str
+    content_type: str
+    # Ключ миниатюры, если картинка проходила обработку
+    thumbnail_key: Optional[str] = None
 
 
 class FileStorageInterface(ABC):
     """Абстрактный интерфейс для файлового хранилища"""
+
+    # Папка для временных файлов загрузки (None — системная)
+    spool_directory: Optional[Path] = None
+
+    async def start(self) -> None:
+        """Открыть долгоживущие ресурсы хранилища (соединения) при старте процесса"""
+
+    async def close(self) -> None:
+        """Освободить ресурсы хранилища при остановке процесса"""
     
     @abstractmethod
-    async def save_file(self, file_data: bytes, file_extension: str) -> str:
+    async def save_file(self, file_data: bytes, file_extension: str) -> StoredFile:
         """
-        Сохранить файл и вернуть его id
+        Сохранить файл и вернуть его ключ
+
+        Ключ вычисляется по содержимому (content_key), поэтому повторное
+        сохранение тех же байтов не создаёт новый объект.
         
         Args:
             file_data: Данные файла в bytes
             file_extension: Расширение файла (например, 'jpg')
             
         Returns:
-            str: Уникальный id файла
+            StoredFile: Ключ объекта и Content-Type
         """
         pass
+
+    async def save_telegram_photo(
+        self, bot: Bot, telegram_file_id: str, file_extension: str = "jpg"
+    ) -> StoredFile:
+        """
+        Сохранить картинку, полученную от Telegram
+
+        По умолчанию файл скачивается с серверов Telegram по частям во
+        временный файл и сохраняется через save_spooled_file, поэтому в
+        памяти бота одна часть. При включённой обработке картинок процесс
+        обработки читает временный файл с диска, а сохраняются
+        нормализованная версия и миниатюра — их размер ограничен
+        IMAGE_MAX_DIMENSION, и они держатся в памяти целиком. Хранилища,
+        которые умеют обходиться без копии, переопределяют метод.
+
+        Args:
+            bot: Бот, получивший картинку
+            telegram_file_id: file_id картинки в Telegram
+            file_extension: Расширение файла
+
+        Returns:
+            StoredFile: Ключ объекта и Content-Type
+        """
+        file_info = await bot.get_file(telegram_file_id)
+        file_path, digest = await spool_to_file(
+            iter_telegram_file(bot, file_info.file_path), self.spool_directory
+        )
+        try:
+            processed = await image_processor.process(file_path)
+            if processed is None:
+                return await self.save_spooled_file(file_path, digest, file_extension)
+            stored = await self.save_file(processed.data, processed.extension)
+            thumbnail = await self.save_file(processed.thumbnail, processed.extension)
+            return StoredFile(
+                key=stored.key, content_type=stored.content_type, thumbnail_key=thumbnail.key
+            )
+        finally:
+            file_path.unlink(missing_ok=True)
+
+    async def save_spooled_file(
+        self, file_path: Path, digest: str, file_extension: str
+    ) -> StoredFile:
+        """
+        Сохранить временный файл, записанный spool_to_file
+
+        По умолчанию файл читается в память и передаётся в save_file;
+        хранилища переопределяют метод, чтобы переносить или загружать
+        файл с диска. Хранилище может забрать файл себе (перенести);
+        оставшийся файл удаляет вызывающий.
+
+        Args:
+            file_path: Путь к временному файлу
+            digest: SHA-256 содержимого
+            file_extension: Расширение файла
+
+        Returns:
+            StoredFile: Ключ объекта и Content-Type
+        """
+        async with aiofiles.open(file_path, 'rb') as f:
+            return await self.save_file(await f.read(), file_extension)
+
+    async def save_stream(
+        self, chunks: AsyncIterator[bytes], file_extension: str
+    ) -> StoredFile:
+        """
+        Сохранить файл, получаемый по частям
+
+        По умолчанию части собираются в памяти и передаются в save_file;
+        хранилища переопределяют метод, чтобы писать части по мере получения.
+
+        Args:
+            chunks: Асинхронный итератор частей файла
+            file_extension: Расширение файла
+
+        Returns:
+            StoredFile: Ключ объекта и Content-Type
+        """
+        return await self.save_file(b"".join([chunk async for chunk in chunks]), file_extension)
     
     @abstractmethod
-    async def get_media_photo(self, file_id: str) -> Optional[InputMediaPhoto]:
+    async def get_media_photo(self, key: str) -> Optional[InputMediaPhoto]:
         """
         Получить файл как InputMediaPhoto для отправки в Telegram
         
         Args:
-            file_id: Id файла
+            key: Ключ файла (или id старого формата без расширения)
             
         Returns:
             Optional[InputMediaPhoto]: InputMediaPhoto или None если файл не найден
@@ -34,12 +198,12 @@ class FileStorageInterface(ABC):
         pass
     
     @abstractmethod
-    async def get_file_url(self, file_id: str, expires_in: int = 3600) -> Optional[str]:
+    async def get_file_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
         """
         Получить URL файла для прямого доступа
         
         Args:
-            file_id: Id файла
+            key: Ключ файла (или id старого формата без расширения)
             expires_in: Время жизни URL в секундах (для S3)
             
         Returns:
@@ -47,15 +211,46 @@ class FileStorageInterface(ABC):
         """
         pass
     
+    async def file_exists(self, key: str) -> bool:
+        """
+        Проверить, что файл есть в хранилище
+
+        Args:
+            key: Ключ файла
+
+        Returns:
+            bool: True если файл найден
+        """
+        return await self.get_file_url(key) is not None
+
     @abstractmethod
-    async def delete_file(self, file_id: str) -> bool:
+    async def delete_file(self, key: str) -> bool:
         """
-        Удалить файл по id
+        Удалить файл по ключу
         
         Args:
-            file_id: Id файла
+            key: Ключ файла (или id старого формата без расширения)
             
         Returns:
             bool: True если файл удален, False если файл не найден
         """
-        pass 
+        pass
+
+    async def delete_files(self, keys: Iterable[str]) -> int:
+        """
+        Удалить несколько файлов
+
+        По умолчанию файлы удаляются параллельно через delete_file;
+        хранилища с пакетным удалением переопределяют метод.
+
+        Args:
+            keys: Ключи файлов
+
+        Returns:
+            int: Сколько файлов удалено
+        """
+        results = await asyncio.gather(
+            *(self.delete_file(key) for key in keys), return_exceptions=True
+        )
+        return sum(result is True for result in results)
+
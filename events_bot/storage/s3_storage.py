@@ -1,17 +1,49 @@
+import asyncio
 import os
+import time
 import uuid
-from typing import Optional
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 from aioboto3 import Session
+from aiobotocore.config import AioConfig
 from aiogram.types import InputMediaPhoto, URLInputFile
 from botocore.exceptions import ClientError, NoCredentialsError
-from .interfaces import FileStorageInterface
+from .interfaces import (
+    LEGACY_EXTENSIONS,
+    FileStorageInterface,
+    StoredFile,
+    content_key,
+    get_content_type,
+    hash_content,
+    is_legacy_file_id,
+    spool_to_file,
+)
 import logfire
 from types_aiobotocore_s3 import Client
 
+# Срок подписанных ссылок, за сколько секунд до истечения ссылка
+# перестаёт выдаваться из кэша, и сколько ссылок держать в памяти
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", 24 * 3600))
+S3_PRESIGN_REFRESH_MARGIN = int(os.getenv("S3_PRESIGN_REFRESH_MARGIN", 3600))
+S3_URL_CACHE_SIZE = int(os.getenv("S3_URL_CACHE_SIZE", 10000))
+# Сколько ключей S3 принимает в одном запросе DeleteObjects
+S3_DELETE_BATCH_SIZE = 1000
+
 
 class S3FileStorage(FileStorageInterface):
-    """S3 файловое хранилище для продакшена"""
+    """S3 файловое хранилище для продакшена
+
+    Один клиент S3 с пулом keep-alive соединений живёт всё время работы
+    процесса: открывается в start() (или при первом обращении) и
+    закрывается в close().
+
+    Подписанные ссылки кэшируются по ключу объекта: выдаются на
+    S3_PRESIGN_EXPIRES секунд и переиспользуются, пока до истечения
+    остаётся больше запаса. Одновременные запросы одной ссылки ждут
+    одну и ту же подпись.
+    """
     
     def __init__(
         self, 
@@ -46,116 +78,252 @@ class S3FileStorage(FileStorageInterface):
             aws_secret_access_key=self.aws_secret_access_key,
             region_name=self.region_name
         )
+        self.client_config = AioConfig(
+            max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50)),
+            connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("S3_READ_TIMEOUT", 30)),
+            retries={"max_attempts": 3, "mode": "standard"},
+            connector_args={"keepalive_timeout": float(os.getenv("S3_KEEPALIVE_TIMEOUT", 60))},
+        )
+        self._client: Optional[Client] = None
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._client_lock = asyncio.Lock()
+        # ключ → (ссылка, момент истечения по time.monotonic())
+        self._url_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._url_inflight: Dict[str, asyncio.Future] = {}
+
+    async def start(self) -> None:
+        """Открыть долгоживущий клиент S3"""
+        await self._get_client()
+
+    async def close(self) -> None:
+        """Закрыть клиент S3 и его пул соединений"""
+        async with self._client_lock:
+            if self._exit_stack:
+                await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
+
+    async def _get_client(self) -> Client:
+        """Клиент S3 процесса; создаётся один раз"""
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    exit_stack = AsyncExitStack()
+                    self._client = await exit_stack.enter_async_context(
+                        self.session.client(
+                            's3',
+                            endpoint_url=self.endpoint_url,
+                            use_ssl=False,
+                            config=self.client_config,
+                        )
+                    )
+                    self._exit_stack = exit_stack
+                    logfire.info("S3 client opened")
+        return self._client
     
-    async def save_file(self, file_data: bytes, file_extension: str) -> str:
-        """Сохранить файл в S3"""
-        # Генерируем уникальный id
-        file_id = str(uuid.uuid4())
-        key = f"{file_id}.{file_extension}"
+    async def _object_exists(self, key: str) -> bool:
+        s3_client = await self._get_client()
+        try:
+            await s3_client.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    async def save_file(self, file_data: bytes, file_extension: str) -> StoredFile:
+        """Сохранить файл в S3 (объект с тем же содержимым повторно не загружается)"""
+        key = content_key(hash_content(file_data), file_extension)
+        content_type = get_content_type(file_extension)
         
         try:
-            async with self.session.client(
-                's3',
-                endpoint_url=self.endpoint_url,
-                use_ssl=False
-            ) as s3_client:
-                await s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=key,
-                    Body=file_data,
-                    ContentType=self._get_content_type(file_extension)
-                )
+            if await self._object_exists(key):
+                logfire.info(f"File already in S3: {key}")
+                return StoredFile(key=key, content_type=content_type)
+            s3_client = await self._get_client()
+            await s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=file_data,
+                ContentType=content_type
+            )
                 
             logfire.info(f"File saved to S3: {key}")
-            return file_id
+            return StoredFile(key=key, content_type=content_type)
             
         except Exception as e:
             logfire.error(f"Error saving file to S3: {e}")
             raise
     
-    async def get_media_photo(self, file_id: str) -> Optional[InputMediaPhoto]:
-        """Получить файл как InputMediaPhoto для отправки в Telegram"""
+    async def save_stream(
+        self, chunks: AsyncIterator[bytes], file_extension: str
+    ) -> StoredFile:
+        """Сохранить файл в S3, получаемый по частям.
+
+        Части пишутся во временный файл с подсчётом хэша, затем файл
+        загружается с диска под ключ по содержимому; в памяти одна часть.
+        """
+        file_path, digest = await spool_to_file(chunks, self.spool_directory)
         try:
-            # Пробуем найти файл с разными расширениями
-            for extension in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                key = f"{file_id}.{extension}"
-                try:
-                    # Генерируем временный URL для файла
-                    url = await self.get_file_url(file_id, expires_in=3600)
-                    if url:
-                        logfire.info("File retrieved from S3: {key}, url: {url}", key=key, url=url)
-                        return InputMediaPhoto(media=URLInputFile(url))
-                except Exception:
-                    continue
-                            
-            logfire.warning(f"File not found in S3: {file_id}")
-            return None
-            
+            return await self.save_spooled_file(file_path, digest, file_extension)
+        finally:
+            file_path.unlink(missing_ok=True)
+
+    async def save_spooled_file(
+        self, file_path: Path, digest: str, file_extension: str
+    ) -> StoredFile:
+        """Загрузить временный файл в S3, читая его с диска (объект с тем же содержимым не загружается)"""
+        key = content_key(digest, file_extension)
+        content_type = get_content_type(file_extension)
+        try:
+            if await self._object_exists(key):
+                logfire.info(f"File already in S3: {key}")
+                return StoredFile(key=key, content_type=content_type)
+            s3_client = await self._get_client()
+            with open(file_path, 'rb') as body:
+                await s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Body=body,
+                    ContentType=content_type,
+                )
+            logfire.info(f"File streamed to S3: {key}")
+            return StoredFile(key=key, content_type=content_type)
         except Exception as e:
-            logfire.error(f"Error retrieving file from S3: {e}")
-            return None
+            logfire.error(f"Error saving file stream to S3: {e}")
+            raise
+
+    async def _resolve_legacy_key(self, file_id: str) -> Optional[str]:
+        """Найти ключ файла старого формата (id без расширения) перебором расширений"""
+        s3_client = await self._get_client()
+        for extension in LEGACY_EXTENSIONS:
+            key = f"{file_id}.{extension}"
+            try:
+                await s3_client.head_object(Bucket=self.bucket_name, Key=key)
+                return key
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                    continue
+                raise
+        return None
     
-    async def delete_file(self, file_id: str) -> bool:
-        """Удалить файл из S3 по id"""
+    async def get_media_photo(self, key: str) -> Optional[InputMediaPhoto]:
+        """Получить файл как InputMediaPhoto для отправки в Telegram"""
+        url = await self.get_file_url(key, expires_in=3600)
+        if url:
+            logfire.info("File retrieved from S3: {key}, url: {url}", key=key, url=url)
+            return InputMediaPhoto(media=URLInputFile(url))
+        logfire.warning(f"File not found in S3: {key}")
+        return None
+    
+    async def file_exists(self, key: str) -> bool:
+        """Проверить наличие объекта в S3 (ссылка подписывается и без объекта)"""
+        return await self._object_exists(key)
+
+    async def delete_file(self, key: str) -> bool:
+        """Удалить файл из S3 по ключу"""
+        self._url_cache.pop(key, None)
         try:
-            async with self.session.client(
-                's3',
-                endpoint_url=self.endpoint_url,
-                use_ssl=False
-            ) as s3_client:
-                s3_client: Client
-                # Пробуем удалить файл с разными расширениями
-                for extension in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                    key = f"{file_id}.{extension}"
-                    try:
-                        await s3_client.delete_object(Bucket=self.bucket_name, Key=key)
-                        logfire.info(f"File deleted from S3: {key}")
-                        return True
-                    except ClientError as e:
-                        if e.response['Error']['Code'] == 'NoSuchKey':
-                            continue
-                        else:
-                            raise
-                            
-            logfire.warning(f"File not found for deletion in S3: {file_id}")
-            return False
+            if is_legacy_file_id(key):
+                key = await self._resolve_legacy_key(key)
+                if not key:
+                    return False
+            s3_client = await self._get_client()
+            await s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            logfire.info(f"File deleted from S3: {key}")
+            return True
             
         except Exception as e:
             logfire.error(f"Error deleting file from S3: {e}")
             return False
     
-    async def get_file_url(self, file_id: str, expires_in: int = 3600) -> Optional[str]:
-        """Получить URL файла для прямого доступа (с временной ссылкой)"""
+    async def delete_files(self, keys: Iterable[str]) -> int:
+        """Удалить файлы из S3 пакетами DeleteObjects до 1000 ключей"""
+        object_keys: List[str] = []
+        for key in keys:
+            self._url_cache.pop(key, None)
+            if is_legacy_file_id(key):
+                try:
+                    key = await self._resolve_legacy_key(key)
+                except Exception as e:
+                    logfire.error(f"Error resolving legacy file {key} for deletion: {e}")
+                    key = None
+                if not key:
+                    continue
+            object_keys.append(key)
+        if not object_keys:
+            return 0
+
+        s3_client = await self._get_client()
+        deleted = 0
+        for start in range(0, len(object_keys), S3_DELETE_BATCH_SIZE):
+            batch = object_keys[start:start + S3_DELETE_BATCH_SIZE]
+            try:
+                response = await s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True},
+                )
+            except Exception as e:
+                logfire.error(f"Error deleting {len(batch)} files from S3: {e}")
+                continue
+            # В тихом режиме S3 возвращает только ошибки
+            errors = response.get('Errors', [])
+            for error in errors:
+                logfire.error(
+                    f"Error deleting file from S3: {error.get('Key')}: {error.get('Message')}"
+                )
+            deleted += len(batch) - len(errors)
+        logfire.info(f"Files deleted from S3: {deleted}")
+        return deleted
+    
+    async def get_file_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
+        """Получить URL файла для прямого доступа (с временной ссылкой).
+
+        Ссылка берётся из кэша, если проживёт ещё не меньше expires_in
+        секунд и запаса S3_PRESIGN_REFRESH_MARGIN, иначе подписывается
+        заново — один раз на все одновременные запросы этого ключа.
+        """
+        cached = self._url_cache.get(key)
+        if cached and cached[1] - time.monotonic() >= max(S3_PRESIGN_REFRESH_MARGIN, expires_in):
+            self._url_cache.move_to_end(key)
+            return cached[0]
+
+        inflight = self._url_inflight.get(key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._presign(key, max(S3_PRESIGN_EXPIRES, expires_in))
+            )
+            self._url_inflight[key] = inflight
+            inflight.add_done_callback(lambda _: self._url_inflight.pop(key, None))
+        # Отмена одного ожидающего не отменяет общую подпись
+        return await asyncio.shield(inflight)
+
+    async def _presign(self, key: str, expires_in: int) -> Optional[str]:
+        """Подписать ссылку и положить её в кэш.
+
+        Ссылка подписывается локально, без запросов к S3; только для id
+        старого формата ключ сначала ищется перебором расширений.
+        """
         try:
-            async with self.session.client(
-                's3',
-                endpoint_url=self.endpoint_url,
-                use_ssl=False
-            ) as s3_client:
-                s3_client: Client
-                # Пробуем найти файл с разными расширениями
-                for extension in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                    key = f"{file_id}.{extension}"
-                    try:
-                        # Проверяем существование файла
-                        await s3_client.head_object(Bucket=self.bucket_name, Key=key)
-                        
-                        # Генерируем временный URL
-                        url = await s3_client.generate_presigned_url(
-                            'get_object',
-                            Params={'Bucket': self.bucket_name, 'Key': key},
-                            ExpiresIn=expires_in
-                        )
-                        logfire.info("Generated presigned URL for: {key}, {url}", key=key, url=url)
-                        return url
-                    except ClientError as e:
-                        if e.response['Error']['Code'] == 'NoSuchKey':
-                            continue
-                        else:
-                            raise
-                            
-            logfire.warning(f"File not found for URL generation: {file_id}")
-            return None
+            object_key = key
+            if is_legacy_file_id(key):
+                object_key = await self._resolve_legacy_key(key)
+                if not object_key:
+                    return None
+            s3_client = await self._get_client()
+            issued_at = time.monotonic()
+            url = await s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': object_key},
+                ExpiresIn=expires_in
+            )
+            logfire.info("Generated presigned URL for: {key}, {url}", key=object_key, url=url)
+            self._url_cache[key] = (url, issued_at + expires_in)
+            self._url_cache.move_to_end(key)
+            while len(self._url_cache) > S3_URL_CACHE_SIZE:
+                self._url_cache.popitem(last=False)
+            return url
             
         except Exception as e:
             logfire.error(f"Error generating file URL: {e}")
@@ -163,25 +331,15 @@ class S3FileStorage(FileStorageInterface):
     
     def _get_content_type(self, file_extension: str) -> str:
         """Определить Content-Type по расширению файла"""
-        content_types = {
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg',
-            'png': 'image/png',
-            'gif': 'image/gif',
-            'webp': 'image/webp',
-        }
-        return content_types.get(file_extension.lower(), 'application/octet-stream')
+        return get_content_type(file_extension)
     
     async def test_connection(self) -> bool:
         """Тестировать подключение к S3"""
         try:
-            async with self.session.client(
-                's3',
-                endpoint_url=self.endpoint_url
-            ) as s3_client:
-                await s3_client.head_bucket(Bucket=self.bucket_name)
-                logfire.info("S3 connection test successful")
-                return True
+            s3_client = await self._get_client()
+            await s3_client.head_bucket(Bucket=self.bucket_name)
+            logfire.info("S3 connection test successful")
+            return True
         except Exception as e:
             logfire.error(f"S3 connection test failed: {e}")
             return False 
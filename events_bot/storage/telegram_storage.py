@@ -0,0 +1,86 @@
+from typing import AsyncIterator, Iterable, Optional
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto
+from .interfaces import FileStorageInterface, StoredFile, get_content_type
+
+# Ключи картинок, которые хранятся только на серверах Telegram
+TELEGRAM_KEY_PREFIX = "tg:"
+
+
+class TelegramFileStorage(FileStorageInterface):
+    """Хранилище, в котором картинки остаются на серверах Telegram
+
+    Для картинки, присланной боту, сохраняется только её file_id: при
+    создании поста ничего не скачивается и не загружается, а отправки
+    используют file_id напрямую. Файлы с другими ключами (посты,
+    созданные до переключения хранилища, и сохранение байтов через
+    save_file) обслуживает fallback-хранилище.
+    """
+
+    def __init__(self, fallback: FileStorageInterface):
+        """
+        Args:
+            fallback: Хранилище для файлов, которых нет в Telegram
+        """
+        self.fallback = fallback
+
+    @staticmethod
+    def _telegram_file_id(key: str) -> Optional[str]:
+        if key.startswith(TELEGRAM_KEY_PREFIX):
+            return key[len(TELEGRAM_KEY_PREFIX):]
+        return None
+
+    async def start(self) -> None:
+        await self.fallback.start()
+
+    async def close(self) -> None:
+        await self.fallback.close()
+
+    async def save_file(self, file_data: bytes, file_extension: str) -> StoredFile:
+        """Байты загрузить в Telegram без отправки нельзя — сохраняем в fallback"""
+        return await self.fallback.save_file(file_data, file_extension)
+
+    async def save_stream(
+        self, chunks: AsyncIterator[bytes], file_extension: str
+    ) -> StoredFile:
+        return await self.fallback.save_stream(chunks, file_extension)
+
+    async def save_telegram_photo(
+        self, bot: Bot, telegram_file_id: str, file_extension: str = "jpg"
+    ) -> StoredFile:
+        """Запомнить file_id без скачивания картинки"""
+        return StoredFile(
+            key=f"{TELEGRAM_KEY_PREFIX}{telegram_file_id}",
+            content_type=get_content_type(file_extension),
+        )
+
+    async def get_media_photo(self, key: str) -> Optional[InputMediaPhoto]:
+        """Получить файл как InputMediaPhoto для отправки в Telegram"""
+        telegram_file_id = self._telegram_file_id(key)
+        if telegram_file_id:
+            return InputMediaPhoto(media=telegram_file_id)
+        return await self.fallback.get_media_photo(key)
+
+    async def get_file_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
+        """URL файла; для картинок в Telegram его нет (ссылка содержала бы токен бота)"""
+        if self._telegram_file_id(key):
+            return None
+        return await self.fallback.get_file_url(key, expires_in)
+
+    async def file_exists(self, key: str) -> bool:
+        """Картинки в Telegram хранятся самим Telegram"""
+        if self._telegram_file_id(key):
+            return True
+        return await self.fallback.file_exists(key)
+
+    async def delete_file(self, key: str) -> bool:
+        """Удалить файл; картинки в Telegram удалять не нужно"""
+        if self._telegram_file_id(key):
+            return True
+        return await self.fallback.delete_file(key)
+
+    async def delete_files(self, keys: Iterable[str]) -> int:
+        keys = list(keys)
+        stored_keys = [key for key in keys if not self._telegram_file_id(key)]
+        deleted = await self.fallback.delete_files(stored_keys) if stored_keys else 0
+        return deleted + len(keys) - len(stored_keys)
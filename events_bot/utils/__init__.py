@@ -8,10 +8,13 @@ from .category_utils import (
     get_clean_category_string,
     visual_len,
 )
+from .msk_time import MSK_OFFSET, get_current_msk_time
 
 __all__ = [
     "remove_emoji_from_category",
     "get_clean_category_names",
     "get_clean_category_string",
     "visual_len",
+    "MSK_OFFSET",
+    "get_current_msk_time",
 ]
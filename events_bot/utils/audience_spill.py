@@ -0,0 +1,79 @@
+"""
+Файлы с заранее подготовленными получателями рассылки
+
+ID пользователей хранятся подряд как 8-байтовые целые (array('q')) по
+возрастанию, поэтому файл занимает 8 байт на получателя, читается
+порциями без загрузки целиком и позволяет продолжить отправку после ID
+из cursor рассылки.
+"""
+
+import os
+from array import array
+from typing import AsyncIterator, List
+import aiofiles
+import aiofiles.os
+
+BROADCAST_AUDIENCE_DIR = os.getenv("BROADCAST_AUDIENCE_DIR", "broadcast_audiences")
+
+_ITEM_SIZE = array("q").itemsize
+
+
+def audience_path(job_id: int) -> str:
+    """Путь к файлу получателей рассылки"""
+    return os.path.join(BROADCAST_AUDIENCE_DIR, f"broadcast_{job_id}.ids")
+
+
+async def write_audience(path: str, batches: AsyncIterator[List[int]]) -> int:
+    """Записать ID получателей из порций в файл; возвращает их число.
+
+    Файл сначала пишется во временный и переименовывается после записи,
+    поэтому прерванная подготовка не оставляет неполный список. Запись
+    идёт через aiofiles и не блокирует цикл событий.
+    """
+    await aiofiles.os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    total = 0
+    async with aiofiles.open(tmp_path, "wb") as f:
+        async for user_ids in batches:
+            await f.write(array("q", user_ids).tobytes())
+            total += len(user_ids)
+    await aiofiles.os.replace(tmp_path, path)
+    return total
+
+
+async def _read_items(f, count: int) -> array:
+    items = array("q")
+    items.frombytes(await f.read(count * _ITEM_SIZE))
+    return items
+
+
+async def read_audience(
+    path: str, after_id: int = 0, batch_size: int = 500
+) -> AsyncIterator[List[int]]:
+    """Читать ID получателей порциями, пропуская ID не больше after_id"""
+    count = (await aiofiles.os.stat(path)).st_size // _ITEM_SIZE
+    async with aiofiles.open(path, "rb") as f:
+        # Бинарный поиск первого ID после after_id прямо по файлу
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            await f.seek(middle * _ITEM_SIZE)
+            item = await _read_items(f, 1)
+            if item[0] <= after_id:
+                low = middle + 1
+            else:
+                high = middle
+        await f.seek(low * _ITEM_SIZE)
+        remaining = count - low
+        while remaining > 0:
+            batch = await _read_items(f, min(batch_size, remaining))
+            if not batch:
+                break
+            remaining -= len(batch)
+            yield batch.tolist()
+
+
+async def remove_audience(path: str | None) -> None:
+    """Удалить файл получателей, если он есть"""
+    if path and await aiofiles.os.path.exists(path):
+        await aiofiles.os.remove(path)
@@ -0,0 +1,36 @@
+"""
+Битовые маски подписок на города и категории
+
+Город или категория с ID n соответствует биту n - 1, поэтому в BIGINT
+помещаются ID от 1 до 63. Подписка пользователя совпадает с постом, если
+маски пересекаются: user_mask & post_mask != 0.
+"""
+
+import os
+from typing import Iterable, List, Optional
+
+# Наибольший ID, который помещается в знаковый BIGINT
+MAX_MASK_ID = 63
+
+# Использовать маски при поиске получателей и в ленте. Включать после
+# заполнения колонок (add_subscription_masks.sql)
+SUBSCRIPTION_BITMASKS_ENABLED = os.getenv("SUBSCRIPTION_BITMASKS", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+def ids_to_mask(ids: Iterable[int]) -> Optional[int]:
+    """Маска для набора ID или None, если какой-то ID в маску не помещается"""
+    mask = 0
+    for item_id in ids:
+        if not 1 <= item_id <= MAX_MASK_ID:
+            return None
+        mask |= 1 << (item_id - 1)
+    return mask
+
+
+def mask_to_ids(mask: int) -> List[int]:
+    """ID, отмеченные в маске"""
+    return [bit + 1 for bit in range(MAX_MASK_ID) if mask >> bit & 1]
@@ -0,0 +1,15 @@
+"""
+Московское время
+
+Время событий (posts.event_at) хранится как московское время без tzinfo.
+Московское время обычно UTC+3, поэтому смещение зафиксировано.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+MSK_OFFSET = timedelta(hours=3)
+
+
+def get_current_msk_time() -> datetime:
+    """Текущее время в Москве (UTC+3) без tzinfo"""
+    return datetime.now(timezone.utc).replace(tzinfo=None) + MSK_OFFSET
@@ -1,5 +1,9 @@
+import os
+from typing import AsyncIterator
+import aiofiles
+from aiogram import Bot
 from aiogram.types import Message
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 import logfire
 
 
@@ -24,3 +28,50 @@ async def safe_edit_message(message: Message, text: str, reply_markup=None, pars
             logfire.error(f"TelegramBadRequest при редактировании сообщения: {e}")
     except Exception as e:
         logfire.error(f"Ошибка при редактировании сообщения: {e}")
+
+
+def get_bot_token() -> str | None:
+    """
+    Получить токен бота из переменных окружения.
+    Поддерживаем несколько названий переменной для удобства:
+    BOT_TOKEN (основное), TELEGRAM_BOT_TOKEN и TG_BOT_TOKEN (альтернативы)
+    """
+    return (
+        os.getenv("BOT_TOKEN")
+        or os.getenv("TELEGRAM_BOT_TOKEN")
+        or os.getenv("TG_BOT_TOKEN")
+    )
+
+
+def get_unreachable_reason(error: Exception) -> str | None:
+    """
+    Определить, означает ли ошибка отправки, что чат недоступен навсегда.
+    Возвращает причину (blocked, deactivated, chat_not_found) или None
+    """
+    message = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in message:
+            return "deactivated"
+        return "blocked"
+    if isinstance(error, TelegramBadRequest) and "chat not found" in message:
+        return "chat_not_found"
+    return None
+
+
+async def iter_telegram_file(
+    bot: Bot, file_path: str, chunk_size: int = 65536, timeout: int = 30
+) -> AsyncIterator[bytes]:
+    """Читать файл с серверов Telegram по частям, не собирая его целиком в памяти"""
+    if bot.session.api.is_local:
+        local_path = bot.session.api.wrap_local_file.to_local(file_path)
+        async with aiofiles.open(local_path, "rb") as f:
+            while chunk := await f.read(chunk_size):
+                yield chunk
+        return
+    async for chunk in bot.session.stream_content(
+        url=bot.session.api.file_url(bot.token, file_path),
+        timeout=timeout,
+        chunk_size=chunk_size,
+        raise_for_status=True,
+    ):
+        yield chunk
@@ -0,0 +1,15 @@
+"""
+Фоновые обработчики бота
+"""
+
+from .outbox_worker import NotificationOutboxWorkerPool
+from .digest_worker import NotificationDigestWorker
+from .reminder_worker import EventReminderWorker
+from .broadcast_worker import BroadcastWorker
+
+__all__ = [
+    "NotificationOutboxWorkerPool",
+    "NotificationDigestWorker",
+    "EventReminderWorker",
+    "BroadcastWorker",
+]
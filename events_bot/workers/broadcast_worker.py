@@ -0,0 +1,239 @@
+"""
+Отправка рассылок администратора
+
+/broadcast только создаёт запись в broadcast_jobs, а отправку выполняет
+этот обработчик. Пользователи сегмента рассылки перебираются по
+возрастанию ID порциями одним запросом только по users.id,
+внутри порции сообщения отправляются параллельно (BROADCAST_CONCURRENCY),
+темп задаёт планировщик запросов. После каждой порции прогресс (cursor)
+сохраняется, поэтому после перезапуска рассылка продолжается; пауза
+и отмена проверяются между порциями. Сообщение о прогрессе обновляется
+не чаще раза в BROADCAST_PROGRESS_INTERVAL секунд.
+
+Запланированные рассылки (/broadcast_at) готовятся заранее: за
+BROADCAST_PRERESOLVE_MINUTES минут до отправки ID получателей выбираются
+из базы и записываются в компактный файл, а в назначенное время рассылка
+переводится в работу и читает получателей из файла, не нагружая базу.
+"""
+
+import asyncio
+import os
+import aiofiles.os
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, Tuple
+import logfire
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from events_bot.bot.utils import get_db_session
+from events_bot.bot.keyboards.broadcast_keyboard import get_broadcast_control_keyboard
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
+from events_bot.database.models import BroadcastJob, BroadcastStatus, utc_now
+from events_bot.database.repositories import BroadcastRepository, UserRepository
+from events_bot.database.services import BroadcastService, UserService
+from events_bot.utils.audience_spill import (
+    audience_path,
+    read_audience,
+    remove_audience,
+    write_audience,
+)
+from events_bot.utils.telegram import get_unreachable_reason
+
+
+class BroadcastWorker:
+    """Обработчик рассылок администратора"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int | None = None,
+        batch_size: int | None = None,
+        progress_interval: float | None = None,
+        poll_interval: float | None = None,
+        preresolve_minutes: float | None = None,
+    ):
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            concurrency: Сколько сообщений отправлять одновременно
+            batch_size: Размер порции пользователей между сохранениями прогресса
+            progress_interval: Минимальный интервал обновления прогресса (секунды)
+            poll_interval: Пауза между проверками новых рассылок (секунды)
+            preresolve_minutes: За сколько минут до отправки готовить получателей
+        """
+        self.bot = bot
+        self.concurrency = concurrency or int(os.getenv("BROADCAST_CONCURRENCY", 10))
+        self.batch_size = batch_size or int(os.getenv("BROADCAST_BATCH_SIZE", 200))
+        self.progress_interval = progress_interval or float(
+            os.getenv("BROADCAST_PROGRESS_INTERVAL", 5)
+        )
+        self.poll_interval = poll_interval or float(os.getenv("NOTIFICATION_POLL_INTERVAL", 5))
+        self.preresolve_minutes = (
+            preresolve_minutes
+            if preresolve_minutes is not None
+            else float(os.getenv("BROADCAST_PRERESOLVE_MINUTES", 15))
+        )
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Разбудить обработчик: рассылка создана или возобновлена"""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Отправлять рассылки до отмены"""
+        with request_priority(RequestPriority.BROADCAST):
+            while True:
+                try:
+                    await self._process_scheduled()
+                    async with get_db_session() as db:
+                        jobs = await BroadcastRepository.get_running(db)
+                    for job in jobs:
+                        await self._process_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logfire.error(f"Ошибка обработчика рассылок: {e}")
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _process_scheduled(self) -> None:
+        """Подготовить получателей близких рассылок и запустить наступившие"""
+        now = utc_now()
+        async with get_db_session() as db:
+            jobs = await BroadcastRepository.get_scheduled(
+                db, now + timedelta(minutes=self.preresolve_minutes)
+            )
+            for job in jobs:
+                if not job.audience_path:
+                    await self._resolve_audience(db, job)
+                if job.scheduled_at <= now and await BroadcastRepository.change_status(
+                    db, job.id, BroadcastStatus.RUNNING, [BroadcastStatus.SCHEDULED]
+                ):
+                    logfire.info(f"Запланированная рассылка №{job.id} запущена")
+                    await self._update_progress(db, job.id)
+
+    async def _resolve_audience(self, db, job: BroadcastJob) -> None:
+        """Выбрать ID получателей из базы и сохранить их в файл"""
+        started = time.monotonic()
+        path = audience_path(job.id)
+        async with get_db_session() as stream_db:
+            total = await write_audience(
+                path,
+                UserRepository.stream_active_user_ids(
+                    stream_db,
+                    batch_size=self.batch_size,
+                    **BroadcastService.segment_filters(job.segment),
+                ),
+            )
+        await BroadcastRepository.set_audience(db, job.id, path, total)
+        await db.refresh(job)
+        logfire.info(
+            f"Получатели рассылки №{job.id} подготовлены: {total} "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+        await self._update_progress(db, job.id)
+
+    async def _iter_recipients(self, stream_db, job: BroadcastJob) -> AsyncIterator[List[int]]:
+        """Порции получателей: из подготовленного файла или запросом к базе"""
+        if job.audience_path and await aiofiles.os.path.exists(job.audience_path):
+            async for user_ids in read_audience(
+                job.audience_path, after_id=job.cursor, batch_size=self.batch_size
+            ):
+                yield user_ids
+            return
+        async for user_ids in UserRepository.stream_active_user_ids(
+            stream_db,
+            after_id=job.cursor,
+            batch_size=self.batch_size,
+            **BroadcastService.segment_filters(job.segment),
+        ):
+            yield user_ids
+
+    async def _process_job(self, job: BroadcastJob) -> None:
+        if job.cursor:
+            logfire.info(f"Продолжаем рассылку №{job.id} после пользователя {job.cursor}")
+        last_progress = time.monotonic()
+        async with get_db_session() as db:
+            async with get_db_session() as stream_db:
+                async for user_ids in self._iter_recipients(stream_db, job):
+                    status = await BroadcastRepository.get_status(db, job.id)
+                    if status != BroadcastStatus.RUNNING.value:
+                        logfire.info(f"Рассылка №{job.id} остановлена: {status}")
+                        if status == BroadcastStatus.CANCELLED.value:
+                            await remove_audience(job.audience_path)
+                        await self._update_progress(db, job.id)
+                        return
+                    sent, errors = await self._send_batch(db, job.text, user_ids)
+                    await BroadcastRepository.advance_cursor(
+                        db, job.id, user_ids[-1], sent, errors
+                    )
+                    if time.monotonic() - last_progress >= self.progress_interval:
+                        await self._update_progress(db, job.id)
+                        last_progress = time.monotonic()
+
+            # Все получатели обработаны: пауза, поставленная после последней
+            # порции, не оставляет отправленную рассылку на паузе
+            finished = await BroadcastRepository.change_status(
+                db,
+                job.id,
+                BroadcastStatus.DONE,
+                [BroadcastStatus.RUNNING, BroadcastStatus.PAUSED],
+            )
+            await remove_audience(job.audience_path)
+            await self._update_progress(db, job.id)
+            if finished:
+                logfire.info(f"Рассылка №{job.id} завершена")
+            else:
+                status = await BroadcastRepository.get_status(db, job.id)
+                logfire.info(f"Рассылка №{job.id} остановлена после отправки: {status}")
+
+    async def _send_batch(self, db, text: str, user_ids: List[int]) -> Tuple[int, int]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        unreachable: Dict[str, List[int]] = {}
+
+        async def send(user_id: int) -> bool:
+            async with semaphore:
+                try:
+                    try:
+                        await self.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+                    except TelegramRetryAfter as e:
+                        # Отправки уже приостановлены планировщиком, повторяем один раз
+                        await asyncio.sleep(e.retry_after)
+                        await self.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+                    return True
+                except Exception as e:
+                    reason = get_unreachable_reason(e)
+                    if reason:
+                        unreachable.setdefault(reason, []).append(user_id)
+                    else:
+                        logfire.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+        for reason, reason_user_ids in unreachable.items():
+            await UserService.mark_unreachable(db, reason_user_ids, reason)
+        sent = sum(results)
+        return sent, len(results) - sent
+
+    async def _update_progress(self, db, job_id: int) -> None:
+        """Обновить сообщение администратору о прогрессе"""
+        job = await BroadcastRepository.get(db, job_id)
+        if not job:
+            return
+        await db.refresh(job)
+        if not job.progress_message_id:
+            return
+        try:
+            with request_priority(RequestPriority.INTERACTIVE):
+                await self.bot.edit_message_text(
+                    chat_id=job.progress_chat_id,
+                    message_id=job.progress_message_id,
+                    text=BroadcastService.format_progress(job),
+                    reply_markup=get_broadcast_control_keyboard(job.id, job.status),
+                    parse_mode="HTML",
+                )
+        except Exception:
+            pass  # Игнорируем ошибки редактирования сообщения о прогрессе
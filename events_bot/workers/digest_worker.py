@@ -0,0 +1,160 @@
+"""
+Рассылка дайджестов уведомлений
+
+В режиме дайджеста (NOTIFICATION_DIGEST_WINDOW_MINUTES > 0) одобренные посты
+собираются в дайджест, а по окончании окна каждый подписчик получает одно
+сообщение со всеми подходящими ему мероприятиями. Получатели определяются
+одним сгруппированным запросом на окно, прогресс сохраняется по ID
+пользователя, поэтому после перезапуска рассылка продолжается. Окна
+отсчитываются от времени закрытия последнего дайджеста в базе, так что
+перезапуск не сдвигает расписание.
+"""
+
+import asyncio
+import os
+from datetime import timedelta
+from typing import Dict, List
+import logfire
+from aiogram import Bot
+from events_bot.bot.utils import get_db_session
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
+from events_bot.bot.keyboards.notification_keyboard import get_digest_keyboard
+from events_bot.database.models import NotificationDigest, Post, utc_now
+from events_bot.database.repositories import DigestRepository
+from events_bot.database.services import NotificationService
+from events_bot.database.services.notification_service import (
+    NOTIFICATION_DIGEST_WINDOW_MINUTES,
+)
+
+
+class NotificationDigestWorker:
+    """Периодическая рассылка дайджестов"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        window_minutes: int | None = None,
+        batch_size: int | None = None,
+    ):
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            window_minutes: Длина окна сбора постов в минутах (0 — режим выключен)
+            batch_size: Размер порции строк между сохранениями прогресса
+        """
+        self.bot = bot
+        self.window_minutes = (
+            window_minutes if window_minutes is not None else NOTIFICATION_DIGEST_WINDOW_MINUTES
+        )
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+
+    async def run(self) -> None:
+        """Рассылать дайджесты по окончании каждого окна"""
+        if self.window_minutes <= 0:
+            return
+        logfire.info(f"📬 Режим дайджеста: окно {self.window_minutes} мин.")
+        with request_priority(RequestPriority.NOTIFICATION):
+            await self._digest_loop()
+
+    async def _digest_loop(self) -> None:
+        # Досылаем дайджесты, прерванные перезапуском
+        await self._send_pending()
+        while True:
+            try:
+                delay = await self._seconds_until_close()
+            except Exception as e:
+                logfire.error(f"Ошибка расчёта окна дайджеста: {e}")
+                delay = self.window_minutes * 60
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                async with get_db_session() as db:
+                    await DigestRepository.close_collecting(db)
+            except Exception as e:
+                logfire.error(f"Ошибка закрытия окна дайджеста: {e}")
+            await self._send_pending()
+
+    async def _seconds_until_close(self) -> float:
+        """Сколько секунд осталось до закрытия текущего окна.
+
+        Окна идут подряд от времени закрытия последнего дайджеста. Собираемый
+        дайджест закрывается на первой границе окна после своего создания;
+        если эта граница прошла за время простоя, он закрывается сразу.
+        """
+        async with get_db_session() as db:
+            last_closed_at = await DigestRepository.get_last_closed_at(db)
+            collecting = await DigestRepository.get_collecting(db)
+        window = timedelta(minutes=self.window_minutes)
+        now = utc_now()
+        opened_at = collecting.created_at if collecting else now
+        anchor = last_closed_at or opened_at
+        close_at = anchor + window
+        if close_at <= opened_at:
+            close_at = anchor + ((opened_at - anchor) // window + 1) * window
+        return (close_at - now).total_seconds()
+
+    async def _send_pending(self) -> None:
+        try:
+            async with get_db_session() as db:
+                digests = await DigestRepository.get_pending(db)
+            for digest in digests:
+                await self._send_digest(digest)
+        except Exception as e:
+            logfire.error(f"Ошибка рассылки дайджеста: {e}")
+
+    async def _send_digest(self, digest: NotificationDigest) -> None:
+        async with get_db_session() as db:
+            posts = await DigestRepository.get_digest_posts(db, digest.id)
+            if not posts:
+                await DigestRepository.mark_done(db, digest.id)
+                return
+            posts_by_id = {post.id: post for post in posts}
+            # Порядок постов в сообщении — по дате события
+            position = {post.id: index for index, post in enumerate(posts)}
+            keyboard = get_digest_keyboard()
+            cursor = digest.cursor
+            total_success = total_errors = 0
+
+            async def flush(user_posts: Dict[int, List[Post]]) -> None:
+                nonlocal cursor, total_success, total_errors
+                for user_post_list in user_posts.values():
+                    user_post_list.sort(key=lambda post: position[post.id])
+                success, errors = await NotificationService.send_digest(
+                    self.bot, user_posts, db, keyboard
+                )
+                total_success += success
+                total_errors += errors
+                cursor = max(user_posts)
+                await DigestRepository.advance_cursor(db, digest.id, cursor)
+
+            pending: Dict[int, List[Post]] = {}
+            async with get_db_session() as stream_db:
+                async for pairs in DigestRepository.stream_recipient_posts(
+                    stream_db, digest.id, after_id=cursor, batch_size=self.batch_size
+                ):
+                    for user_id, post_id in pairs:
+                        if post_id in posts_by_id:
+                            pending.setdefault(user_id, []).append(posts_by_id[post_id])
+                    # Посты последнего пользователя порции могут продолжиться
+                    # в следующей порции, поэтому его откладываем
+                    last_user_id = pairs[-1][0]
+                    ready = {
+                        user_id: user_posts
+                        for user_id, user_posts in pending.items()
+                        if user_id != last_user_id
+                    }
+                    if ready:
+                        await flush(ready)
+                        pending = {
+                            user_id: user_posts
+                            for user_id, user_posts in pending.items()
+                            if user_id == last_user_id
+                        }
+            if pending:
+                await flush(pending)
+
+            await DigestRepository.mark_done(db, digest.id)
+            logfire.info(
+                f"Дайджест {digest.id} ({len(posts)} постов) разослан: "
+                f"успех={total_success}, ошибок={total_errors}"
+            )
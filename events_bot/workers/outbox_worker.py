@@ -0,0 +1,264 @@
+"""
+Пул обработчиков очереди уведомлений (outbox)
+
+Одобрение поста только ставит задание в таблицу notification_outbox,
+а рассылку выполняют обработчики из этого пула. Прогресс (cursor)
+сохраняется после каждой порции получателей, поэтому после перезапуска
+рассылка продолжается с места остановки. Пул можно запустить внутри бота
+или отдельным процессом: python -m events_bot.workers.outbox_worker
+
+Пул принадлежит приложению, а не обработчику модерации: колбэк модератора
+только ставит задание и будит пул через notify(), а итоги рассылки пул
+сам отправляет в группу модерации. При шардах отправки задание после
+раскладки получает статус dispatched, и итоги подводятся, когда шарды
+обработают все его отправки.
+"""
+
+import asyncio
+import os
+import socket
+import logfire
+from aiogram import Bot
+from events_bot.bot.utils import get_db_session
+from events_bot.database import dispose_engine
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
+from events_bot.database.models import SendStatus
+from events_bot.database.repositories import OutboxRepository, SendQueueRepository
+from events_bot.database.services import NotificationService, PostService
+from events_bot.database.services.notification_service import DeliveryStats
+from .sender import get_bot_rate_limit, get_sender_shards
+
+
+class NotificationOutboxWorkerPool:
+    """Пул асинхронных обработчиков очереди уведомлений"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int | None = None,
+        batch_size: int | None = None,
+        poll_interval: float | None = None,
+        lease_seconds: int | None = None,
+        max_attempts: int | None = None,
+        sender_shards: int | None = None,
+    ):
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            workers: Количество параллельных обработчиков
+            batch_size: Размер порции получателей между сохранениями прогресса
+            poll_interval: Пауза между опросами пустой очереди (секунды)
+            lease_seconds: Через сколько секунд без прогресса задание
+                считается брошенным и может быть захвачено заново
+            max_attempts: Сколько раз повторять задание после ошибок
+            sender_shards: Если больше 0, сообщения не отправляются, а
+                раскладываются по шардам для events_bot.workers.sender
+        """
+        self.bot = bot
+        self.workers = workers if workers is not None else int(os.getenv("NOTIFICATION_WORKERS", 2))
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+        self.poll_interval = poll_interval or float(os.getenv("NOTIFICATION_POLL_INTERVAL", 5))
+        self.lease_seconds = lease_seconds or int(os.getenv("NOTIFICATION_LEASE_SECONDS", 300))
+        self.max_attempts = max_attempts or int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", 5))
+        self.sender_shards = (
+            sender_shards if sender_shards is not None else get_sender_shards()
+        )
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Разбудить обработчики: в очереди появилось новое задание"""
+        self._wakeup.set()
+
+    async def _wait_for_jobs(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def run(self) -> None:
+        """Запустить все обработчики и работать до отмены"""
+        if self.workers <= 0:
+            logfire.info("Обработчики очереди уведомлений отключены")
+            return
+        logfire.info(f"📨 Запускаем {self.workers} обработчиков очереди уведомлений")
+        loops = [self._worker_loop(f"{self._worker_prefix}:{n}") for n in range(self.workers)]
+        if self.sender_shards:
+            loops.append(self._dispatched_loop())
+        await asyncio.gather(*loops)
+
+    async def _worker_loop(self, worker_id: str) -> None:
+        with request_priority(RequestPriority.NOTIFICATION):
+            await self._poll_jobs(worker_id)
+
+    async def _poll_jobs(self, worker_id: str) -> None:
+        while True:
+            try:
+                async with get_db_session() as db:
+                    jobs = await OutboxRepository.claim(
+                        db, worker_id, limit=1, lease_seconds=self.lease_seconds
+                    )
+                if not jobs:
+                    await self._wait_for_jobs()
+                    continue
+                for job in jobs:
+                    await self._process_job(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logfire.error(f"Ошибка обработчика очереди уведомлений {worker_id}: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _process_job(self, job, worker_id: str) -> None:
+        async with get_db_session() as db:
+            try:
+                post = await PostService.get_post_by_id(db, job.post_id)
+                if not post:
+                    logfire.warning(f"Пост {job.post_id} удалён, задание {job.id} закрыто")
+                    await OutboxRepository.ack(db, job.id, worker_id)
+                    return
+
+                # Текст, клавиатура и картинка готовятся один раз на всю рассылку
+                payload = await NotificationService.build_post_notification_payload(post, db)
+                cursor = job.cursor
+                # Разбивка ошибок и задержки до перезапуска не сохраняются,
+                # учитываются только их количества
+                stats = DeliveryStats(
+                    sent=job.sent_count,
+                    failures={"before_restart": job.error_count} if job.error_count else {},
+                )
+                if cursor:
+                    logfire.info(f"Продолжаем рассылку о посте {post.id} после пользователя {cursor}")
+                # Получатели читаются серверным курсором в отдельной сессии:
+                # в основной сессии между порциями фиксируется прогресс
+                async with get_db_session() as stream_db:
+                    async for user_ids in NotificationService.iter_recipient_ids(
+                        stream_db, post, after_id=cursor, batch_size=self.batch_size
+                    ):
+                        if self.sender_shards:
+                            await SendQueueRepository.enqueue_batch(
+                                db, post.id, user_ids, self.sender_shards
+                            )
+                            cursor = user_ids[-1]
+                            if not await OutboxRepository.advance_cursor(
+                                db, job.id, worker_id, cursor
+                            ):
+                                logfire.warning(f"Задание {job.id} перехвачено другим обработчиком")
+                                return
+                            continue
+                        success, errors = await NotificationService.send_post_notification(
+                            bot=self.bot,
+                            post=post,
+                            user_ids=user_ids,
+                            db=db,
+                            payload=payload,
+                            stats=stats,
+                        )
+                        cursor = user_ids[-1]
+                        if not await OutboxRepository.advance_cursor(
+                            db, job.id, worker_id, cursor, sent=success, errors=errors
+                        ):
+                            logfire.warning(f"Задание {job.id} перехвачено другим обработчиком")
+                            return
+
+                if self.sender_shards:
+                    await OutboxRepository.mark_dispatched(db, job.id, worker_id)
+                    logfire.info(f"Рассылка о посте {post.id} передана шардам отправки")
+                    return
+                await OutboxRepository.ack(db, job.id, worker_id)
+                logfire.info(
+                    f"Рассылка о посте {post.id} завершена: успех={stats.sent}, ошибок={stats.failed}"
+                )
+                await NotificationService.record_delivery(
+                    db, post, stats, started_at=job.created_at
+                )
+                await self._report_completion(post, stats.sent, stats.failed)
+            except Exception as e:
+                logfire.error(f"Ошибка рассылки задания {job.id}: {e}")
+                await db.rollback()
+                await OutboxRepository.release_with_error(
+                    db, job.id, worker_id, str(e), self.max_attempts
+                )
+
+    async def _dispatched_loop(self) -> None:
+        """Подводить итоги рассылок, которые выполняют шарды отправки"""
+        while True:
+            try:
+                async with get_db_session() as db:
+                    for job in await OutboxRepository.get_dispatched(db):
+                        await self._complete_dispatched(db, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logfire.error(f"Ошибка подведения итогов рассылок шардов: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _complete_dispatched(self, db, job) -> None:
+        counts = await SendQueueRepository.get_post_progress(db, job.post_id)
+        if counts.get(SendStatus.PENDING.value):
+            return
+        # Итоги подводит один процесс: тот, кто первым закрыл задание
+        if not await OutboxRepository.complete_dispatched(db, job.id):
+            return
+        post = await PostService.get_post_by_id(db, job.post_id)
+        if post:
+            # Задержки, повторы и классы ошибок шарды сохраняют в строках отправок
+            stats = await NotificationService.build_sharded_delivery_stats(db, job.post_id)
+            logfire.info(
+                f"Рассылка о посте {post.id} шардами завершена: "
+                f"успех={stats.sent}, ошибок={stats.failed}"
+            )
+            await NotificationService.record_delivery(db, post, stats, started_at=job.created_at)
+            await self._report_completion(post, stats.sent, stats.failed)
+        await SendQueueRepository.prune_post(db, job.post_id)
+
+    async def _report_completion(self, post, sent: int, errors: int) -> None:
+        """Отправить итоги рассылки в группу модерации"""
+        moderation_group_id = os.getenv("MODERATION_GROUP_ID")
+        if not moderation_group_id:
+            return
+        try:
+            with request_priority(RequestPriority.MODERATION):
+                await self.bot.send_message(
+                    chat_id=moderation_group_id,
+                    text=(
+                        f"📨 Рассылка о мероприятии «{post.title}» (ID {post.id}) завершена\n"
+                        f"Доставлено: {sent}\n"
+                        f"Ошибок: {errors}"
+                    ),
+                )
+        except Exception as e:
+            logfire.warning(f"Не удалось отправить итоги рассылки в группу модерации: {e}")
+
+
+async def main() -> None:
+    """Запуск пула обработчиков отдельным процессом"""
+    from events_bot.bot.request_scheduler import OutboundScheduler, ScheduledRequestMiddleware
+    from events_bot.database.subscription_index import subscription_index
+    from events_bot.storage import file_storage
+    from events_bot.utils.telegram import get_bot_token
+
+    token = get_bot_token()
+    if not token:
+        logfire.error("❌ Error: bot token not set (BOT_TOKEN/TELEGRAM_BOT_TOKEN)")
+        return
+
+    bot = Bot(token=token)
+    bot.session.middleware(
+        ScheduledRequestMiddleware(OutboundScheduler(rate_per_second=get_bot_rate_limit()))
+    )
+    await file_storage.start()
+    try:
+        await asyncio.gather(
+            NotificationOutboxWorkerPool(bot).run(),
+            subscription_index.run(get_db_session),
+        )
+    finally:
+        await bot.session.close()
+        await file_storage.close()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
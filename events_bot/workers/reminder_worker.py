@@ -0,0 +1,164 @@
+"""
+Напоминания о мероприятиях из избранного
+
+За REMINDER_HOURS_BEFORE часов до начала события всем, кто добавил пост
+в избранное, приходит напоминание. Раз в REMINDER_SCAN_MINUTES минут
+посты, чьё напоминание наступит до следующего просмотра, выбираются
+диапазонным запросом по индексу posts.event_at и попадают в очередь
+таймеров в памяти (heapq). Таблица likes целиком не просматривается:
+получатели читаются по индексу likes.post_id в момент отправки.
+
+Посты удаляются за 2 часа до начала события, поэтому напоминание
+должно приходить раньше.
+
+Отправка напоминания захватывается с арендой (NOTIFICATION_LEASE_SECONDS),
+а после каждой порции получателей сохраняется прогресс (cursor), как в
+очереди уведомлений. Отправленным напоминание отмечается только после
+рассылки всем получателям; если процесс упал посреди отправки, пост
+снова попадёт в очередь таймеров и рассылка продолжится с места остановки.
+"""
+
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+from typing import List, Set, Tuple
+import logfire
+from aiogram import Bot
+from events_bot.bot.utils import get_db_session
+from events_bot.bot.request_scheduler import RequestPriority, request_priority
+from events_bot.database.repositories import LikeRepository, PostRepository
+from events_bot.database.services import NotificationService, PostService
+from events_bot.utils.msk_time import get_current_msk_time
+
+# За сколько часов до начала события посты удаляются (см. delete_expired_posts)
+POST_EXPIRY_HOURS_BEFORE_EVENT = 2
+
+
+class EventReminderWorker:
+    """Очередь таймеров напоминаний о мероприятиях"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        hours_before: float | None = None,
+        scan_minutes: float | None = None,
+        batch_size: int | None = None,
+        lease_seconds: int | None = None,
+    ):
+        """
+        Args:
+            bot: Экземпляр бота для отправки сообщений
+            hours_before: За сколько часов до события напоминать (0 — выключено)
+            scan_minutes: Период пополнения очереди таймеров из базы
+            batch_size: Размер порции получателей
+            lease_seconds: Через сколько секунд без прогресса отправка
+                напоминания считается брошенной и может быть захвачена заново
+        """
+        self.bot = bot
+        self.hours_before = (
+            hours_before
+            if hours_before is not None
+            else float(os.getenv("REMINDER_HOURS_BEFORE", 24))
+        )
+        self.scan_minutes = scan_minutes or float(os.getenv("REMINDER_SCAN_MINUTES", 10))
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+        self.lease_seconds = lease_seconds or int(os.getenv("NOTIFICATION_LEASE_SECONDS", 300))
+        # (момент напоминания по МСК, ID поста)
+        self._timers: List[Tuple[datetime, int]] = []
+        self._scheduled: Set[int] = set()
+
+    async def run(self) -> None:
+        """Пополнять очередь таймеров и отправлять наступившие напоминания"""
+        if self.hours_before <= 0:
+            return
+        if self.hours_before <= POST_EXPIRY_HOURS_BEFORE_EVENT:
+            logfire.warning(
+                f"REMINDER_HOURS_BEFORE={self.hours_before}: посты удаляются за "
+                f"{POST_EXPIRY_HOURS_BEFORE_EVENT} ч до события, напоминания отключены"
+            )
+            return
+        logfire.info(f"⏰ Напоминания о мероприятиях за {self.hours_before} ч")
+        with request_priority(RequestPriority.NOTIFICATION):
+            await self._timer_loop()
+
+    async def _timer_loop(self) -> None:
+        next_scan = datetime.min
+        while True:
+            now = get_current_msk_time()
+            if now >= next_scan:
+                try:
+                    await self._refill(now)
+                except Exception as e:
+                    logfire.error(f"Ошибка пополнения очереди напоминаний: {e}")
+                next_scan = now + timedelta(minutes=self.scan_minutes)
+
+            while self._timers and self._timers[0][0] <= now:
+                _, post_id = heapq.heappop(self._timers)
+                self._scheduled.discard(post_id)
+                try:
+                    await self._send_reminder(post_id)
+                except Exception as e:
+                    logfire.error(f"Ошибка отправки напоминаний о посте {post_id}: {e}")
+
+            wake_at = next_scan
+            if self._timers:
+                wake_at = min(wake_at, self._timers[0][0])
+            now = get_current_msk_time()
+            await asyncio.sleep(max((wake_at - now).total_seconds(), 0))
+
+    async def _refill(self, now: datetime) -> None:
+        """Добавить в очередь посты, напоминание о которых наступит до следующего просмотра.
+
+        Нижняя граница — события, которые ещё не удалены; напоминания,
+        пропущенные из-за перезапуска, отправляются сразу.
+        """
+        lead = timedelta(hours=self.hours_before)
+        async with get_db_session() as db:
+            rows = await PostRepository.get_posts_to_remind(
+                db,
+                event_from=now + timedelta(hours=POST_EXPIRY_HOURS_BEFORE_EVENT),
+                event_to=now + lead + timedelta(minutes=self.scan_minutes),
+            )
+        added = 0
+        for post_id, event_at in rows:
+            if post_id in self._scheduled:
+                continue
+            heapq.heappush(self._timers, (event_at - lead, post_id))
+            self._scheduled.add(post_id)
+            added += 1
+        if added:
+            logfire.info(f"В очередь напоминаний добавлено постов: {added}")
+
+    async def _send_reminder(self, post_id: int) -> None:
+        async with get_db_session() as db:
+            # Захват не даёт двум обработчикам рассылать одно напоминание;
+            # отметка об отправке ставится только после рассылки всем
+            claimed, cursor = await PostRepository.claim_reminder(
+                db, post_id, self.lease_seconds
+            )
+            if not claimed:
+                return
+            post = await PostService.get_post_by_id(db, post_id)
+            if not post or not post.is_published:
+                await PostRepository.mark_reminder_sent(db, post_id)
+                return
+            if cursor:
+                logfire.info(f"Продолжаем напоминания о посте {post_id} после пользователя {cursor}")
+            payload = await NotificationService.build_event_reminder_payload(post, db)
+            total_success = total_errors = 0
+            async with get_db_session() as stream_db:
+                async for user_ids in LikeRepository.stream_liker_ids(
+                    stream_db, post_id, after_id=cursor, batch_size=self.batch_size
+                ):
+                    success, errors = await NotificationService.send_post_notification(
+                        bot=self.bot, post=post, user_ids=user_ids, db=db, payload=payload
+                    )
+                    await PostRepository.advance_reminder_cursor(db, post_id, user_ids[-1])
+                    total_success += success
+                    total_errors += errors
+            await PostRepository.mark_reminder_sent(db, post_id)
+            logfire.info(
+                f"Напоминания о посте {post_id} отправлены: "
+                f"успех={total_success}, ошибок={total_errors}"
+            )
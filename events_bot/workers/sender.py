@@ -0,0 +1,295 @@
+"""
+Шардированные процессы отправки уведомлений
+
+При NOTIFICATION_SENDER_SHARDS > 0 обработчики очереди notification_outbox
+не отправляют сообщения сами, а раскладывают их по шардам (chat_id % N)
+в таблицу notification_sends. Каждый шард обслуживает ровно один процесс:
+
+    python -m events_bot.workers.sender            # все шарды, по процессу на шард
+    python -m events_bot.workers.sender --shard 2  # только шард 2
+
+Сообщения одного чата всегда попадают в один шард и отправляются по
+порядку. Шарды берут токены из общего token bucket в таблице sender_state
+со скоростью SENDER_RATE_LIMIT, поэтому простаивающий шард не занимает
+долю лимита. Эта часть вычитается из TELEGRAM_RATE_LIMIT процесса бота,
+чтобы вместе они не превышали лимит Telegram. RetryAfter от Telegram,
+полученный любым шардом, через sender_state приостанавливает все шарды.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import logfire
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from events_bot.bot.utils import get_db_session
+from events_bot.database import dispose_engine
+from events_bot.bot.request_scheduler import (
+    DEFAULT_SHARES,
+    OutboundScheduler,
+    RequestPriority,
+    ScheduledRequestMiddleware,
+    request_priority,
+)
+from events_bot.database.models import Post, SendStatus, utc_now
+from events_bot.database.repositories import SendQueueRepository
+from events_bot.database.services import NotificationService, PostService, UserService
+from events_bot.database.services.notification_service import NotificationPayload
+from events_bot.utils.telegram import get_unreachable_reason
+
+# Как часто шард перечитывает общую паузу из базы (секунды)
+PAUSE_SYNC_INTERVAL = 1.0
+# Сколько подготовленных уведомлений держать в памяти процесса
+PAYLOAD_CACHE_SIZE = 64
+# Сколько токенов общего лимита шард берёт из базы за раз
+BUDGET_LEASE_SIZE = 5
+
+
+def get_sender_shards() -> int:
+    """Количество шардов отправки (NOTIFICATION_SENDER_SHARDS; 0 — шарды не используются).
+
+    Читается при вызове, а не при импорте модуля.
+    """
+    return int(os.getenv("NOTIFICATION_SENDER_SHARDS", 0))
+
+
+def get_sender_rate_limit() -> float:
+    """Общий лимит всех шардов отправки, сообщений в секунду (SENDER_RATE_LIMIT).
+
+    По умолчанию — доля уведомлений в TELEGRAM_RATE_LIMIT.
+    """
+    total = float(os.getenv("TELEGRAM_RATE_LIMIT", 25))
+    default = total * DEFAULT_SHARES[RequestPriority.NOTIFICATION]
+    return min(float(os.getenv("SENDER_RATE_LIMIT", default)), total)
+
+
+def get_bot_rate_limit() -> float | None:
+    """Лимит процесса бота: при шардах из TELEGRAM_RATE_LIMIT вычитается лимит шардов.
+
+    None — шарды не используются, планировщик берёт весь TELEGRAM_RATE_LIMIT.
+    """
+    if get_sender_shards() <= 0:
+        return None
+    total = float(os.getenv("TELEGRAM_RATE_LIMIT", 25))
+    # Ответы пользователям не останавливаются, даже если шардам отдан весь лимит
+    return max(total - get_sender_rate_limit(), 1.0)
+
+
+class ShardedNotificationSender:
+    """Отправитель уведомлений одного шарда"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        scheduler: OutboundScheduler,
+        shard: int,
+        batch_size: int | None = None,
+        poll_interval: float | None = None,
+        rate: float | None = None,
+    ):
+        """
+        Args:
+            bot: Бот, чья сессия пропускает запросы через scheduler
+            scheduler: Планировщик отправок процесса
+            shard: Номер обслуживаемого шарда
+            batch_size: Сколько отправок читать из очереди за раз
+            poll_interval: Пауза между опросами пустой очереди (секунды)
+            rate: Общий лимит всех шардов, сообщений в секунду
+        """
+        self.bot = bot
+        self.scheduler = scheduler
+        self.shard = shard
+        self.rate = rate or get_sender_rate_limit()
+        # Токены общего лимита, уже взятые из базы
+        self._budget = 0
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_BATCH_SIZE", 100))
+        self.poll_interval = poll_interval or float(os.getenv("NOTIFICATION_POLL_INTERVAL", 5))
+        self._payloads: Dict[int, Tuple[Optional[Post], Optional[NotificationPayload]]] = {}
+        self._pause_synced_at = 0.0
+
+    async def run(self) -> None:
+        """Обрабатывать очередь шарда до отмены"""
+        logfire.info(f"📤 Шард отправки {self.shard} запущен")
+        with request_priority(RequestPriority.NOTIFICATION):
+            while True:
+                try:
+                    async with get_db_session() as db:
+                        await self._sync_pause(db)
+                        sends = await SendQueueRepository.get_pending(
+                            db, self.shard, self.batch_size
+                        )
+                        if not sends:
+                            await asyncio.sleep(self.poll_interval)
+                            continue
+                        await self._process(db, sends)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logfire.error(f"Ошибка шарда отправки {self.shard}: {e}")
+                    await asyncio.sleep(self.poll_interval)
+
+    async def _sync_pause(self, db) -> None:
+        """Применить общую паузу, выставленную любым из шардов"""
+        if time.monotonic() - self._pause_synced_at < PAUSE_SYNC_INTERVAL:
+            return
+        self._pause_synced_at = time.monotonic()
+        paused_until = await SendQueueRepository.get_paused_until(db)
+        if paused_until:
+            remaining = (paused_until - utc_now()).total_seconds()
+            if remaining > 0:
+                self.scheduler.pause(remaining)
+
+    async def _take_budget(self, db) -> None:
+        """Дождаться токена общего лимита шардов (берутся из базы порциями)"""
+        while self._budget <= 0:
+            self._budget = await SendQueueRepository.take_tokens(
+                db, BUDGET_LEASE_SIZE, self.rate, capacity=max(self.rate, BUDGET_LEASE_SIZE)
+            )
+            if self._budget <= 0:
+                await asyncio.sleep(BUDGET_LEASE_SIZE / self.rate)
+        self._budget -= 1
+
+    async def _get_payload(
+        self, db, post_id: int
+    ) -> Tuple[Optional[Post], Optional[NotificationPayload]]:
+        if post_id not in self._payloads:
+            if len(self._payloads) >= PAYLOAD_CACHE_SIZE:
+                self._payloads.clear()
+            post = await PostService.get_post_by_id(db, post_id)
+            payload = (
+                await NotificationService.build_post_notification_payload(post, db)
+                if post and post.is_published
+                else None
+            )
+            self._payloads[post_id] = (post, payload)
+        return self._payloads[post_id]
+
+    @staticmethod
+    def _result(
+        send, status: SendStatus, latency: float | None = None, error_class: str | None = None
+    ) -> Dict[str, Any]:
+        """Значения строки отправки для итогов рассылки"""
+        return {
+            "id": send.id,
+            "status": status.value,
+            "attempts": send.attempts + 1,
+            "sent_at": utc_now(),
+            "latency_ms": latency * 1000 if latency is not None else None,
+            "error_class": error_class,
+        }
+
+    async def _process(self, db, sends) -> None:
+        results: List[Dict[str, Any]] = []
+        unreachable: Dict[str, List[int]] = {}
+        for send in sends:
+            post, payload = await self._get_payload(db, send.post_id)
+            if payload is None:
+                # Пост удалён или снят с публикации
+                results.append(self._result(send, SendStatus.FAILED, error_class="post_unavailable"))
+                continue
+            await self._sync_pause(db)
+            await self._take_budget(db)
+            started = time.monotonic()
+            try:
+                message = await NotificationService.send_payload(self.bot, send.chat_id, payload)
+            except TelegramRetryAfter as e:
+                # Остальные отправки порции остаются в очереди в прежнем порядке,
+                # отложенная попытка учитывается как повтор
+                await SendQueueRepository.record_retry(db, send.id)
+                await SendQueueRepository.pause_until(
+                    db, utc_now() + timedelta(seconds=e.retry_after)
+                )
+                break
+            except Exception as e:
+                reason = get_unreachable_reason(e)
+                results.append(
+                    self._result(send, SendStatus.FAILED, error_class=reason or type(e).__name__)
+                )
+                if reason:
+                    unreachable.setdefault(reason, []).append(send.chat_id)
+                else:
+                    logfire.warning(f"Ошибка отправки уведомления пользователю {send.chat_id}: {e}")
+                continue
+            results.append(self._result(send, SendStatus.DONE, time.monotonic() - started))
+            # Картинка загружается в Telegram один раз, дальше рассылаем по file_id
+            if payload.photo and not isinstance(payload.photo, str):
+                payload.photo = await PostService.remember_telegram_file_id(
+                    db, post, message
+                ) or payload.photo
+
+        await SendQueueRepository.record_results(db, results)
+        for reason, chat_ids in unreachable.items():
+            await UserService.mark_unreachable(db, chat_ids, reason)
+        if results:
+            done = sum(result["status"] == SendStatus.DONE.value for result in results)
+            logfire.info(
+                f"Шард {self.shard}: отправлено {done}, ошибок {len(results) - done}"
+            )
+
+
+async def run_shard(shard: int, shards: int) -> None:
+    """Запустить отправитель одного шарда"""
+    from events_bot.storage import file_storage
+    from events_bot.utils.telegram import get_bot_token
+
+    token = get_bot_token()
+    if not token:
+        logfire.error("❌ Error: bot token not set (BOT_TOKEN/TELEGRAM_BOT_TOKEN)")
+        return
+
+    # Темп задаёт общий token bucket; планировщик процесса лишь не даёт
+    # одному шарду превысить весь лимит шардов и применяет паузы
+    rate = get_sender_rate_limit()
+    scheduler = OutboundScheduler(rate_per_second=rate)
+    bot = Bot(token=token)
+    bot.session.middleware(ScheduledRequestMiddleware(scheduler))
+    await file_storage.start()
+    try:
+        await ShardedNotificationSender(bot, scheduler, shard, rate=rate).run()
+    finally:
+        await bot.session.close()
+        await file_storage.close()
+        await dispose_engine()
+
+
+def _run_shard_process(shard: int, shards: int) -> None:
+    asyncio.run(run_shard(shard, shards))
+
+
+def main() -> None:
+    """Точка входа: один шард или все шарды отдельными процессами"""
+    parser = argparse.ArgumentParser(description="Шардированная отправка уведомлений")
+    parser.add_argument("--shards", type=int, default=get_sender_shards())
+    parser.add_argument("--shard", type=int, default=None)
+    args = parser.parse_args()
+    if args.shards <= 0:
+        parser.error("укажите --shards или NOTIFICATION_SENDER_SHARDS больше 0")
+
+    if args.shard is not None:
+        if not 0 <= args.shard < args.shards:
+            parser.error(f"--shard должен быть от 0 до {args.shards - 1}")
+        _run_shard_process(args.shard, args.shards)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=_run_shard_process, args=(shard, args.shards), name=f"sender-{shard}"
+        )
+        for shard in range(args.shards)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
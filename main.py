@@ -12,10 +12,9 @@ except Exception:
     pass
 
 import asyncio
-import os
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from events_bot.database import init_database
+from events_bot.database import dispose_engine, init_database
 from events_bot.bot.handlers import (
     register_start_handlers,
     register_user_handlers,
@@ -24,8 +23,21 @@ from events_bot.bot.handlers import (
     register_moderation_handlers,
     register_feed_handlers,
 )
-from events_bot.bot.middleware import DatabaseMiddleware
+from events_bot.bot.middleware import ActivityMiddleware, DatabaseMiddleware
+from events_bot.bot.request_scheduler import OutboundScheduler, ScheduledRequestMiddleware
 from events_bot.database.services.post_service import PostService
+from events_bot.database.subscription_index import subscription_index
+from events_bot.bot.utils import get_db_session
+from events_bot.storage import file_storage
+from events_bot.storage.image_processing import image_processor
+from events_bot.utils.telegram import get_bot_token
+from events_bot.workers import (
+    NotificationOutboxWorkerPool,
+    NotificationDigestWorker,
+    EventReminderWorker,
+    BroadcastWorker,
+)
+from events_bot.workers.sender import get_bot_rate_limit
 from loguru import logger
 
 logger.configure(handlers=[logfire.loguru_handler()])
@@ -33,22 +45,10 @@ logger.configure(handlers=[logfire.loguru_handler()])
 
 async def main() -> None:
     """Главная функция бота"""
-    # Подхват переменных окружения из .env, если есть
-    try:
-        from dotenv import load_dotenv
-
-        load_dotenv()
-    except Exception:
-        pass
+    # Переменные из .env подхватываются при импорте пакета events_bot
 
     # Получаем токен из переменных окружения
-    # Поддерживаем несколько названий переменной для удобства:
-    # BOT_TOKEN (основное), TELEGRAM_BOT_TOKEN и TG_BOT_TOKEN (альтернативы)
-    token = (
-        os.getenv("BOT_TOKEN")
-        or os.getenv("TELEGRAM_BOT_TOKEN")
-        or os.getenv("TG_BOT_TOKEN")
-    )
+    token = get_bot_token()
     if not token:
         logfire.error(
             "❌ Error: bot token not set (BOT_TOKEN/TELEGRAM_BOT_TOKEN)"
@@ -61,12 +61,28 @@ async def main() -> None:
 
     # Создаем бота и диспетчер
     bot = Bot(token=token)
+    # Все исходящие отправки делят общий лимит Telegram по классам приоритета;
+    # при шардах отправки их часть лимита из него вычитается
+    bot.session.middleware(
+        ScheduledRequestMiddleware(OutboundScheduler(rate_per_second=get_bot_rate_limit()))
+    )
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
     # Подключаем middleware для базы данных
     dp.message.middleware(DatabaseMiddleware())
     dp.callback_query.middleware(DatabaseMiddleware())
+    # Время последней активности — для сегментов рассылок
+    activity_middleware = ActivityMiddleware()
+    dp.message.middleware(activity_middleware)
+    dp.callback_query.middleware(activity_middleware)
+
+    # Пул рассылки уведомлений принадлежит приложению; обработчики получают
+    # его через аргумент notification_pool, чтобы будить после одобрения поста
+    notification_pool = NotificationOutboxWorkerPool(bot)
+    dp["notification_pool"] = notification_pool
+    broadcast_worker = BroadcastWorker(bot)
+    dp["broadcast_worker"] = broadcast_worker
 
     # Регистрируем обработчики
     register_start_handlers(dp)
@@ -76,45 +92,51 @@ async def main() -> None:
     register_moderation_handlers(dp)
     register_feed_handlers(dp)
 
+    # Соединения с хранилищем файлов открываются один раз на процесс
+    # Процессы обработки картинок запускаются до фоновых задач
+    image_processor.start()
+    await file_storage.start()
+
     logfire.info("🤖 Bot started...")
 
     async def cleanup_expired_posts_task() -> None:
-        from events_bot.bot.utils import get_db_session
-        from events_bot.storage import file_storage
-
         while True:
             try:
                 async with get_db_session() as db:
-                    # Сначала собираем информацию о просроченных постах
-                    # (id, image_id)
-                    expired = await PostService.get_expired_posts_info(db)
+                    # Посты удаляются вместе со ссылками на свои картинки
                     deleted = await PostService.delete_expired_posts(db)
                     if deleted:
                         logfire.info(
                             f"🧹 Удалено просроченных постов: {deleted}"
                         )
-                        # Удаляем связанные файлы из хранилища
-                        for row in expired:
-                            image_id = row.get("image_id")
-                            if image_id:
-                                try:
-                                    await file_storage.delete_file(image_id)
-                                except Exception:
-                                    pass
+                    # Удаляем файлы, на которые не осталось ссылок
+                    # (одна картинка может использоваться в нескольких постах)
+                    try:
+                        await PostService.collect_unreferenced_media(db)
+                    except Exception as e:
+                        logfire.error(f"Ошибка удаления файлов без ссылок: {e}")
             except Exception as e:
                 logfire.error(f"Ошибка фоновой очистки постов: {e}")
             await asyncio.sleep(60 * 10)
 
     try:
-        # Запускаем бота и фоновую очистку одновременно
+        # Запускаем бота, фоновую очистку и рассылку уведомлений одновременно
         await asyncio.gather(
             dp.start_polling(bot),
             cleanup_expired_posts_task(),
+            notification_pool.run(),
+            NotificationDigestWorker(bot).run(),
+            EventReminderWorker(bot).run(),
+            broadcast_worker.run(),
+            subscription_index.run(get_db_session),
         )
     except KeyboardInterrupt:
         logfire.info("🛑 Bot stopped")
     finally:
         await bot.session.close()
+        await file_storage.close()
+        await dispose_engine()
+        image_processor.shutdown()
 
 
 if __name__ == "__main__":
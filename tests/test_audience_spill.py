@@ -0,0 +1,61 @@
+from typing import AsyncIterator, List
+
+import pytest
+
+from events_bot.utils.audience_spill import read_audience, remove_audience, write_audience
+
+
+async def _batches(*batches: List[int]) -> AsyncIterator[List[int]]:
+    for batch in batches:
+        yield batch
+
+
+async def _read(path: str, **kwargs) -> List[List[int]]:
+    return [batch async for batch in read_audience(path, **kwargs)]
+
+
+@pytest.fixture
+async def audience(tmp_path):
+    path = str(tmp_path / "audience" / "broadcast_1.ids")
+    await write_audience(path, _batches([2, 4, 6], [8, 10], [12]))
+    return path
+
+
+async def test_write_audience_returns_count(tmp_path):
+    path = str(tmp_path / "broadcast_2.ids")
+
+    assert await write_audience(path, _batches([1, 2], [3])) == 3
+    assert not (tmp_path / "broadcast_2.ids.tmp").exists()
+
+
+async def test_read_audience_in_batches(audience):
+    assert await _read(audience, batch_size=4) == [[2, 4, 6, 8], [10, 12]]
+
+
+@pytest.mark.parametrize(
+    "after_id, expected",
+    [
+        (0, [2, 4, 6, 8, 10, 12]),
+        (1, [2, 4, 6, 8, 10, 12]),
+        # Отправка продолжается после последнего обработанного ID
+        (6, [8, 10, 12]),
+        (7, [8, 10, 12]),
+        (12, []),
+        (100, []),
+    ],
+)
+async def test_read_audience_resumes_after_id(audience, after_id, expected):
+    batches = await _read(audience, after_id=after_id, batch_size=2)
+
+    assert [user_id for batch in batches for user_id in batch] == expected
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+async def test_remove_audience(audience):
+    await remove_audience(audience)
+    # Повторное удаление и пустой путь не считаются ошибкой
+    await remove_audience(audience)
+    await remove_audience(None)
+
+    with pytest.raises(FileNotFoundError):
+        await _read(audience)
@@ -0,0 +1,36 @@
+import pytest
+
+from events_bot.utils.bitmask import MAX_MASK_ID, ids_to_mask, mask_to_ids
+
+
+@pytest.mark.parametrize(
+    "ids, mask",
+    [
+        ([], 0),
+        ([1], 0b1),
+        ([1, 3], 0b101),
+        ([3, 1, 3], 0b101),
+        ([MAX_MASK_ID], 1 << (MAX_MASK_ID - 1)),
+    ],
+)
+def test_ids_to_mask(ids, mask):
+    assert ids_to_mask(ids) == mask
+
+
+def test_mask_to_ids_reverses_ids_to_mask():
+    ids = [1, 2, 17, 40, MAX_MASK_ID]
+
+    assert mask_to_ids(ids_to_mask(ids)) == ids
+
+
+def test_full_mask_fits_signed_bigint():
+    mask = ids_to_mask(range(1, MAX_MASK_ID + 1))
+
+    assert mask == 2**63 - 1
+    assert mask_to_ids(mask) == list(range(1, MAX_MASK_ID + 1))
+
+
+@pytest.mark.parametrize("ids", [[MAX_MASK_ID + 1], [1, 2, MAX_MASK_ID + 1], [0], [-1]])
+def test_ids_outside_mask_give_none(ids):
+    # Такие подписки ищутся по таблицам связей, а не по маске
+    assert ids_to_mask(ids) is None
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+# Пакет бота импортируется первым, как в main.py: сервисы и обработчики
+# импортируют друг друга
+import events_bot.bot  # noqa: F401
+from events_bot.database.models import utc_now
+from events_bot.database.services import BroadcastService
+from events_bot.utils.msk_time import MSK_OFFSET
+
+
+def test_parse_segment_without_options():
+    assert BroadcastService.parse_segment("Всем привет") == (None, "Всем привет")
+
+
+def test_parse_segment_options():
+    segment, text = BroadcastService.parse_segment("city=1,2 category=3 Концерт в субботу")
+
+    assert segment == {"city_ids": [1, 2], "category_ids": [3]}
+    assert text == "Концерт в субботу"
+
+
+def test_parse_segment_active_days():
+    segment, text = BroadcastService.parse_segment("active=30 Новости")
+
+    active_since = datetime.fromisoformat(segment["active_since"])
+    assert active_since == pytest.approx(utc_now() - timedelta(days=30), abs=timedelta(seconds=5))
+    assert text == "Новости"
+
+
+def test_parse_segment_stops_at_first_text_word():
+    segment, text = BroadcastService.parse_segment("city=1 цена=100 city=2")
+
+    assert segment == {"city_ids": [1]}
+    assert text == "цена=100 city=2"
+
+
+def test_parse_segment_rejects_non_numeric_value():
+    with pytest.raises(ValueError):
+        BroadcastService.parse_segment("city=one Текст")
+
+
+def test_parse_schedule_converts_msk_to_utc():
+    scheduled_msk = (utc_now() + MSK_OFFSET + timedelta(days=1)).replace(second=0, microsecond=0)
+
+    scheduled_at, text = BroadcastService.parse_schedule(
+        f"{scheduled_msk:%d.%m.%Y %H:%M} city=1 Концерт"
+    )
+
+    assert scheduled_at == scheduled_msk - timedelta(hours=3)
+    assert text == "city=1 Концерт"
+
+
+def test_parse_schedule_without_text():
+    scheduled_msk = utc_now() + MSK_OFFSET + timedelta(days=1)
+
+    _, text = BroadcastService.parse_schedule(f"{scheduled_msk:%d.%m.%Y %H:%M}")
+
+    assert text == ""
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "25.12.2030",
+        "2030-12-25 10:00 Текст",
+        "25.12.2030 25:00 Текст",
+        # Время по Москве, которое уже прошло
+        f"{utc_now() + MSK_OFFSET - timedelta(minutes=5):%d.%m.%Y %H:%M} Текст",
+    ],
+)
+def test_parse_schedule_rejects_invalid_time(text):
+    with pytest.raises(ValueError):
+        BroadcastService.parse_schedule(text)
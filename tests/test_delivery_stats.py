@@ -0,0 +1,47 @@
+import pytest
+
+# Пакет бота импортируется первым, как в main.py: сервисы и обработчики
+# импортируют друг друга
+import events_bot.bot  # noqa: F401
+from events_bot.database.services.notification_service import DeliveryStats
+
+
+def _stats(latencies) -> DeliveryStats:
+    stats = DeliveryStats()
+    for latency in latencies:
+        stats.record_sent(latency)
+    return stats
+
+
+def test_percentile_without_sends():
+    assert DeliveryStats().latency_percentile(50) is None
+
+
+@pytest.mark.parametrize(
+    "percent, expected",
+    [(0, 0.1), (10, 0.1), (50, 0.5), (51, 0.6), (90, 0.9), (95, 1.0), (100, 1.0)],
+)
+def test_percentile_nearest_rank(percent, expected):
+    # Задержки добавлены не по порядку: перцентиль считается по сортировке
+    stats = _stats([0.7, 0.1, 1.0, 0.4, 0.9, 0.2, 0.6, 0.3, 0.8, 0.5])
+
+    assert stats.latency_percentile(percent) == expected
+
+
+def test_percentile_of_single_send():
+    stats = _stats([0.25])
+
+    assert stats.latency_percentile(50) == 0.25
+    assert stats.latency_percentile(99) == 0.25
+
+
+def test_failures_do_not_affect_latency():
+    stats = _stats([0.2, 0.4])
+    stats.record_failure("blocked")
+    stats.record_failure("blocked")
+    stats.record_failure("TelegramBadRequest")
+
+    assert stats.latency_percentile(100) == 0.4
+    assert stats.failures == {"blocked": 2, "TelegramBadRequest": 1}
+    assert (stats.sent, stats.failed, stats.audience_size) == (2, 3, 5)
+    assert stats.first_send_at <= stats.last_send_at
@@ -0,0 +1,138 @@
+import asyncio
+from collections import Counter
+from typing import List, Tuple
+
+import pytest
+
+from events_bot.bot.request_scheduler import OutboundScheduler, RequestPriority
+
+
+class FakeClock:
+    """Время, которое идёт только во время ожидания планировщика"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        # Сначала даём выполниться уже получившим слот запросам
+        await asyncio.sleep(0)
+        self.now += seconds
+
+
+async def _grant(
+    scheduler: OutboundScheduler, clock: FakeClock, priority: RequestPriority
+) -> float:
+    """Дождаться слота и вернуть время его выдачи"""
+    await scheduler.acquire(priority)
+    return clock.now
+
+
+async def _grant_order(
+    scheduler: OutboundScheduler,
+    clock: FakeClock,
+    priorities: List[RequestPriority],
+    per_class: int,
+    grants: int,
+) -> List[Tuple[float, RequestPriority]]:
+    """Поставить per_class запросов каждого класса и вернуть первые grants выдач"""
+    order: List[Tuple[float, RequestPriority]] = []
+    done = asyncio.Event()
+
+    async def request(priority: RequestPriority) -> None:
+        order.append((await _grant(scheduler, clock, priority), priority))
+        if len(order) == grants:
+            done.set()
+
+    tasks = [
+        asyncio.create_task(request(priority))
+        for _ in range(per_class)
+        for priority in priorities
+    ]
+    await asyncio.wait_for(done.wait(), timeout=5)
+    for task in tasks:
+        task.cancel()
+    scheduler._task.cancel()
+    await asyncio.gather(*tasks, scheduler._task, return_exceptions=True)
+    return order[:grants]
+
+
+@pytest.mark.parametrize(
+    "shares",
+    [
+        {
+            RequestPriority.INTERACTIVE: 0.4,
+            RequestPriority.MODERATION: 0.1,
+            RequestPriority.NOTIFICATION: 0.3,
+            RequestPriority.BROADCAST: 0.2,
+        },
+        {
+            RequestPriority.INTERACTIVE: 0.1,
+            RequestPriority.MODERATION: 0.1,
+            RequestPriority.NOTIFICATION: 0.5,
+            RequestPriority.BROADCAST: 0.3,
+        },
+    ],
+)
+async def test_grants_follow_shares_when_all_classes_are_busy(shares):
+    clock = FakeClock()
+    scheduler = OutboundScheduler(
+        rate_per_second=10, shares=shares, burst=1, clock=clock, sleep=clock.sleep
+    )
+
+    order = await _grant_order(
+        scheduler, clock, list(RequestPriority), per_class=500, grants=1000
+    )
+
+    counts = Counter(priority for _, priority in order)
+    for priority, share in shares.items():
+        assert counts[priority] == pytest.approx(1000 * share, abs=2)
+    # Выдача идёт с общим лимитом: 1000 слотов по 0.1 с
+    assert order[-1][0] == pytest.approx(99.9)
+
+
+async def test_idle_classes_share_goes_to_busy_ones():
+    clock = FakeClock()
+    scheduler = OutboundScheduler(rate_per_second=10, burst=1, clock=clock, sleep=clock.sleep)
+
+    order = await _grant_order(
+        scheduler,
+        clock,
+        [RequestPriority.NOTIFICATION, RequestPriority.BROADCAST],
+        per_class=500,
+        grants=500,
+    )
+
+    counts = Counter(priority for _, priority in order)
+    # Доли 0.3 и 0.2 делят весь лимит в отношении 3:2
+    assert counts[RequestPriority.NOTIFICATION] == pytest.approx(300, abs=2)
+    assert counts[RequestPriority.BROADCAST] == pytest.approx(200, abs=2)
+
+
+async def test_pause_delays_grants():
+    clock = FakeClock()
+    scheduler = OutboundScheduler(rate_per_second=10, burst=1, clock=clock, sleep=clock.sleep)
+    scheduler.pause(30)
+
+    granted_at = await _grant(scheduler, clock, RequestPriority.INTERACTIVE)
+
+    assert granted_at == pytest.approx(30)
+    scheduler._task.cancel()
+
+
+async def test_cancelled_request_does_not_use_slot():
+    clock = FakeClock()
+    scheduler = OutboundScheduler(rate_per_second=10, burst=1, clock=clock, sleep=clock.sleep)
+    first, cancelled, last = (
+        asyncio.create_task(_grant(scheduler, clock, RequestPriority.BROADCAST))
+        for _ in range(3)
+    )
+    # Все три запроса в очереди, планировщик ещё не выдал ни одного слота
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await first == pytest.approx(0)
+    assert await last == pytest.approx(0.1)
+    scheduler._task.cancel()
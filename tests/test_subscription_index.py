@@ -0,0 +1,48 @@
+from array import array
+
+import pytest
+
+from events_bot.database.subscription_index import _intersect_sorted, _union_sorted
+
+
+def _ids(*values: int) -> array:
+    return array("q", values)
+
+
+@pytest.mark.parametrize(
+    "arrays, expected",
+    [
+        ([], []),
+        ([_ids(), _ids()], []),
+        ([_ids(1, 5, 9)], [1, 5, 9]),
+        ([_ids(1, 5, 9), _ids()], [1, 5, 9]),
+        ([_ids(1, 5, 9), _ids(2, 5, 10), _ids(5, 9, 11)], [1, 2, 5, 9, 10, 11]),
+    ],
+)
+def test_union_sorted(arrays, expected):
+    assert list(_union_sorted(arrays)) == expected
+
+
+@pytest.mark.parametrize(
+    "smaller, larger, excluded, expected",
+    [
+        (_ids(), _ids(1, 2), _ids(), []),
+        (_ids(2, 4, 6), _ids(1, 2, 3, 4, 5), _ids(), [2, 4]),
+        # Порядок аргументов не важен: перебирается меньший массив
+        (_ids(1, 2, 3, 4, 5), _ids(2, 4, 6), _ids(), [2, 4]),
+        (_ids(2, 4, 6), _ids(1, 2, 3, 4, 5, 6), _ids(4), [2, 6]),
+        (_ids(7, 8), _ids(1, 2, 3), _ids(), []),
+    ],
+)
+def test_intersect_sorted(smaller, larger, excluded, expected):
+    assert list(_intersect_sorted(smaller, larger, excluded)) == expected
+
+
+def test_intersect_sorted_matches_set_intersection():
+    city = array("q", range(0, 3000, 3))
+    category = array("q", range(0, 3000, 5))
+    blocked = array("q", range(0, 3000, 7))
+
+    result = _intersect_sorted(city, category, blocked)
+
+    assert list(result) == sorted((set(city) & set(category)) - set(blocked))